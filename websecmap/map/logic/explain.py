@@ -43,7 +43,7 @@ def get_all_explains(country, organization_type, limit=0):
         UrlGenericScan.objects.all()
         .filter(
             comply_or_explain_is_explained=True,
-            is_the_latest_scan=True,
+            latest_scan__isnull=False,
         )
         .annotate(
             n_urls=Count(
@@ -65,7 +65,7 @@ def get_all_explains(country, organization_type, limit=0):
         EndpointGenericScan.objects.all()
         .filter(
             comply_or_explain_is_explained=True,
-            is_the_latest_scan=True,
+            latest_scan__isnull=False,
         )
         .annotate(
             n_urls=Count(
@@ -133,10 +133,10 @@ def get_explanation(type, scan):
 def get_scan(scan_id: int, scan_type: str) -> Union[EndpointGenericScan, UrlGenericScan, None]:
 
     if scan_type in ENDPOINT_SCAN_TYPES:
-        return EndpointGenericScan.objects.all().filter(pk=scan_id, type=scan_type, is_the_latest_scan=True).first()
+        return EndpointGenericScan.objects.all().filter(pk=scan_id, type=scan_type, latest_scan__isnull=False).first()
 
     if scan_type in URL_SCAN_TYPES:
-        return UrlGenericScan.objects.all().filter(pk=scan_id, type=scan_type, is_the_latest_scan=True).first()
+        return UrlGenericScan.objects.all().filter(pk=scan_id, type=scan_type, latest_scan__isnull=False).first()
 
     return None
 
@@ -27,7 +27,7 @@ def get_all_latest_scans(country, organization_type):
         scans = (
             EndpointGenericScan.objects.filter(
                 type=scan_type,
-                is_the_latest_scan=True,
+                latest_scan__isnull=False,
             )
             .annotate(
                 n_urls=Count(
@@ -72,7 +72,7 @@ def get_all_latest_scans(country, organization_type):
         scans = (
             UrlGenericScan.objects.filter(
                 type=scan_type,
-                is_the_latest_scan=True,
+                latest_scan__isnull=False,
             )
             .annotate(
                 n_urls=Count(
@@ -1,5 +1,6 @@
+import logging
 from datetime import datetime
-from typing import List
+from typing import Any, Dict, List
 
 import pytz
 import simplejson as json
@@ -8,8 +9,11 @@ from django.db import connection
 from django.utils.text import slugify
 
 from websecmap.map.logic.map_defaults import get_country, get_organization_type, remark
-from websecmap.map.models import MapDataCache
+from websecmap.map.models import MapDataCache, OrganizationReport, OrganizationReportSeverity
 from websecmap.scanners import ENDPOINT_SCAN_TYPES, URL_SCAN_TYPES
+from websecmap.scanners.scanner.utils import in_chunks
+
+log = logging.getLogger(__package__)
 
 
 def get_reports_by_ids(ids):
@@ -78,59 +82,66 @@ def get_map_data(
     if hasattr(country, "code"):
         country = country.code
 
-    when = datetime.now(pytz.utc) - relativedelta(days=int(days_back))
+    cached = get_cached_map_data(country, organization_type, days_back, [map_layer(displayed_issue)])
 
-    desired_url_scans = []
-    desired_endpoint_scans = []
+    if cached:
+        return cached
 
-    if displayed_issue in URL_SCAN_TYPES:
-        desired_url_scans += [displayed_issue]
+    return get_map_data_layers(country, organization_type, days_back, [displayed_issue])[displayed_issue]
 
-    if displayed_issue in ENDPOINT_SCAN_TYPES:
-        desired_endpoint_scans += [displayed_issue]
 
+def map_layer(displayed_issue: str = None) -> str:
     # fallback if no data is "all", which is the default.
-    if not desired_url_scans and not desired_endpoint_scans:
-        desired_url_scans = URL_SCAN_TYPES
-        desired_endpoint_scans = ENDPOINT_SCAN_TYPES
+    if displayed_issue in URL_SCAN_TYPES or displayed_issue in ENDPOINT_SCAN_TYPES:
+        return displayed_issue
 
-        filters = ["all"]
-    else:
-        filters = desired_url_scans + desired_endpoint_scans
-
-    cached = get_cached_map_data(country, organization_type, days_back, filters)
+    return "all"
 
-    if cached:
-        return cached
 
+def get_map_data_layers(
+    country: str = "NL", organization_type: str = "municipality", days_back: int = 0, displayed_issues: List[str] = None
+) -> Dict[str, Dict]:
     """
-    Returns a json structure containing all current map data.
+    Returns a json structure containing all current map data, for every displayed issue (filter layer).
     This is used by the client to render the map.
 
     Renditions of this dataset might be pushed to gitlab automatically.
 
-    :return:
+    All layers are made from the same organization reports, which are retrieved only once. The severities per layer
+    come from the precomputed OrganizationReportSeverity, so there is no need to parse the calculations.
+
+    :return: displayed issue -> map data
     """
+    if not displayed_issues:
+        displayed_issues = ["all"]
+
+    if hasattr(country, "code"):
+        country = country.code
 
-    data = {
-        "metadata": {
-            "type": "FeatureCollection",
-            "render_date": datetime.now(pytz.utc).isoformat(),
-            "data_from_time": when.isoformat(),
-            "remark": remark,
-            "applied filter": displayed_issue,
-            "layer": organization_type,
-            "country": country,
-        },
-        "crs": {"type": "name", "properties": {"name": "urn:ogc:def:crs:OGC:1.3:CRS84"}},
-        "features": [],
+    when = datetime.now(pytz.utc) - relativedelta(days=int(days_back))
+
+    datasets = {
+        displayed_issue: {
+            "metadata": {
+                "type": "FeatureCollection",
+                "render_date": datetime.now(pytz.utc).isoformat(),
+                "data_from_time": when.isoformat(),
+                "remark": remark,
+                "applied filter": displayed_issue,
+                "layer": organization_type,
+                "country": country,
+            },
+            "crs": {"type": "name", "properties": {"name": "urn:ogc:def:crs:OGC:1.3:CRS84"}},
+            "features": [],
+        }
+        for displayed_issue in displayed_issues
     }
 
     cursor = connection.cursor()
 
     # Sept 2019: MySQL has an issue with mediumtext fields. When joined, and the query is not optimized, the
     # result will take 2 minutes to complete. Would you not select the mediumtext field, the query finishes in a second.
-    # That is why there are two queries to retrieve map data from the database.
+    # That is why the calculation is not retrieved: the severities are stored separately.
     sql = """
         SELECT
             map_organizationreport.low,
@@ -224,97 +235,25 @@ def get_map_data(
     cursor.execute(sql)
     rows = cursor.fetchall()
 
-    needed_reports = []
-    for i in rows:
-        # prevent sequence item 0: expected str instance, int found
-        needed_reports.append(str(i[6]))
-
-    reports = get_reports_by_ids(needed_reports)
+    severities = get_organization_report_severities(
+        [i[6] for i in rows], [map_layer(displayed_issue) for displayed_issue in displayed_issues]
+    )
 
     # todo: http://www.gadzmo.com/python/using-pythons-dictcursor-in-mysql-to-return-a-dict-with-keys/
     # unfortunately numbered results are used. There is no decent solution for sqlite and the column to dict
     # translation is somewhat hairy. A rawquery would probably be better if possible.
 
     for i in rows:
-
-        # Here we're going to do something stupid: to rebuild the high, medium, low classifcation based on scan_types
-        # It's somewhat insane to do it like this, but it's also insane to keep adding columns for each vulnerability
-        # that's added to the system. This solution will be a bit slow, but given the caching and such it wouldn't
-        # hurt too much.
-        # Also: we've optimized for calculation in the past, but we're not even using it until now. So that part of
-        # this code is pretty optimized :)
-        # This feature is created to give an instant overview of what issues are where. This will lead more clicks to
-        # reports.
-        # The caching of this url should be decent, as people want to click fast. Filtering on the client
-        # would be possible using the calculation field. Perhaps that should be the way. Yet then we have to do
-        # filtering with javascript, which is error prone (todo: this will be done in the future, as it responds faster
-        # but it will also mean an enormous increase of data sent to the client.)
-        # It's actually reasonably fast.
-        high, medium, low, ok = 0, 0, 0, 0
-
-        calculation = json.loads(reports[i[6]])
-
-        for url in calculation["organization"]["urls"]:
-            for url_rating in url["ratings"]:
-                if (
-                    url_rating["type"] in desired_url_scans
-                    and url_rating.get("comply_or_explain_valid_at_time_of_report", False) is False
-                ):
-                    high += url_rating["high"]
-                    medium += url_rating["medium"]
-                    low += url_rating["low"]
-                    ok += url_rating["ok"]
-
-            # it's possible the url doesn't have ratings.
-            for endpoint in url["endpoints"]:
-                for endpoint_rating in endpoint["ratings"]:
-                    if (
-                        endpoint_rating["type"] in desired_endpoint_scans
-                        and endpoint_rating.get("comply_or_explain_valid_at_time_of_report", False) is False
-                    ):
-                        high += endpoint_rating["high"]
-                        medium += endpoint_rating["medium"]
-                        low += endpoint_rating["low"]
-                        ok += endpoint_rating["ok"]
-
-        # figure out if red, orange or green:
-        # #162, only make things red if there is a critical issue.
-        # removed json parsing of the calculation. This saves time.
-        # no contents, no endpoint ever mentioned in any url (which is a standard attribute)
-        if "total_urls" not in calculation["organization"] or not calculation["organization"]["total_urls"]:
-            severity = "unknown"
-        else:
-            # things have to be OK in order to be colored. If it's all empty... then it's not OK.
-            severity = "high" if high else "medium" if medium else "low" if low else "good" if ok else "unknown"
-
-        dataset = {
-            "type": "Feature",
-            "properties": {
-                "organization_id": i[5],
-                "organization_type": i[2],
-                "organization_name": i[1],
-                "organization_name_lowercase": i[1].lower(),
-                "organization_slug": slugify(i[1]),
-                "additional_keywords": extract_domains(calculation),
-                "high": high,
-                "medium": medium,
-                "low": low,
-                "data_from": when.isoformat(),
-                "severity": severity,
-                "total_urls": i[11],  # = 100%
-                "high_urls": i[12],
-                "medium_urls": i[13],
-                "low_urls": i[14],
-            },
-            "geometry": {
-                # the coordinate ID makes it easy to check if the geometry has changed shape/location.
-                "coordinate_id": i[15],
-                "type": i[4],
-                # Sometimes the data is a string, sometimes it's a list. The admin
-                # interface might influence this. The fastest would be to use a string, instead of
-                # loading some json.
-                "coordinates": proper_coordinate(i[3], i[4]),
-            },
+        report_severities = severities[i[6]]
+
+        geometry = {
+            # the coordinate ID makes it easy to check if the geometry has changed shape/location.
+            "coordinate_id": i[15],
+            "type": i[4],
+            # Sometimes the data is a string, sometimes it's a list. The admin
+            # interface might influence this. The fastest would be to use a string, instead of
+            # loading some json.
+            "coordinates": proper_coordinate(i[3], i[4]),
         }
 
         # calculate some statistics, so the frontends do not have to...
@@ -324,23 +263,165 @@ def get_map_data(
             high_urls = int(i[12])
             medium_urls = int(i[13])
             low_urls = int(i[14])
-            dataset["properties"]["percentages"] = {
+            percentages = {
                 "high_urls": round(high_urls / total_urls, 2) * 100,
                 "medium_urls": round(medium_urls / total_urls, 2) * 100,
                 "low_urls": round(low_urls / total_urls, 2) * 100,
                 "good_urls": round((total_urls - (high_urls + medium_urls + low_urls)) / total_urls, 2) * 100,
             }
         else:
-            dataset["properties"]["percentages"] = {
+            percentages = {
                 "high_urls": 0,
                 "medium_urls": 0,
                 "low_urls": 0,
                 "good_urls": 0,
             }
 
-        data["features"].append(dataset)
+        additional_keywords = domain_keywords(report_severities["all"]["urls"])
+
+        for displayed_issue in displayed_issues:
+            # This feature is created to give an instant overview of what issues are where. This will lead more
+            # clicks to reports. The high, medium, low classification per scan type is stored when the organization
+            # report is created, see summarize_organization_report.
+            severity = report_severities.get(map_layer(displayed_issue), empty_severity())
+            high, medium, low, ok = severity["high"], severity["medium"], severity["low"], severity["ok"]
+
+            # figure out if red, orange or green:
+            # #162, only make things red if there is a critical issue.
+            # removed json parsing of the calculation. This saves time.
+            # no contents, no endpoint ever mentioned in any url (which is a standard attribute)
+            if not i[11]:
+                severity = "unknown"
+            else:
+                # things have to be OK in order to be colored. If it's all empty... then it's not OK.
+                severity = "high" if high else "medium" if medium else "low" if low else "good" if ok else "unknown"
+
+            dataset = {
+                "type": "Feature",
+                "properties": {
+                    "organization_id": i[5],
+                    "organization_type": i[2],
+                    "organization_name": i[1],
+                    "organization_name_lowercase": i[1].lower(),
+                    "organization_slug": slugify(i[1]),
+                    "additional_keywords": additional_keywords,
+                    "high": high,
+                    "medium": medium,
+                    "low": low,
+                    "data_from": when.isoformat(),
+                    "severity": severity,
+                    "total_urls": i[11],  # = 100%
+                    "high_urls": i[12],
+                    "medium_urls": i[13],
+                    "low_urls": i[14],
+                    "percentages": percentages,
+                },
+                "geometry": geometry,
+            }
+
+            datasets[displayed_issue]["features"].append(dataset)
+
+    return datasets
+
+
+def get_organization_report_severities(report_ids: List[int], scan_types: List[str]) -> Dict[int, Dict[str, Dict]]:
+    """
+    Retrieves the stored severities of organization reports, for the given scan types and "all".
+
+    Reports that were created before the severities were stored are summarized from their calculation. These
+    summaries are stored, so older reports are summarized only once.
+
+    :return: organization report id -> scan type -> severity
+    """
+    severities = {report_id: {} for report_id in report_ids}
+
+    for report_ids_chunk in in_chunks(list(report_ids), 500):
+        stored_severities = OrganizationReportSeverity.objects.all().filter(
+            organization_report__in=report_ids_chunk, scan_type__in=set(scan_types) | {"all"}
+        )
+        for stored_severity in stored_severities:
+            severities[stored_severity.organization_report_id][stored_severity.scan_type] = {
+                "high": stored_severity.high,
+                "medium": stored_severity.medium,
+                "low": stored_severity.low,
+                "ok": stored_severity.ok,
+                "urls": stored_severity.urls,
+            }
+
+    # the "all" severity is always stored, so when it's missing, nothing is stored for this report.
+    missing_reports = [str(report_id) for report_id, severity in severities.items() if "all" not in severity]
+    if missing_reports:
+        log.debug("Summarizing %s organization reports without stored severities." % len(missing_reports))
+        summaries = []
+        for report_id, calculation in get_reports_by_ids(missing_reports).items():
+            severities[report_id] = summarize_organization_report(json.loads(calculation))
+            summaries.extend(
+                OrganizationReportSeverity(organization_report_id=report_id, scan_type=scan_type, **severity)
+                for scan_type, severity in severities[report_id].items()
+            )
+        # another map might be assembled from the same reports at the same time
+        OrganizationReportSeverity.objects.bulk_create(summaries, batch_size=500, ignore_conflicts=True)
+
+    return severities
+
+
+def store_organization_report_severities(report: OrganizationReport):
+    """Stores the summary of a saved organization report, which is used to assemble the map."""
+    OrganizationReportSeverity.objects.bulk_create(
+        [
+            OrganizationReportSeverity(organization_report=report, scan_type=scan_type, **severity)
+            for scan_type, severity in summarize_organization_report(report.calculation).items()
+        ]
+    )
+
+
+def summarize_organization_report(calculation) -> Dict[str, Dict]:
+    """
+    Counts the high, medium, low and ok ratings per scan type in the calculation of an organization report, in a
+    single pass. The "all" scan type contains all url and endpoint scan types. Explained ratings are not counted.
+
+    :return: scan type -> {"high": int, "medium": int, "low": int, "ok": int, "urls": [str]}
+    """
+    severities = {"all": empty_severity()}
+
+    for url in calculation["organization"]["urls"]:
+        severities["all"]["urls"][url["url"]] = None
+
+        for url_rating in url["ratings"]:
+            if url_rating["type"] in URL_SCAN_TYPES:
+                add_rating_to_severities(severities, url_rating, url["url"])
+
+        # it's possible the url doesn't have ratings.
+        for endpoint in url["endpoints"]:
+            for endpoint_rating in endpoint["ratings"]:
+                if endpoint_rating["type"] in ENDPOINT_SCAN_TYPES:
+                    add_rating_to_severities(severities, endpoint_rating, url["url"])
+
+    # the urls are collected in a dict, which keeps them unique and in order without searching a list for every rating.
+    for severity in severities.values():
+        severity["urls"] = list(severity["urls"])
+
+    return severities
+
 
-    return data
+def add_rating_to_severities(severities: Dict[str, Dict], rating: Dict, url: str):
+    if rating.get("comply_or_explain_valid_at_time_of_report", False) is not False:
+        return
+
+    for scan_type in ["all", rating["type"]]:
+        severity = severities.setdefault(scan_type, empty_severity())
+        severity["high"] += rating["high"]
+        severity["medium"] += rating["medium"]
+        severity["low"] += rating["low"]
+        severity["ok"] += rating["ok"]
+
+        # all urls are already listed in the all severity
+        if scan_type != "all":
+            severity["urls"][url] = None
+
+
+def empty_severity() -> Dict[str, Any]:
+    return {"high": 0, "medium": 0, "low": 0, "ok": 0, "urls": {}}
 
 
 def proper_coordinate(coordinate, geojsontype):
@@ -372,10 +453,14 @@ def extract_domains(calculation):
     data websecmap example mysite testsite lan anothersite
     """
 
+    return domain_keywords([url["url"] for url in calculation["organization"]["urls"]])
+
+
+def domain_keywords(urls: List[str]) -> str:
     words = []
 
-    for url in calculation["organization"]["urls"]:
-        words += url["url"].split(".")
+    for url in urls:
+        words += url.split(".")
 
     # unique words only.
     words = list(set(words))
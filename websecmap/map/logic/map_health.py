@@ -1,10 +1,12 @@
 import logging
-from collections import defaultdict
 from datetime import datetime, timedelta
+from functools import lru_cache
+from itertools import chain
 from typing import Any, Dict, List, Tuple
 
 import dateutil.parser
 import pytz
+from django.db import transaction
 
 from websecmap.celery import app
 from websecmap.map.logic.map_defaults import get_country, get_organization_type
@@ -31,53 +33,138 @@ This grade gets stored inside a model related to a certain map, so the metric ca
 def update_map_health_reports(
     published_scan_types, days: int = 366, countries: List = None, organization_types: List = None
 ):
+    """
+    Creates a health report per day per map. The reports of each organization are retrieved once and classified
+    once. After that the days are walked in order, keeping track of the latest report of each organization.
+    """
+    now = datetime.now(pytz.utc)
+    moments = [now - timedelta(days=days_back) for days_back in reversed(range(0, days))]
+    if not moments:
+        return
+
+    # Outdated means outdated now, also for health reports of days in the past.
+    a_while_ago = now - timedelta(hours=OUTDATED_HOURS)
 
     map_configurations = filter_map_configs(countries=countries, organization_types=organization_types)
     for map_configuration in map_configurations:
         organization_type_id = map_configuration["organization_type"]
         country = map_configuration["country"]
+        configuration = retrieve(country, organization_type_id)
 
         organizations_on_map = Organization.objects.all().filter(country=country, type=organization_type_id)
-
-        for days_back in list(reversed(range(0, days))):
-            total_outdated = []
-            total_good = []
-            old_date = datetime.now(pytz.utc) - timedelta(days=days_back)
-
-            log.debug(f"Creating health report of {days_back} days back.")
-            for organization in organizations_on_map:
-                # log.debug(f"Creating health report of {organization} at {old_date}.")
-                latest_report = get_latest_report_of_organization(organization, old_date)
-                if not latest_report:
+        histories = [
+            get_health_history_of_organization(organization, moments[0], moments[-1], published_scan_types, a_while_ago)
+            for organization in organizations_on_map.values_list("id", flat=True)
+        ]
+        # per organization the position of the latest report in its history, -1 is before the first report.
+        latest = [-1] * len(histories)
+
+        # Update reports of a certain day. For example when the report for a single day is re-generated.
+        existing_health_reports = {}
+        for health_report in (
+            MapHealthReport.objects.all()
+            .filter(map_configuration=configuration, at_when__gte=moments[0].date(), at_when__lte=moments[-1].date())
+            .order_by("id")
+        ):
+            existing_health_reports.setdefault(health_report.at_when, health_report)
+
+        new_health_reports, updated_health_reports = [], []
+        for moment in moments:
+            log.debug(f"Creating health report of {moment.date()}.")
+            total_outdated, total_good = {}, {}
+            for index, history in enumerate(histories):
+                while latest[index] + 1 < len(history) and history[latest[index] + 1][0] <= moment:
+                    latest[index] += 1
+                if latest[index] < 0:
                     continue
 
-                # log.debug(f"The latest report of {organization} at {old_date} is from {latest_report.at_when}.")
-
-                ratings_outdated, ratings_good = split_ratings_between_good_and_bad(latest_report, OUTDATED_HOURS)
-                total_outdated += ratings_outdated
-                total_good += ratings_good
-
-            report = create_health_report(total_outdated, total_good, published_scan_types)
-            # Update reports of a certain day. For example when the report for a single day is re-generated.
-            hr = (
-                MapHealthReport.objects.all()
-                .filter(
-                    map_configuration=retrieve(country, organization_type_id),
-                    at_when__year=old_date.year,
-                    at_when__month=old_date.month,
-                    at_when__day=old_date.day,
-                )
-                .first()
-            )
-            if not hr:
+                at_when, outdated, good = history[latest[index]]
+                add_counts(total_outdated, outdated)
+                add_counts(total_good, good)
+
+            report = create_health_report_from_counts(total_outdated, total_good)
+            hr = existing_health_reports.get(moment.date())
+            if hr:
+                updated_health_reports.append(hr)
+            else:
                 hr = MapHealthReport()
-            hr.map_configuration = retrieve(country, organization_type_id)
-            hr.at_when = old_date
+                new_health_reports.append(hr)
+            hr.map_configuration = configuration
+            hr.at_when = moment.date()
             hr.percentage_up_to_date = report["percentage_up_to_date"]
             hr.percentage_out_of_date = report["percentage_out_of_date"]
             hr.outdate_period_in_hours = report["outdate_period_in_hours"]
             hr.detailed_report = report
-            hr.save()
+
+        with transaction.atomic():
+            MapHealthReport.objects.bulk_update(
+                updated_health_reports,
+                [
+                    "percentage_up_to_date",
+                    "percentage_out_of_date",
+                    "outdate_period_in_hours",
+                    "detailed_report",
+                ],
+                batch_size=500,
+            )
+            MapHealthReport.objects.bulk_create(new_health_reports, batch_size=500)
+
+
+def get_health_history_of_organization(
+    organization_id: int, first_moment: datetime, last_moment: datetime, published_scan_types, a_while_ago: datetime
+) -> List[Tuple[datetime, Dict[str, int], Dict[str, int]]]:
+    """
+    The reports that are the latest report of the organization at some point between the first and last moment, in
+    chronological order. Each as the moment of the report, with the amount of outdated and good ratings per scan type.
+    """
+    reports = []
+
+    previous_report = get_latest_report_of_organization(organization_id, first_moment)
+    if previous_report:
+        reports.append(previous_report)
+
+    reports = chain(
+        reports,
+        OrganizationReport.objects.all()
+        .filter(organization=organization_id, at_when__gt=first_moment, at_when__lte=last_moment)
+        .order_by("at_when")
+        .only("at_when", "calculation")
+        .iterator(),
+    )
+
+    return [
+        (report.at_when, *count_ratings_between_good_and_bad(report, published_scan_types, a_while_ago))
+        for report in reports
+    ]
+
+
+def count_ratings_between_good_and_bad(
+    report: OrganizationReport, published_scan_types, a_while_ago: datetime
+) -> Tuple[Dict[str, int], Dict[str, int]]:
+    """The amount of outdated and good ratings per published scan type, in the order of the ratings in the report."""
+    outdated, good = {}, {}
+    for url in report.calculation["organization"]["urls"]:
+        # endpoint ratings, then url ratings (dnssec etc), like split_ratings_between_good_and_bad
+        ratings = [rating for endpoint in url["endpoints"] for rating in endpoint["ratings"]] + url["ratings"]
+        for rating in ratings:
+            scan_type = rating.get("scan_type", "unknown")
+            if scan_type not in published_scan_types:
+                continue
+
+            counts = outdated if parse_last_scan(rating["last_scan"]) < a_while_ago else good
+            counts[scan_type] = counts.get(scan_type, 0) + 1
+    return outdated, good
+
+
+@lru_cache(maxsize=100000)
+def parse_last_scan(last_scan: str) -> datetime:
+    # The same rating is in all reports until it changes, so the same moments are parsed over and over.
+    return dateutil.parser.isoparse(last_scan)
+
+
+def add_counts(total: Dict[str, int], counts: Dict[str, int]):
+    for scan_type, amount in counts.items():
+        total[scan_type] = total.get(scan_type, 0) + amount
 
 
 def get_outdated_ratings(
@@ -189,9 +276,21 @@ def create_health_report(outdated: List, good: List, published_scan_types):
     # only include published metrics:
     outdated = [item for item in outdated if item.get("scan_type", "unknown") in published_scan_types]
     good = [item for item in good if item.get("scan_type", "unknown") in published_scan_types]
-    nr_total = len(good) + len(outdated)
-    nr_good = len(good)
-    nr_outdated = len(outdated)
+
+    outdated_per_scan_type, good_per_scan_type = {}, {}
+    for item in outdated:
+        add_counts(outdated_per_scan_type, {item.get("scan_type", "unknown"): 1})
+    for item in good:
+        add_counts(good_per_scan_type, {item.get("scan_type", "unknown"): 1})
+
+    return create_health_report_from_counts(outdated_per_scan_type, good_per_scan_type)
+
+
+def create_health_report_from_counts(outdated: Dict[str, int], good: Dict[str, int]):
+    """See create_health_report, with the amount of outdated and good published ratings per scan type."""
+    nr_good = sum(good.values())
+    nr_outdated = sum(outdated.values())
+    nr_total = nr_good + nr_outdated
     if not nr_total:
         return {
             "outdate_period_in_hours": OUTDATED_HOURS,
@@ -209,20 +308,10 @@ def create_health_report(outdated: List, good: List, published_scan_types):
         "amount_out_of_date": nr_outdated,
         "per_scan": [],
     }
-    failures_per_scan_type = defaultdict(dict)
-    for outdate in outdated:
-        if not failures_per_scan_type[outdate.get("scan_type", "unknown")]:
-            failures_per_scan_type[outdate.get("scan_type", "unknown")] = {"total": 0, "outdated": 0, "good": 0}
-        failures_per_scan_type[outdate.get("scan_type", "unknown")]["total"] += 1
-        failures_per_scan_type[outdate.get("scan_type", "unknown")]["outdated"] += 1
-    for outdate in good:
-        if not failures_per_scan_type[outdate.get("scan_type", "unknown")]:
-            failures_per_scan_type[outdate.get("scan_type", "unknown")] = {"total": 0, "outdated": 0, "good": 0}
-        failures_per_scan_type[outdate.get("scan_type", "unknown")]["total"] += 1
-        failures_per_scan_type[outdate.get("scan_type", "unknown")]["good"] += 1
-    for key in failures_per_scan_type.keys():
-        per_scan_good = failures_per_scan_type[key]["good"]
-        per_scan_outdated = failures_per_scan_type[key]["outdated"]
+    # scan types in the order they are first seen: outdated ones first
+    for key in list(outdated) + [scan_type for scan_type in good if scan_type not in outdated]:
+        per_scan_good = good.get(key, 0)
+        per_scan_outdated = outdated.get(key, 0)
         per_scan_total = per_scan_good + per_scan_outdated
         if not per_scan_total:
             continue
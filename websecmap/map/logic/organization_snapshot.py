@@ -0,0 +1,105 @@
+"""
+Snapshots of organization reports, one per organization per day. See OrganizationSnapshot.
+
+The latest report of organizations at or before a day is retrieved with a range condition:
+
+    map_organizationsnapshot.day <= '%(day)s'
+    AND (map_organizationsnapshot.until IS NULL OR map_organizationsnapshot.until > '%(day)s')
+
+Note that snapshots are made per day: the latest report at or before a moment is the latest report of that day.
+"""
+import logging
+from typing import List
+
+from django.db import transaction
+
+from websecmap.map.models import OrganizationReport, OrganizationSnapshot
+from websecmap.reporting.models import AllIssuesCombined, EndpointIssues, JudgedEndpoints, JudgedUrls, UrlIssues
+
+log = logging.getLogger(__package__)
+
+# The statistics that are copied from the organization report to the snapshot.
+SNAPSHOT_FIELDS = [
+    field.name
+    for statistics in [AllIssuesCombined, JudgedUrls, JudgedEndpoints, UrlIssues, EndpointIssues]
+    for field in statistics._meta.fields
+]
+
+
+def store_organization_snapshot(report: OrganizationReport):
+    """
+    Adds a saved organization report to the snapshots of its organization. Reports are usually added in
+    chronological order, but a report can also be placed between existing snapshots.
+    """
+    day = report.at_when.date()
+    statistics = {field: getattr(report, field) for field in SNAPSHOT_FIELDS}
+
+    with transaction.atomic():
+        snapshot = OrganizationSnapshot.objects.all().filter(organization=report.organization_id, day=day).first()
+        if snapshot:
+            # There already is a later report on this day, which is the one that is shown.
+            if snapshot.at_when > report.at_when:
+                return
+
+            for field, value in statistics.items():
+                setattr(snapshot, field, value)
+            snapshot.organization_report = report
+            snapshot.at_when = report.at_when
+            snapshot.save()
+            return
+
+        previous_snapshot = (
+            OrganizationSnapshot.objects.all().filter(organization=report.organization_id, day__lt=day).order_by("-day")
+        ).first()
+        next_snapshot = (
+            OrganizationSnapshot.objects.all().filter(organization=report.organization_id, day__gt=day).order_by("day")
+        ).first()
+
+        OrganizationSnapshot.objects.create(
+            organization_id=report.organization_id,
+            organization_report=report,
+            at_when=report.at_when,
+            day=day,
+            until=next_snapshot.day if next_snapshot else None,
+            **statistics,
+        )
+
+        if previous_snapshot:
+            previous_snapshot.until = day
+            previous_snapshot.save(update_fields=["until"])
+
+
+def rebuild_organization_snapshots(organizations: List[int]):
+    """Replaces the snapshots of the organizations with snapshots made from all their organization reports."""
+
+    for organization_id in organizations:
+        reports = (
+            OrganizationReport.objects.all()
+            .filter(organization=organization_id)
+            .order_by("at_when", "id")
+            .only("id", "organization_id", "at_when", *SNAPSHOT_FIELDS)
+        )
+
+        # the last report of each day is the report of that day
+        latest_report_per_day = {}
+        for report in reports:
+            latest_report_per_day[report.at_when.date()] = report
+
+        days = list(latest_report_per_day.keys())
+        snapshots = [
+            OrganizationSnapshot(
+                organization_id=organization_id,
+                organization_report=report,
+                at_when=report.at_when,
+                day=day,
+                until=days[index + 1] if index + 1 < len(days) else None,
+                **{field: getattr(report, field) for field in SNAPSHOT_FIELDS},
+            )
+            for index, (day, report) in enumerate(latest_report_per_day.items())
+        ]
+
+        with transaction.atomic():
+            OrganizationSnapshot.objects.all().filter(organization=organization_id).delete()
+            OrganizationSnapshot.objects.bulk_create(snapshots, batch_size=500)
+
+        log.debug("Created %s snapshots for organization %s." % (len(snapshots), organization_id))
@@ -7,7 +7,7 @@ from dateutil.relativedelta import relativedelta
 from django.utils import timezone
 
 from websecmap.map.logic.map_defaults import get_country, get_default_country, get_default_layer, get_organization_type
-from websecmap.map.models import Configuration, HighLevelStatistic, OrganizationReport, VulnerabilityStatistic
+from websecmap.map.models import Configuration, HighLevelStatistic, OrganizationSnapshot, VulnerabilityStatistic
 from websecmap.organizations.models import Organization
 from websecmap.reporting.severity import get_severity
 from websecmap.scanners import POLICY, URL_SCAN_TYPES
@@ -74,10 +74,22 @@ def get_vulnerability_graph(country, organization_type, weeks_back):
 def get_organization_vulnerability_timeline(organization_id: int):
     one_year_ago = timezone.now() - timedelta(days=365)
 
+    # one snapshot per day, with only the integer statistics of the latest organization report on that day.
     ratings = (
-        OrganizationReport.objects.all()
-        .filter(organization=organization_id, at_when__gte=one_year_ago)
-        .order_by("at_when")
+        OrganizationSnapshot.objects.all()
+        .filter(organization=organization_id, day__gte=one_year_ago.date())
+        .order_by("day")
+        .only(
+            "day",
+            "total_endpoints",
+            "total_urls",
+            "url_issues_high",
+            "endpoint_issues_high",
+            "url_issues_medium",
+            "endpoint_issues_medium",
+            "url_issues_low",
+            "endpoint_issues_low",
+        )
     )
 
     stats = []
@@ -85,7 +97,7 @@ def get_organization_vulnerability_timeline(organization_id: int):
     for rating in ratings:
         stats.append(
             {
-                "date": rating.at_when.date().isoformat(),
+                "date": rating.day.isoformat(),
                 "endpoints": rating.total_endpoints,
                 "urls": rating.total_urls,
                 "high": rating.url_issues_high + rating.endpoint_issues_high,
@@ -237,7 +249,7 @@ def what_to_improve(country: str, organization_type: str, issue_type: str):
 def what_to_improve_ugs(country: str, organization_type: str, issue_type: str, policy):
     scans = UrlGenericScan.objects.all().filter(
         type=issue_type,
-        is_the_latest_scan=True,
+        latest_scan__isnull=False,
         comply_or_explain_is_explained=False,
         rating__in=policy["high"] + policy["medium"],
         url__is_dead=False,
@@ -263,7 +275,7 @@ def what_to_improve_ugs(country: str, organization_type: str, issue_type: str, p
 def what_to_improve_epgs(country: str, organization_type: str, issue_type: str, policy):
     scans = EndpointGenericScan.objects.all().filter(
         type=issue_type,
-        is_the_latest_scan=True,
+        latest_scan__isnull=False,
         comply_or_explain_is_explained=False,
         rating__in=policy["high"] + policy["medium"],
         endpoint__is_dead=False,
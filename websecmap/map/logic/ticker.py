@@ -3,7 +3,7 @@ from datetime import timedelta
 from constance import config
 
 from websecmap.map.logic.map_defaults import get_country, get_organization_type, get_when
-from websecmap.map.models import OrganizationReport
+from websecmap.map.models import OrganizationSnapshot
 
 
 def get_ticker_data(
@@ -27,31 +27,22 @@ def get_ticker_data(
 
     # compare the first urlrating to the last urlrating
     # but do not include urls that don't exist.
+    # The latest organization reports are retrieved from the daily snapshots, see OrganizationSnapshot.
 
     sql = """
         SELECT
-            map_organizationreport.id as id,
+            map_organizationsnapshot.id as id,
             name,
             high,
             medium,
             low
         FROM
-            map_organizationreport
-        INNER JOIN
-           (
-                SELECT MAX(or2.id) as id2
-                FROM map_organizationreport or2
-                INNER JOIN organization as filter_organization
-                ON (filter_organization.id = or2.organization_id)
-                WHERE
-                    at_when <= '%(when)s'
-                    AND filter_organization.country='%(country)s'
-                    AND filter_organization.type_id=%(OrganizationTypeId)s
-               GROUP BY organization_id
-            ) as stacked_organizationreport
-        ON stacked_organizationreport.id2 = map_organizationreport.id
-        INNER JOIN organization ON map_organizationreport.organization_id = organization.id
+            map_organizationsnapshot
+        INNER JOIN organization ON map_organizationsnapshot.organization_id = organization.id
         WHERE
+        map_organizationsnapshot.day <= '%(day)s'
+        AND (map_organizationsnapshot.until IS NULL OR map_organizationsnapshot.until > '%(day)s')
+        AND
         (('%(when)s' BETWEEN organization.created_on AND organization.is_dead_since
            AND organization.is_dead = 1
            ) OR (
@@ -63,38 +54,29 @@ def get_ticker_data(
         AND total_urls > 0
         """ % {
         "when": when,
+        "day": when.date(),
         "OrganizationTypeId": get_organization_type(organization_type),
         "country": get_country(country),
     }
 
-    newest_urlratings = list(OrganizationReport.objects.raw(sql))
+    newest_urlratings = list(OrganizationSnapshot.objects.raw(sql))
 
     # this of course doesn't work with the first day, as then we didn't measure
     # everything (and the ratings for several issues are 0...
     sql = """
         SELECT
-            map_organizationreport.id as id,
+            map_organizationsnapshot.id as id,
             name,
             high,
             medium,
             low
         FROM
-               map_organizationreport
-        INNER JOIN
-            (
-                SELECT MAX(or2.id) as id2
-                FROM map_organizationreport or2
-                INNER JOIN organization as filter_organization
-                ON (filter_organization.id = or2.organization_id)
-                WHERE
-                    at_when <= '%(when)s'
-                    AND filter_organization.country='%(country)s'
-                    AND filter_organization.type_id=%(OrganizationTypeId)s
-               GROUP BY organization_id
-            ) as stacked_organizationreport
-        ON stacked_organizationreport.id2 = map_organizationreport.id
-        INNER JOIN organization ON map_organizationreport.organization_id = organization.id
+            map_organizationsnapshot
+        INNER JOIN organization ON map_organizationsnapshot.organization_id = organization.id
         WHERE
+        map_organizationsnapshot.day <= '%(day)s'
+        AND (map_organizationsnapshot.until IS NULL OR map_organizationsnapshot.until > '%(day)s')
+        AND
         (('%(when)s' BETWEEN organization.created_on AND organization.is_dead_since
                AND organization.is_dead = 1
                ) OR (
@@ -106,11 +88,12 @@ def get_ticker_data(
         AND total_urls > 0
         """ % {
         "when": when - timedelta(days=(weeks_duration * 7)),
+        "day": (when - timedelta(days=(weeks_duration * 7))).date(),
         "OrganizationTypeId": get_organization_type(organization_type),
         "country": get_country(country),
     }
 
-    oldest_urlratings = list(OrganizationReport.objects.raw(sql))
+    oldest_urlratings = list(OrganizationSnapshot.objects.raw(sql))
 
     # create a dict, where the keys are pointing to the ratings. This makes it easy to match the
     # correct ones. And handle missing oldest ratings for example.
@@ -40,24 +40,17 @@ def get_top_win_data(country: str = "NL", organization_type="municipality", week
               total_urls,
               total_endpoints,
               organization.is_dead
-            FROM map_organizationreport
+            FROM map_organizationsnapshot
             INNER JOIN
-              organization on organization.id = map_organizationreport.organization_id
+              organization on organization.id = map_organizationsnapshot.organization_id
             INNER JOIN
               organizations_organizationtype on organizations_organizationtype.id = organization.type_id
             INNER JOIN
               coordinate ON coordinate.organization_id = organization.id
-            INNER JOIN
-              (
-                SELECT MAX(or2.id) as id2 FROM map_organizationreport or2
-                INNER JOIN organization as org2 ON org2.id = or2.organization_id
-                WHERE at_when <= '%(when)s'
-                  AND org2.country = '%(country)s'
-                  AND org2.type_id = '%(OrganizationTypeId)s'
-                GROUP BY organization_id
-              ) as stacked_organization_report
-            ON stacked_organization_report.id2 = map_organizationreport.id
             WHERE
+              map_organizationsnapshot.day <= '%(day)s'
+              AND (map_organizationsnapshot.until IS NULL OR map_organizationsnapshot.until > '%(day)s')
+              AND
               (('%(when)s' BETWEEN organization.created_on AND organization.is_dead_since
                AND organization.is_dead = 1
                ) OR (
@@ -72,6 +65,7 @@ def get_top_win_data(country: str = "NL", organization_type="municipality", week
             ORDER BY low ASC, total_endpoints DESC, organization.name ASC
             """ % {
         "when": when,
+        "day": when.date(),
         "OrganizationTypeId": get_organization_type(organization_type),
         "country": get_country(country),
     }
@@ -100,24 +94,17 @@ def get_top_fail_data(country: str = "NL", organization_type="municipality", wee
                 low,
                 total_urls,
                 total_endpoints
-            FROM map_organizationreport
+            FROM map_organizationsnapshot
             INNER JOIN
-              organization on organization.id = map_organizationreport.organization_id
+              organization on organization.id = map_organizationsnapshot.organization_id
             INNER JOIN
               organizations_organizationtype on organizations_organizationtype.id = organization.type_id
             INNER JOIN
               coordinate ON coordinate.organization_id = organization.id
-            INNER JOIN
-              (
-                SELECT MAX(or2.id) as id2 FROM map_organizationreport or2
-                INNER JOIN organization as org2 ON org2.id = or2.organization_id
-                WHERE at_when <= '%(when)s'
-                  AND org2.country = '%(country)s'
-                  AND org2.type_id = '%(OrganizationTypeId)s'
-                GROUP BY organization_id
-              ) as stacked_organization_report
-            ON stacked_organization_report.id2 = map_organizationreport.id
             WHERE
+              map_organizationsnapshot.day <= '%(day)s'
+              AND (map_organizationsnapshot.until IS NULL OR map_organizationsnapshot.until > '%(day)s')
+              AND
               (('%(when)s' BETWEEN organization.created_on AND organization.is_dead_since
                AND organization.is_dead = 1
                ) OR (
@@ -132,6 +119,7 @@ def get_top_fail_data(country: str = "NL", organization_type="municipality", wee
             ORDER BY high DESC, medium DESC, medium DESC, organization.name ASC
             """ % {
         "when": when,
+        "day": when.date(),
         "OrganizationTypeId": get_organization_type(organization_type),
         "country": get_country(country),
     }
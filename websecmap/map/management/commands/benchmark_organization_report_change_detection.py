@@ -0,0 +1,153 @@
+import logging
+import random
+import time
+from copy import deepcopy
+from datetime import datetime, timedelta
+
+import pytz
+import simplejson as json
+from deepdiff import DeepDiff
+from django.core.management.base import BaseCommand
+from django.db.models.functions import Length
+
+from websecmap.map.models import OrganizationReport
+from websecmap.reporting.digest import calculation_digest
+from websecmap.scanners import ENDPOINT_SCAN_TYPES, URL_SCAN_TYPES
+
+log = logging.getLogger(__package__)
+
+
+class Command(BaseCommand):
+    """
+    Compares the cost of detecting a changed organization report with DeepDiff and with digests.
+
+    Before: the calculation of the previous report is loaded and compared to the new calculation with DeepDiff.
+    After: the digest of the new calculation is compared to the stored digest of the previous report.
+
+    Synthetic calculations are used, and with --largest also the calculations of the largest stored reports. Both
+    the case where nothing changed and the case where a single rating changed are measured.
+
+    Example: websecmap benchmark_organization_report_change_detection --urls 100 1000 5000 --largest 3
+    """
+
+    help = __doc__
+
+    def add_arguments(self, parser):
+        parser.add_argument("--urls", nargs="*", type=int, default=[100, 1000, 5000])
+        parser.add_argument("--largest", type=int, default=0, help="Also measure the largest stored reports.")
+        parser.add_argument("--repeat", type=int, default=3)
+        parser.add_argument("--seed", type=int, default=42)
+
+    def handle(self, *args, **options):
+        calculations = [
+            (f"synthetic, {urls} urls", synthetic_organization_calculation(urls, options["seed"]))
+            for urls in options["urls"]
+        ]
+
+        for report in (
+            OrganizationReport.objects.all()
+            .annotate(size=Length("calculation"))
+            .order_by("-size")
+            .only("id", "calculation")[: options["largest"]]
+        ):
+            calculations.append((f"report {report.id}", report.calculation))
+
+        for label, calculation in calculations:
+            changed_calculation = with_changed_rating(calculation)
+            stored_calculation = json.dumps(calculation)
+
+            for change, new_calculation in [("unchanged", calculation), ("changed", changed_calculation)]:
+                before = measure(
+                    lambda: DeepDiff(
+                        json.loads(stored_calculation), new_calculation, ignore_order=True, report_repetition=True
+                    ),
+                    options["repeat"],
+                )
+                after = measure(lambda: calculation_digest(new_calculation), options["repeat"])
+
+                print(
+                    f"{label:>30} {change:>9}: deepdiff {before * 1000:10.1f}ms, digest {after * 1000:8.1f}ms "
+                    f"({before / after:,.0f}x)"
+                )
+
+
+def measure(function, repeat: int) -> float:
+    """Returns the fastest duration of a few runs, in seconds."""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return min(durations)
+
+
+def with_changed_rating(calculation):
+    changed_calculation = deepcopy(calculation)
+    for url in changed_calculation.get("organization", {}).get("urls", []):
+        for endpoint in url.get("endpoints", []):
+            for rating in endpoint.get("ratings", []):
+                rating["high"] = rating.get("high", 0) + 1
+                return changed_calculation
+    return changed_calculation
+
+
+def synthetic_organization_calculation(urls: int, seed: int):
+    """An organization calculation in the shape of what create_organization_report_on_moment stores."""
+    generator = random.Random(seed)
+    moment = datetime(2020, 1, 1, tzinfo=pytz.utc)
+
+    def rating(scan_type: str):
+        high, medium, low = [int(generator.random() < 0.1) for _ in range(3)]
+        since = moment + timedelta(minutes=generator.randrange(500000))
+        return {
+            "type": scan_type,
+            "scan_type": scan_type,
+            "scan": generator.randrange(10000000),
+            "explanation": "synthetic rating",
+            "since": since.isoformat(),
+            "last_scan": since.isoformat(),
+            "high": high,
+            "medium": medium,
+            "low": low,
+            "ok": int(not any([high, medium, low])),
+            "not_testable": False,
+            "not_applicable": False,
+            "error_in_test": False,
+            "is_explained": False,
+            "comply_or_explain_explanation": "",
+            "comply_or_explain_explained_on": "",
+            "comply_or_explain_explanation_valid_until": "",
+            "comply_or_explain_valid_at_time_of_report": False,
+        }
+
+    return {
+        "organization": {
+            "name": "Synthetic",
+            "urls": [
+                {
+                    "url": f"subdomain{index}.example.nl",
+                    "ratings": [rating(scan_type) for scan_type in sorted(URL_SCAN_TYPES)],
+                    "endpoints": [
+                        {
+                            "id": generator.randrange(10000000),
+                            "concat": f"{protocol}/{port} IPv{ip_version}",
+                            "ip": ip_version,
+                            "ip_version": ip_version,
+                            "port": port,
+                            "protocol": protocol,
+                            "v4": ip_version == 4,
+                            "ratings": [
+                                rating(scan_type)
+                                for scan_type in generator.sample(
+                                    sorted(ENDPOINT_SCAN_TYPES), min(8, len(ENDPOINT_SCAN_TYPES))
+                                )
+                            ],
+                        }
+                        for protocol, port in [("http", 80), ("https", 443)]
+                        for ip_version in [4, 6]
+                    ],
+                }
+                for index in range(urls)
+            ],
+        }
+    }
@@ -1,6 +1,44 @@
-from websecmap.map.management.commands.custom_commands import CalculateCommand
-from websecmap.map.report import calculate_map_data
+from websecmap.map.management.commands.custom_commands import CalculateCommand, check_positive
+from websecmap.map.report import calculate_map_data, compose_calculate_map_data_task
 
 
 class Command(CalculateCommand):
-    CalculateCommand.command = calculate_map_data
+    """
+    Creates the map data of every day for all map configurations. Days that are already calculated are skipped.
+
+    When a concurrency is given, the days are calculated in parallel on the reporting workers.
+    """
+
+    help = __doc__
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+
+        parser.add_argument(
+            "--concurrency",
+            type=check_positive,
+            help="Calculate days in parallel on the reporting workers, with at most this many at the same time.",
+            required=False,
+        )
+
+        parser.add_argument("--force", action="store_true", help="Also calculate days that are already calculated.")
+
+    def handle(self, *args, **options):
+        days = options["days"] if options["days"] else 366
+        countries = [options["country"]] if options["country"] else []
+        organization_types = [options["organization_type"]] if options["organization_type"] else []
+
+        if options["concurrency"]:
+            task = compose_calculate_map_data_task(
+                days=days,
+                countries=countries,
+                organization_types=organization_types,
+                concurrency=options["concurrency"],
+                force=options["force"],
+            )
+            task.apply_async()
+            return
+
+        calculate_map_data(
+            days=days, countries=countries, organization_types=organization_types, force=options["force"]
+        )
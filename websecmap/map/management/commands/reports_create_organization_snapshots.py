@@ -0,0 +1,20 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from websecmap.map.logic.organization_snapshot import rebuild_organization_snapshots
+from websecmap.organizations.models import Organization
+
+log = logging.getLogger(__package__)
+
+
+class Command(BaseCommand):
+    help = "Creates the daily snapshots of all existing organization reports, replacing existing snapshots."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--organization_ids", nargs="*", type=int, help="Only these organizations.", required=False)
+
+    def handle(self, *args, **options):
+        organizations = options["organization_ids"] or list(Organization.objects.all().values_list("id", flat=True))
+        log.info("Creating snapshots for %s organizations." % len(organizations))
+        rebuild_organization_snapshots(organizations)
@@ -0,0 +1,42 @@
+# Generated by Django 3.1.13 on 2026-10-18 14:05
+
+import django.db.models.deletion
+import jsonfield.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("map", "0052_maphealthreport"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OrganizationReportSeverity",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("scan_type", models.CharField(db_index=True, help_text="A scan type or 'all'.", max_length=255)),
+                ("high", models.PositiveIntegerField(default=0)),
+                ("medium", models.PositiveIntegerField(default=0)),
+                ("low", models.PositiveIntegerField(default=0)),
+                ("ok", models.PositiveIntegerField(default=0)),
+                (
+                    "urls",
+                    jsonfield.fields.JSONField(
+                        help_text="The urls in the report that have a rating of this scan type. For 'all' these are all urls "
+                        "in the report."
+                    ),
+                ),
+                (
+                    "organization_report",
+                    models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to="map.organizationreport"),
+                ),
+            ],
+            options={
+                "verbose_name": "Organization Report Severity",
+                "verbose_name_plural": "Organization Report Severities",
+                "unique_together": {("organization_report", "scan_type")},
+            },
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 3.1.13 on 2026-10-18 14:09
+
+import django.db.models.deletion
+import django_countries.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("organizations", "0060_auto_20200908_1055"),
+        ("map", "0053_organizationreportseverity"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MapDataCheckpoint",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                (
+                    "country",
+                    django_countries.fields.CountryField(
+                        db_index=True, help_text="Part of the combination shown on the map.", max_length=2
+                    ),
+                ),
+                ("at_when", models.DateField()),
+                (
+                    "latest_organization_report_id",
+                    models.PositiveIntegerField(
+                        default=0,
+                        help_text="The highest id of the organization reports the map data was calculated from. Rebuilding reports creates reports with a higher id, which invalidates the map data.",
+                    ),
+                ),
+                ("calculated_on", models.DateTimeField(auto_now=True)),
+                (
+                    "organization_type",
+                    models.ForeignKey(
+                        help_text="Part of the combination shown on the map.",
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="organizations.organizationtype",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("country", "organization_type", "at_when")},
+            },
+        ),
+    ]
@@ -0,0 +1,146 @@
+# Generated by Django 3.1.13 on 2026-10-18 14:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("organizations", "0060_auto_20200908_1055"),
+        ("map", "0054_mapdatacheckpoint"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OrganizationSnapshot",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("total_issues", models.IntegerField(default=0)),
+                ("high", models.IntegerField(default=0)),
+                ("medium", models.IntegerField(default=0)),
+                ("low", models.IntegerField(default=0)),
+                ("ok", models.IntegerField(default=0)),
+                ("not_applicable", models.IntegerField(default=0)),
+                ("not_testable", models.IntegerField(default=0)),
+                ("error_in_test", models.IntegerField(default=0)),
+                (
+                    "total_endpoint_issues",
+                    models.IntegerField(
+                        default=0,
+                        help_text="A sum of all endpoint issues for this endpoint, it includes all high, medium and lows.",
+                    ),
+                ),
+                (
+                    "endpoint_issues_high",
+                    models.IntegerField(default=0, help_text="Total amount of high risk issues on this endpoint."),
+                ),
+                (
+                    "endpoint_issues_medium",
+                    models.IntegerField(default=0, help_text="Total amount of medium risk issues on this endpoint."),
+                ),
+                (
+                    "endpoint_issues_low",
+                    models.IntegerField(default=0, help_text="Total amount of low risk issues on this endpoint"),
+                ),
+                (
+                    "endpoint_ok",
+                    models.IntegerField(
+                        default=0, help_text="Amount of measurements that resulted in an OK score on this endpoint."
+                    ),
+                ),
+                (
+                    "endpoint_not_testable",
+                    models.IntegerField(
+                        default=0, help_text="Amount of things that could not be tested on this endpoint."
+                    ),
+                ),
+                (
+                    "endpoint_not_applicable",
+                    models.IntegerField(
+                        default=0, help_text="Amount of things that are not applicable on this endpoint."
+                    ),
+                ),
+                (
+                    "endpoint_error_in_test",
+                    models.IntegerField(default=0, help_text="Amount of errors in tests performed on this endpoint."),
+                ),
+                ("total_url_issues", models.IntegerField(default=0, help_text="Total amount of issues on url level.")),
+                ("url_issues_high", models.IntegerField(default=0, help_text="Number of high issues on url level.")),
+                (
+                    "url_issues_medium",
+                    models.IntegerField(default=0, help_text="Number of medium issues on url level."),
+                ),
+                ("url_issues_low", models.IntegerField(default=0, help_text="Number of low issues on url level.")),
+                ("url_ok", models.IntegerField(default=0, help_text="Zero issues on these urls.")),
+                (
+                    "url_not_testable",
+                    models.IntegerField(default=0, help_text="Amount of things that could not be tested on this url."),
+                ),
+                (
+                    "url_not_applicable",
+                    models.IntegerField(default=0, help_text="Amount of things that are not applicable on this url."),
+                ),
+                (
+                    "url_error_in_test",
+                    models.IntegerField(default=0, help_text="Amount of errors in tests on this url."),
+                ),
+                ("total_urls", models.IntegerField(default=0, help_text="Amount of urls for this organization.")),
+                (
+                    "high_urls",
+                    models.IntegerField(default=0, help_text="Amount of urls with (1 or more) high risk issues."),
+                ),
+                (
+                    "medium_urls",
+                    models.IntegerField(default=0, help_text="Amount of urls with (1 or more) medium risk issues."),
+                ),
+                (
+                    "low_urls",
+                    models.IntegerField(default=0, help_text="Amount of urls with (1 or more) low risk issues."),
+                ),
+                ("ok_urls", models.IntegerField(default=0, help_text="Amount of urls with zero issues.")),
+                ("total_endpoints", models.IntegerField(default=0, help_text="Amount of endpoints for this url.")),
+                (
+                    "high_endpoints",
+                    models.IntegerField(default=0, help_text="Amount of endpoints with (1 or more) high risk issues."),
+                ),
+                (
+                    "medium_endpoints",
+                    models.IntegerField(
+                        default=0, help_text="Amount of endpoints with (1 or more) medium risk issues."
+                    ),
+                ),
+                (
+                    "low_endpoints",
+                    models.IntegerField(default=0, help_text="Amount of endpoints with (1 or more) low risk issues."),
+                ),
+                ("ok_endpoints", models.IntegerField(default=0, help_text="Amount of endpoints with zero issues.")),
+                ("at_when", models.DateTimeField(help_text="The moment of the organization report.")),
+                ("day", models.DateField()),
+                (
+                    "until",
+                    models.DateField(
+                        blank=True,
+                        help_text="The day of the next snapshot of this organization, empty when this is the latest.",
+                        null=True,
+                    ),
+                ),
+                (
+                    "organization",
+                    models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to="organizations.organization"),
+                ),
+                (
+                    "organization_report",
+                    models.ForeignKey(
+                        help_text="The latest report of the organization on this day.",
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="map.organizationreport",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("organization", "day")},
+                "index_together": {("day", "until")},
+            },
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 3.1.13 on 2026-10-18 14:18
+
+from django.db import migrations, models
+
+from websecmap.reporting.digest import calculation_digest
+
+
+def forward(apps, schema_editor):
+    """Stores the digest of all existing organization reports, in batches to keep memory usage low."""
+    OrganizationReport = apps.get_model("map", "OrganizationReport")
+
+    batch = []
+    for report in OrganizationReport.objects.all().only("id", "calculation").iterator(chunk_size=500):
+        report.calculation_digest = calculation_digest(report.calculation)
+        batch.append(report)
+
+        if len(batch) >= 500:
+            OrganizationReport.objects.bulk_update(batch, ["calculation_digest"])
+            batch = []
+
+    if batch:
+        OrganizationReport.objects.bulk_update(batch, ["calculation_digest"])
+
+
+def noop(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("map", "0055_organizationsnapshot"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="organizationreport",
+            name="calculation_digest",
+            field=models.CharField(
+                blank=True,
+                help_text="Order insensitive sha256 of the calculation. Used to see if a new calculation differs from "
+                "this one without comparing the calculations. See websecmap.reporting.digest.",
+                max_length=64,
+                null=True,
+            ),
+        ),
+        migrations.RunPython(forward, noop),
+    ]
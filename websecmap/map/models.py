@@ -6,7 +6,14 @@ from django_countries.fields import CountryField
 from jsonfield import JSONField
 
 from websecmap.organizations.models import Organization, OrganizationType
-from websecmap.reporting.models import SeriesOfUrlsReportMixin
+from websecmap.reporting.models import (
+    AllIssuesCombined,
+    EndpointIssues,
+    JudgedEndpoints,
+    JudgedUrls,
+    SeriesOfUrlsReportMixin,
+    UrlIssues,
+)
 
 
 class AdministrativeRegion(models.Model):
@@ -251,6 +258,14 @@ class OrganizationReport(SeriesOfUrlsReportMixin):
 
     organization = models.ForeignKey(Organization, on_delete=models.CASCADE)
 
+    calculation_digest = models.CharField(
+        max_length=64,
+        null=True,
+        blank=True,
+        help_text="Order insensitive sha256 of the calculation. Used to see if a new calculation differs from this one "
+        "without comparing the calculations. See websecmap.reporting.digest.",
+    )
+
     class Meta:
         get_latest_by = "at_when"
         index_together = [
@@ -258,3 +273,90 @@ class OrganizationReport(SeriesOfUrlsReportMixin):
         ]
         verbose_name = _("Organization Report")
         verbose_name_plural = _("Organization Reports")
+
+
+class OrganizationReportSeverity(models.Model):
+    """
+    A compact summary of an organization report for a single scan type: the amount of high, medium, low and ok
+    ratings and the urls that have these ratings. The scan type "all" sums up all scan types and lists all urls.
+
+    The map is assembled from these rows, so the (multi megabyte) calculation of an organization report does not
+    have to be parsed for every layer of the map. These are stored when the organization report is saved.
+    """
+
+    organization_report = models.ForeignKey(OrganizationReport, on_delete=models.CASCADE)
+
+    scan_type = models.CharField(max_length=255, db_index=True, help_text="A scan type or 'all'.")
+
+    high = models.PositiveIntegerField(default=0)
+    medium = models.PositiveIntegerField(default=0)
+    low = models.PositiveIntegerField(default=0)
+    ok = models.PositiveIntegerField(default=0)
+
+    urls = JSONField(
+        help_text="The urls in the report that have a rating of this scan type. For 'all' these are all urls "
+        "in the report."
+    )
+
+    class Meta:
+        unique_together = [["organization_report", "scan_type"]]
+        verbose_name = _("Organization Report Severity")
+        verbose_name_plural = _("Organization Report Severities")
+
+
+class MapDataCheckpoint(models.Model):
+    """
+    Administration of the map data that has been calculated for a map configuration on a day. When the organization
+    reports of that map configuration on that day did not change since, the map data does not have to be calculated
+    again. This allows an interrupted calculation of map data to resume where it stopped.
+    """
+
+    country = CountryField(db_index=True, help_text="Part of the combination shown on the map.")
+
+    organization_type = models.ForeignKey(
+        OrganizationType, on_delete=models.CASCADE, help_text="Part of the combination shown on the map."
+    )
+
+    at_when = models.DateField()
+
+    latest_organization_report_id = models.PositiveIntegerField(
+        default=0,
+        help_text="The highest id of the organization reports the map data was calculated from. Rebuilding reports "
+        "creates reports with a higher id, which invalidates the map data.",
+    )
+
+    calculated_on = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = [["country", "organization_type", "at_when"]]
+
+
+class OrganizationSnapshot(AllIssuesCombined, JudgedUrls, JudgedEndpoints, UrlIssues, EndpointIssues):
+    """
+    The statistics of the latest organization report of an organization on a day. A snapshot is valid from its day
+    until the day of the next snapshot of the organization. This makes the latest report at or before a certain day
+    a simple range lookup, instead of finding the latest report per organization in the entire history.
+
+    Snapshots are stored when an organization report is saved. Use reports_create_organization_snapshots to create
+    the snapshots of existing reports.
+    """
+
+    organization = models.ForeignKey(Organization, on_delete=models.CASCADE)
+
+    organization_report = models.ForeignKey(
+        OrganizationReport, on_delete=models.CASCADE, help_text="The latest report of the organization on this day."
+    )
+
+    at_when = models.DateTimeField(help_text="The moment of the organization report.")
+
+    day = models.DateField()
+
+    until = models.DateField(
+        null=True,
+        blank=True,
+        help_text="The day of the next snapshot of this organization, empty when this is the latest.",
+    )
+
+    class Meta:
+        unique_together = [["organization", "day"]]
+        index_together = [["day", "until"]]
@@ -48,7 +48,10 @@ def compose_task(
 
         # Do NOT update the statistics also. This can take long and might not have a desired effect.
         # those updates have to be called explicitly.
-        tasks.append(group(recreate_url_reports(urls)) | recreate_organization_reports.si([organization.pk]))
+        tasks.append(
+            group(recreate_url_reports([url.id for url in urls], full_rebuild=True))
+            | recreate_organization_reports.si([organization.pk])
+        )
 
     if not tasks:
         log.error("Could not rebuild reports, filters resulted in no tasks created.")
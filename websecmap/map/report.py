@@ -1,27 +1,33 @@
 import calendar
 import logging
 from collections import OrderedDict
-from copy import deepcopy
 from datetime import date, datetime, timedelta
 from typing import List, Tuple
 
 import pytz
 import simplejson as json
-from celery import group
-from deepdiff import DeepDiff
-from django.db.models import Count
+from celery import chain, group
+from django.db.models import Count, Max
 
 from websecmap.celery import Task, app
-from websecmap.map.logic.map import get_map_data, get_reports_by_ids
+from websecmap.map.logic.map import get_map_data_layers, get_reports_by_ids, store_organization_report_severities
 from websecmap.map.logic.map_health import update_map_health_reports
+from websecmap.map.logic.organization_snapshot import store_organization_snapshot
 from websecmap.map.map_configs import filter_map_configs
-from websecmap.map.models import HighLevelStatistic, MapDataCache, OrganizationReport, VulnerabilityStatistic
+from websecmap.map.models import (
+    HighLevelStatistic,
+    MapDataCache,
+    MapDataCheckpoint,
+    OrganizationReport,
+    OrganizationSnapshot,
+    VulnerabilityStatistic,
+)
 from websecmap.organizations.models import Organization, OrganizationType, Url
+from websecmap.reporting.digest import calculation_digest
 from websecmap.reporting.report import (
     START_DATE,
-    aggegrate_url_rating_scores,
+    aggegrate_latest_url_report_scores,
     get_allowed_to_report,
-    get_latest_urlratings_fast,
     recreate_url_reports,
     relevant_urls_at_timepoint,
     significant_moments,
@@ -56,6 +62,10 @@ PUBLISHED_URL_SCAN_TYPES = ["DNSSEC"]
 
 PUBLISHED_SCAN_TYPES = PUBLISHED_ENDPOINT_SCAN_TYPES + PUBLISHED_URL_SCAN_TYPES
 
+# The amount of days of map data that are calculated at the same time by compose_calculate_map_data_task. Every day
+# runs a heavy query, running too many of them at the same time will swamp the database.
+MAP_DATA_CONCURRENCY = 4
+
 
 def compose_task(
     organizations_filter: dict = dict(),
@@ -476,54 +486,149 @@ def calculate_map_data_today():
 
 
 @app.task(queue="reporting")
-def calculate_map_data(days: int = 366, countries: List = None, organization_types: List = None):
-    from django.db import OperationalError
-
+def calculate_map_data(days: int = 366, countries: List = None, organization_types: List = None, force: bool = False):
     log.info("calculate_map_data")
 
     map_configurations = filter_map_configs(countries=countries, organization_types=organization_types)
 
+    for map_configuration in map_configurations:
+        for days_back in list(reversed(range(0, days))):
+            calculate_map_data_on_day(
+                map_configuration["country"],
+                map_configuration["organization_type"],
+                map_configuration["organization_type__name"],
+                days_back,
+                force,
+            )
+
+
+def compose_calculate_map_data_task(
+    days: int = 366,
+    countries: List = None,
+    organization_types: List = None,
+    concurrency: int = MAP_DATA_CONCURRENCY,
+    force: bool = False,
+) -> Task:
+    """
+    The same as calculate_map_data, but every map configuration and day is a separate task. Only [concurrency] of
+    these tasks run at the same time: the tasks are divided over that many chains, and each chain runs its tasks one
+    after the other. The oldest days are calculated first.
+
+    A failing task stops its chain. Running this again resumes where it stopped, as days that have been calculated
+    already are skipped.
+    """
+
+    map_configurations = filter_map_configs(countries=countries, organization_types=organization_types)
+
+    tasks = [
+        calculate_map_data_on_day.si(
+            map_configuration["country"],
+            map_configuration["organization_type"],
+            map_configuration["organization_type__name"],
+            days_back,
+            force,
+        )
+        for days_back in list(reversed(range(0, days)))
+        for map_configuration in map_configurations
+    ]
+
+    return group(chain(tasks[index::concurrency]) for index in range(concurrency) if tasks[index::concurrency])
+
+
+@app.task(queue="reporting")
+def calculate_map_data_on_day(
+    country: str, organization_type_id: int, organization_type_name: str, days_back: int, force: bool = False
+):
+    """
+    Creates the map data with all filters for a map configuration on a single day.
+
+    Past days that have been calculated before are skipped, unless the organization reports on that day have changed
+    since, see MapDataCheckpoint. Today is always calculated, as there are more changes that affect today's map.
+    """
+    from django.db import OperationalError
+
+    when = datetime.now(pytz.utc) - timedelta(days=days_back)
+
     # the "all" filter will retrieve all layers at once
     scan_types = ["all"] + PUBLISHED_SCAN_TYPES
 
-    for map_configuration in map_configurations:
-        for days_back in list(reversed(range(0, days))):
-            when = datetime.now(pytz.utc) - timedelta(days=days_back)
-            for scan_type in scan_types:
+    latest_organization_report_id = (
+        OrganizationReport.objects.all()
+        .filter(organization__country=country, organization__type=organization_type_id, at_when__lte=when)
+        .aggregate(latest_id=Max("id"))["latest_id"]
+        or 0
+    )
 
-                # You can expect something to change each day. Therefore just store the map data each day.
-                MapDataCache.objects.all().filter(
-                    at_when=when,
-                    country=map_configuration["country"],
-                    organization_type=OrganizationType(pk=map_configuration["organization_type"]),
-                    filters=[scan_type],
-                ).delete()
-
-                log.debug(
-                    "Country: %s, Organization_type: %s, day: %s, date: %s, filter: %s"
-                    % (
-                        map_configuration["country"],
-                        map_configuration["organization_type__name"],
-                        days_back,
-                        when,
-                        scan_type,
-                    )
-                )
-                data = get_map_data(
-                    map_configuration["country"], map_configuration["organization_type__name"], days_back, scan_type
-                )
+    if (
+        not force
+        and days_back
+        and map_data_is_calculated(country, organization_type_id, when, scan_types, latest_organization_report_id)
+    ):
+        log.debug("Map data of %s %s on %s is already calculated." % (country, organization_type_name, when.date()))
+        return
 
-                try:
-                    cached = MapDataCache()
-                    cached.organization_type = OrganizationType(pk=map_configuration["organization_type"])
-                    cached.country = map_configuration["country"]
-                    cached.filters = [scan_type]
-                    cached.at_when = when
-                    cached.dataset = data
-                    cached.save()
-                except OperationalError as a:
-                    # The public user does not have permission to run insert statements....
-                    log.exception(a)
+    log.debug(
+        "Country: %s, Organization_type: %s, day: %s, date: %s" % (country, organization_type_name, days_back, when)
+    )
+    # All filters of a day are created at once, from the same organization reports.
+    datasets = get_map_data_layers(country, organization_type_name, days_back, scan_types)
+
+    for scan_type in scan_types:
+
+        # You can expect something to change each day. Therefore just store the map data each day.
+        MapDataCache.objects.all().filter(
+            at_when=when,
+            country=country,
+            organization_type=OrganizationType(pk=organization_type_id),
+            filters=[scan_type],
+        ).delete()
+
+        try:
+            cached = MapDataCache()
+            cached.organization_type = OrganizationType(pk=organization_type_id)
+            cached.country = country
+            cached.filters = [scan_type]
+            cached.at_when = when
+            cached.dataset = datasets[scan_type]
+            cached.save()
+        except OperationalError as a:
+            # The public user does not have permission to run insert statements....
+            log.exception(a)
+            return
+
+    MapDataCheckpoint.objects.all().update_or_create(
+        country=country,
+        organization_type=OrganizationType(pk=organization_type_id),
+        at_when=when.date(),
+        defaults={"latest_organization_report_id": latest_organization_report_id},
+    )
+
+
+def map_data_is_calculated(
+    country: str, organization_type_id: int, when: datetime, scan_types: List[str], latest_organization_report_id: int
+) -> bool:
+    checkpoint_exists = (
+        MapDataCheckpoint.objects.all()
+        .filter(
+            country=country,
+            organization_type=organization_type_id,
+            at_when=when.date(),
+            latest_organization_report_id=latest_organization_report_id,
+        )
+        .exists()
+    )
+    if not checkpoint_exists:
+        return False
+
+    # The cache might have been cleared since.
+    amount_of_cached_filters = (
+        MapDataCache.objects.all()
+        .filter(at_when=when, country=country, organization_type=organization_type_id)
+        .values("filters")
+        .distinct()
+        .count()
+    )
+    return amount_of_cached_filters >= len(scan_types)
 
 
 @app.task(queue="reporting")
@@ -565,30 +670,22 @@ def calculate_high_level_stats(days: int = 1, countries: List = None, organizati
                 "explained": {},
             }
 
+            # The latest organization report per organization is retrieved from the daily snapshots.
             sql = """
                 SELECT
-                    map_organizationreport.id,
-                    map_organizationreport.medium,
-                    map_organizationreport.high,
-                    map_organizationreport.total_urls
+                    map_organizationsnapshot.id,
+                    map_organizationsnapshot.organization_report_id,
+                    map_organizationsnapshot.medium,
+                    map_organizationsnapshot.high,
+                    map_organizationsnapshot.total_urls
                 FROM
-                    map_organizationreport
-                INNER JOIN
-                    (
-                    SELECT MAX(or2.id) as id2
-                    FROM map_organizationreport or2
-                    INNER JOIN organization as filter_organization
-                    ON (filter_organization.id = or2.organization_id)
-                    WHERE
-                        at_when <= '%(when)s'
-                        AND filter_organization.country='%(country)s'
-                        AND filter_organization.type_id=%(OrganizationTypeId)s
-                   GROUP BY organization_id
-                ) as stacked_organizationreport
-                ON stacked_organizationreport.id2 = map_organizationreport.id
-                INNER JOIN organization ON map_organizationreport.organization_id = organization.id
+                    map_organizationsnapshot
+                INNER JOIN organization ON map_organizationsnapshot.organization_id = organization.id
                 WHERE
+                    map_organizationsnapshot.day <= '%(day)s'
+                    AND (map_organizationsnapshot.until IS NULL OR map_organizationsnapshot.until > '%(day)s')
                     /* Only include organizations that are alive now... */
+                    AND
                     (('%(when)s' BETWEEN organization.created_on AND organization.is_dead_since
                     AND organization.is_dead = 1
                     ) OR (
@@ -601,17 +698,18 @@ def calculate_high_level_stats(days: int = 1, countries: List = None, organizati
                     AND total_urls > 0
             """ % {
                 "when": when,
+                "day": when.date(),
                 "OrganizationTypeId": map_configuration["organization_type__id"],
                 "country": map_configuration["country"],
             }
 
             # log.debug(sql)
 
-            ratings = OrganizationReport.objects.raw(sql)
+            ratings = OrganizationSnapshot.objects.raw(sql)
 
             needed_reports = []
             for organizationrating in ratings:
-                needed_reports.append(str(organizationrating.id))
+                needed_reports.append(str(organizationrating.organization_report_id))
 
             reports = get_reports_by_ids(needed_reports)
 
@@ -632,7 +730,7 @@ def calculate_high_level_stats(days: int = 1, countries: List = None, organizati
                 # it will double the urls that are shared between organizations.
                 # that is not really bad, it distorts a little.
                 # we're forced to load each item separately anyway, so why not read it?
-                calculation = json.loads(reports[rating.id])
+                calculation = json.loads(reports[rating.organization_report_id])
                 measurement["total_urls"] += len(calculation["organization"]["urls"])
 
                 measurement["good_urls"] += sum(
@@ -786,36 +884,45 @@ def create_organization_report_on_moment(organization: Organization, when: datet
     urls = relevant_urls_at_timepoint_organization(organization=organization, when=when)
 
     # Here used to be a lost of nested queries: getting the "last" one per url. This has been replaced with a
-    # custom query that is many many times faster.
-    all_url_ratings = get_latest_urlratings_fast(urls, when)
-    scores = aggegrate_url_rating_scores(all_url_ratings)
-
-    # Still do deepdiff to prevent double reports.
-    try:
-        last = OrganizationReport.objects.filter(organization=organization, at_when__lte=when).latest("at_when")
-    except OrganizationReport.DoesNotExist:
-        log.debug("Could not find the last organization rating, creating a dummy one.")
-        last = OrganizationReport()  # create an empty one
+    # custom query that is many many times faster. The statistics are summed by the database.
+    scores = aggegrate_latest_url_report_scores(urls, when)
 
     scores["name"] = organization.name
     calculation = {"organization": scores}
+    digest = calculation_digest(calculation)
+
+    # Prevent double reports: only the digest of the previous report is needed to see if anything changed.
+    last = (
+        OrganizationReport.objects.filter(organization=organization, at_when__lte=when)
+        .only("id", "calculation_digest")
+        .order_by("-at_when")
+        .first()
+    )
+    if not last:
+        log.debug("Could not find the last organization rating, this is the first one.")
+        last_digest = None
+    elif last.calculation_digest:
+        last_digest = last.calculation_digest
+    else:
+        # reports from before digests were stored
+        last.refresh_from_db(fields=["calculation"])
+        last_digest = calculation_digest(last.calculation)
 
-    # this is 10% faster without deepdiff, the major pain is elsewhere.
-    if DeepDiff(last.calculation, calculation, ignore_order=True, report_repetition=True):
+    if digest != last_digest:
         log.info("The calculation for %s on %s has changed, so we're saving this rating." % (organization, when))
 
         # remove urls and name from scores object, so it can be used as initialization parameters (saves lines)
-        # this is by reference, meaning that the calculation will be affected if we don't work on a clone.
-        init_scores = deepcopy(scores)
-        del init_scores["name"]
-        del init_scores["urls"]
+        init_scores = {key: value for key, value in scores.items() if key not in ["name", "urls"]}
 
         organizationrating = OrganizationReport(**init_scores)
         organizationrating.organization = organization
         organizationrating.at_when = when
         organizationrating.calculation = calculation
+        organizationrating.calculation_digest = digest
 
         organizationrating.save()
+        store_organization_report_severities(organizationrating)
+        store_organization_snapshot(organizationrating)
         log.info("Saved report for %s on %s." % (organization, when))
     else:
         # This happens because some urls are dead etc: our filtering already removes this from the relevant information
@@ -902,7 +1009,10 @@ def default_organization_rating(organizations: List[int]):
                 "total_issues": 0,
             }
         }
+        r.calculation_digest = calculation_digest(r.calculation)
         r.save()
+        store_organization_report_severities(r)
+        store_organization_snapshot(r)
 
 
 @app.task(queue="reporting")
@@ -1059,7 +1169,7 @@ def update_report_tasks(url_chunk: List[int]):
         # Note that you cannot determine the moment to be "now" as the urls have to be re-reated.
         # the moment to rerate organizations is when the url_ratings has finished.
 
-        tasks.append(group(recreate_url_reports([url])) | create_organization_reports_now.si(organizations))
+        tasks.append(group(recreate_url_reports([url.id])) | create_organization_reports_now.si(organizations))
 
         # Calculating statistics is _extremely slow_ so we're not doing that in this method to keep the pace.
         # Otherwise you'd have a 1000 statistic rebuilds pending, all doing a marginal job.
@@ -3,9 +3,15 @@ from datetime import datetime
 import pytz
 from dateutil.relativedelta import relativedelta
 
-from websecmap.map.logic.map import get_map_data, get_cached_map_data
-from websecmap.map.models import MapDataCache
-from websecmap.organizations.models import OrganizationType
+from websecmap.map.logic.map import (
+    extract_domains,
+    get_cached_map_data,
+    get_map_data,
+    get_map_data_layers,
+    store_organization_report_severities,
+)
+from websecmap.map.models import MapDataCache, OrganizationReport, OrganizationReportSeverity
+from websecmap.organizations.models import Coordinate, Organization, OrganizationType
 
 
 def test_get_cached_map_data(db):
@@ -26,3 +32,98 @@ def test_get_cached_map_data(db):
 
     assert get_map_data(country="NL", organization_type="test", days_back=8) == expected_result
     assert get_cached_map_data(country="NL", organization_type="test", days_back=8) == expected_result
+
+
+def test_get_map_data_layers(db):
+    organization_type, created = OrganizationType.objects.all().get_or_create(name="municipality")
+    organization = Organization.objects.create(
+        name="Test", type=organization_type, country="NL", created_on=datetime(2016, 1, 1, tzinfo=pytz.utc)
+    )
+    Coordinate.objects.create(
+        organization=organization,
+        geojsontype="Point",
+        area=[4.895168, 52.370216],
+        created_on=datetime(2016, 1, 1, tzinfo=pytz.utc),
+    )
+
+    report = OrganizationReport(
+        organization=organization, at_when=datetime(2016, 1, 2, tzinfo=pytz.utc), total_urls=2, high=1, low=1
+    )
+    report.calculation = {
+        "organization": {
+            "name": "Test",
+            "total_urls": 2,
+            "urls": [
+                {
+                    "url": "www.example.nl",
+                    "ratings": [{"type": "DNSSEC", "high": 1, "medium": 0, "low": 0, "ok": 0}],
+                    "endpoints": [
+                        {
+                            "ratings": [
+                                {"type": "tls_qualys_encryption_quality", "high": 0, "medium": 0, "low": 1, "ok": 0},
+                                # explained ratings are not counted
+                                {
+                                    "type": "plain_https",
+                                    "high": 1,
+                                    "medium": 0,
+                                    "low": 0,
+                                    "ok": 0,
+                                    "comply_or_explain_valid_at_time_of_report": True,
+                                },
+                            ]
+                        }
+                    ],
+                },
+                {
+                    "url": "example.nl",
+                    "ratings": [],
+                    "endpoints": [
+                        {"ratings": [{"type": "plain_https", "high": 0, "medium": 0, "low": 0, "ok": 1}]},
+                    ],
+                },
+            ],
+        }
+    }
+    report.save()
+    store_organization_report_severities(report)
+    assert OrganizationReportSeverity.objects.all().count() == 4
+    # the urls are stored once per scan type, in the order of the calculation
+    assert {severity.scan_type: severity.urls for severity in OrganizationReportSeverity.objects.all()} == {
+        "all": ["www.example.nl", "example.nl"],
+        "DNSSEC": ["www.example.nl"],
+        "tls_qualys_encryption_quality": ["www.example.nl"],
+        "plain_https": ["example.nl"],
+    }
+
+    layers = ["all", "DNSSEC", "tls_qualys_encryption_quality", "plain_https", "ftp"]
+    datasets = get_map_data_layers("NL", "municipality", 0, layers)
+
+    assert list(datasets.keys()) == layers
+    summary = {
+        layer: [
+            {key: feature["properties"][key] for key in ["high", "medium", "low", "severity"]}
+            for feature in datasets[layer]["features"]
+        ]
+        for layer in layers
+    }
+    assert summary == {
+        "all": [{"high": 1, "medium": 0, "low": 1, "severity": "high"}],
+        "DNSSEC": [{"high": 1, "medium": 0, "low": 0, "severity": "high"}],
+        "tls_qualys_encryption_quality": [{"high": 0, "medium": 0, "low": 1, "severity": "low"}],
+        "plain_https": [{"high": 0, "medium": 0, "low": 0, "severity": "good"}],
+        "ftp": [{"high": 0, "medium": 0, "low": 0, "severity": "unknown"}],
+    }
+    assert datasets["all"]["features"][0]["properties"]["additional_keywords"] == extract_domains(report.calculation)
+    assert datasets["ftp"]["metadata"]["applied filter"] == "ftp"
+
+    # reports without stored severities are summarized from their calculation, with the same outcome. The summary
+    # is stored, so it is only made once.
+    OrganizationReportSeverity.objects.all().delete()
+    for attempt in range(2):
+        datasets = get_map_data_layers("NL", "municipality", 0, layers)
+        for layer in layers:
+            assert [
+                {key: feature["properties"][key] for key in ["high", "medium", "low", "severity"]}
+                for feature in datasets[layer]["features"]
+            ] == summary[layer]
+        assert OrganizationReportSeverity.objects.all().count() == 4
@@ -0,0 +1,94 @@
+from datetime import datetime, timedelta
+
+import pytz
+
+from websecmap.map.logic.map_health import (
+    create_health_report,
+    get_latest_report_of_organization,
+    split_ratings_between_good_and_bad,
+    update_map_health_reports,
+)
+from websecmap.map.models import Configuration, MapHealthReport, OrganizationReport
+from websecmap.organizations.models import Organization, OrganizationType
+
+PUBLISHED_SCAN_TYPES = ["plain_https", "tls_qualys_encryption_quality", "dnssec"]
+
+
+def rating(scan_type, last_scan):
+    return {"scan_type": scan_type, "last_scan": last_scan.isoformat(), "high": 0, "medium": 0, "low": 0, "ok": 1}
+
+
+def create_report(organization, at_when, last_scan):
+    OrganizationReport.objects.all().create(
+        organization=organization,
+        at_when=at_when,
+        calculation={
+            "organization": {
+                "name": organization.name,
+                "urls": [
+                    {
+                        "url": "example.nl",
+                        "ratings": [rating("dnssec", last_scan), rating("not_published", last_scan)],
+                        "endpoints": [
+                            {
+                                "ratings": [
+                                    rating("plain_https", at_when),
+                                    rating("tls_qualys_encryption_quality", last_scan),
+                                ]
+                            }
+                        ],
+                    }
+                ],
+            }
+        },
+    )
+
+
+def test_update_map_health_reports(db):
+    now = datetime.now(pytz.utc)
+    organization_type, created = OrganizationType.objects.all().get_or_create(name="municipality")
+    configuration = Configuration.objects.all().create(
+        country="NL", organization_type=organization_type, is_reported=True
+    )
+    first = Organization.objects.all().create(name="First", type=organization_type, country="NL")
+    second = Organization.objects.all().create(name="Second", type=organization_type, country="NL")
+
+    create_report(first, now - timedelta(days=30), now - timedelta(days=30))
+    create_report(first, now - timedelta(days=5, hours=2), now - timedelta(days=1))
+    create_report(first, now - timedelta(days=5, hours=1), now - timedelta(days=20))
+    create_report(second, now - timedelta(days=3), now - timedelta(hours=1))
+
+    # an earlier health report of a day is updated
+    MapHealthReport.objects.all().create(
+        map_configuration=configuration,
+        at_when=(now - timedelta(days=2)).date(),
+        percentage_up_to_date=0,
+        percentage_out_of_date=0,
+        outdate_period_in_hours=0,
+        detailed_report={},
+    )
+
+    update_map_health_reports(PUBLISHED_SCAN_TYPES, days=10)
+    assert MapHealthReport.objects.all().count() == 10
+
+    # the same as classifying the latest report of each organization on every day
+    for health_report in MapHealthReport.objects.all():
+        moment = datetime.combine(health_report.at_when, now.timetz())
+        outdated, good = [], []
+        for organization in [first, second]:
+            latest_report = get_latest_report_of_organization(organization, moment)
+            if latest_report:
+                ratings_outdated, ratings_good = split_ratings_between_good_and_bad(latest_report)
+                outdated += ratings_outdated
+                good += ratings_good
+
+        assert health_report.detailed_report == create_health_report(outdated, good, PUBLISHED_SCAN_TYPES)
+
+    today = MapHealthReport.objects.all().get(at_when=now.date()).detailed_report
+    assert today["amount_up_to_date"] == 4
+    assert today["amount_out_of_date"] == 2
+    assert [scan["scan_type"] for scan in today["per_scan"]] == [
+        "tls_qualys_encryption_quality",
+        "dnssec",
+        "plain_https",
+    ]
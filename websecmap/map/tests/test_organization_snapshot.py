@@ -0,0 +1,65 @@
+from datetime import datetime
+
+import pytz
+from freezegun import freeze_time
+
+from websecmap.map.logic.organization_snapshot import rebuild_organization_snapshots, store_organization_snapshot
+from websecmap.map.logic.stats_and_graphs import get_organization_vulnerability_timeline
+from websecmap.map.logic.ticker import get_ticker_data
+from websecmap.map.logic.top import get_top_fail_data
+from websecmap.map.models import OrganizationReport, OrganizationSnapshot
+from websecmap.organizations.models import Coordinate, Organization, OrganizationType
+
+
+def create_report(organization, at_when, high):
+    report = OrganizationReport.objects.all().create(
+        organization=organization, at_when=at_when, high=high, url_issues_high=high, total_urls=1, calculation={}
+    )
+    store_organization_snapshot(report)
+    return report
+
+
+def snapshots(organization):
+    return [
+        (snapshot.day.isoformat(), snapshot.until.isoformat() if snapshot.until else None, snapshot.high)
+        for snapshot in OrganizationSnapshot.objects.all().filter(organization=organization).order_by("day")
+    ]
+
+
+def test_organization_snapshot(db):
+    organization_type, created = OrganizationType.objects.all().get_or_create(name="municipality")
+    organization = Organization.objects.all().create(
+        name="Test", type=organization_type, country="NL", created_on=datetime(2020, 1, 1, tzinfo=pytz.utc)
+    )
+    Coordinate.objects.all().create(
+        organization=organization, geojsontype="Point", area=[4.895168, 52.370216], created_on=organization.created_on
+    )
+
+    create_report(organization, datetime(2020, 1, 1, 10, tzinfo=pytz.utc), 1)
+    create_report(organization, datetime(2020, 1, 3, 10, tzinfo=pytz.utc), 3)
+    # the last report of a day is in the snapshot
+    create_report(organization, datetime(2020, 1, 3, 12, tzinfo=pytz.utc), 4)
+    create_report(organization, datetime(2020, 1, 3, 11, tzinfo=pytz.utc), 5)
+    # a report can be added between existing snapshots
+    create_report(organization, datetime(2020, 1, 2, 10, tzinfo=pytz.utc), 2)
+
+    expected_snapshots = [("2020-01-01", "2020-01-02", 1), ("2020-01-02", "2020-01-03", 2), ("2020-01-03", None, 4)]
+    assert snapshots(organization) == expected_snapshots
+
+    # the backfill creates the same snapshots
+    OrganizationSnapshot.objects.all().delete()
+    rebuild_organization_snapshots([organization.id])
+    assert snapshots(organization) == expected_snapshots
+
+    with freeze_time("2020-01-10"):
+        assert [(stat["date"], stat["high"]) for stat in get_organization_vulnerability_timeline(organization.id)] == [
+            ("2020-01-01", 1),
+            ("2020-01-02", 2),
+            ("2020-01-03", 4),
+        ]
+
+        # the latest snapshot of the organization is used
+        assert [rank["high"] for rank in get_top_fail_data("NL", "municipality")["ranking"]] == [4]
+
+        ticker = get_ticker_data("NL", "municipality", weeks_back=0, weeks_duration=1)
+        assert [(change["high_now"], change["high_then"]) for change in ticker["changes"]] == [(4, 4)]
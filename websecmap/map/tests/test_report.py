@@ -4,7 +4,21 @@ from datetime import datetime
 import pytz
 from freezegun import freeze_time
 
-from websecmap.map.report import reduce_to_days, reduce_to_months, reduce_to_save_data, reduce_to_weeks
+from websecmap.map.models import Configuration, HighLevelStatistic, MapDataCache, MapDataCheckpoint, OrganizationReport
+from websecmap.map.report import (
+    PUBLISHED_SCAN_TYPES,
+    calculate_high_level_stats,
+    calculate_map_data,
+    compose_calculate_map_data_task,
+    create_organization_report_on_moment,
+    default_organization_rating,
+    reduce_to_days,
+    reduce_to_months,
+    reduce_to_save_data,
+    reduce_to_weeks,
+)
+from websecmap.organizations.models import Coordinate, Organization, OrganizationType
+from websecmap.reporting.digest import calculation_digest
 
 
 def test_reduce_to_days():
@@ -148,3 +162,69 @@ def test_reduce_to_save_data():
         )
 
         assert reduce_to_save_data([]) == []
+
+
+def test_calculate_map_data_on_day(db):
+    organization_type, created = OrganizationType.objects.all().get_or_create(name="municipality")
+    Configuration.objects.all().create(country="NL", organization_type=organization_type, is_reported=True)
+    organization = Organization.objects.all().create(
+        name="Test", type=organization_type, country="NL", created_on=datetime(2016, 1, 1, tzinfo=pytz.utc)
+    )
+    Coordinate.objects.all().create(
+        organization=organization, geojsontype="Point", area=[4.895168, 52.370216], created_on=organization.created_on
+    )
+    default_organization_rating([organization.id])
+
+    calculate_map_data(days=2)
+    assert MapDataCache.objects.all().count() == 2 * len(["all"] + PUBLISHED_SCAN_TYPES)
+    assert MapDataCheckpoint.objects.all().count() == 2
+    cached_ids = set(MapDataCache.objects.all().values_list("id", flat=True))
+
+    # yesterday is skipped, today is always calculated again
+    calculate_map_data(days=2)
+    assert MapDataCache.objects.all().count() == 2 * len(["all"] + PUBLISHED_SCAN_TYPES)
+    assert (
+        len(cached_ids & set(MapDataCache.objects.all().values_list("id", flat=True))) == len(PUBLISHED_SCAN_TYPES) + 1
+    )
+
+    # rebuilding the reports invalidates the map data of yesterday
+    OrganizationReport.objects.all().delete()
+    default_organization_rating([organization.id])
+    calculate_map_data(days=2)
+    assert not cached_ids & set(MapDataCache.objects.all().values_list("id", flat=True))
+
+    # the high level statistics are made from the snapshots of these reports
+    calculate_high_level_stats(days=1)
+    assert HighLevelStatistic.objects.all().count() == 1
+
+    # the tasks are divided over chains, of which only a few run at the same time
+    task = compose_calculate_map_data_task(days=7, concurrency=3)
+    assert len(task.tasks) == 3
+    assert [len(chain.tasks) for chain in task.tasks] == [3, 2, 2]
+
+
+def test_create_organization_report_on_moment_only_saves_changes(db):
+    organization_type, created = OrganizationType.objects.all().get_or_create(name="municipality")
+    organization = Organization.objects.all().create(
+        name="Test", type=organization_type, country="NL", created_on=datetime(2016, 1, 1, tzinfo=pytz.utc)
+    )
+    default_organization_rating([organization.id])
+    assert OrganizationReport.objects.all().filter(organization=organization, calculation_digest__isnull=False).count()
+
+    reports = OrganizationReport.objects.all().filter(organization=organization)
+
+    # without urls nothing changes compared to the default rating, so there is no new report
+    create_organization_report_on_moment(organization, datetime(2020, 1, 1, tzinfo=pytz.utc))
+    assert reports.count() == 1
+
+    # also when the previous report was stored before digests were stored
+    reports.update(calculation_digest=None)
+    create_organization_report_on_moment(organization, datetime(2020, 1, 2, tzinfo=pytz.utc))
+    assert reports.count() == 1
+
+    # a changed calculation is saved, with its digest
+    organization.name = "Renamed"
+    organization.save()
+    create_organization_report_on_moment(organization, datetime(2020, 1, 3, tzinfo=pytz.utc))
+    assert reports.count() == 2
+    assert reports.latest().calculation_digest == calculation_digest(reports.latest().calculation)
@@ -0,0 +1,35 @@
+"""
+Digests of report calculations, to see if a calculation changed without comparing the calculations themselves.
+
+The digest does not depend on the order of dictionaries and lists, only on their contents. This gives the same
+outcome as DeepDiff(..., ignore_order=True, report_repetition=True): two calculations with the same digest have
+the same contents, including the amount of times an item is repeated in a list.
+"""
+import hashlib
+import json
+
+
+def calculation_digest(calculation) -> str:
+    return hashlib.sha256(canonical_json(calculation).encode()).hexdigest()
+
+
+def canonical_json(value) -> str:
+    """A json representation where the items of dictionaries and lists are sorted."""
+    if isinstance(value, dict):
+        # Ratings and such only contain values: these are encoded at once, which is many times faster.
+        if not any(isinstance(item, (dict, list, tuple)) for item in value.values()):
+            return json.dumps(value, sort_keys=True, separators=(",", ":"))
+
+        return (
+            "{"
+            + ",".join(
+                f"{json.dumps(key)}:{canonical_json(item)}"
+                for key, item in sorted(value.items(), key=lambda key_and_item: key_and_item[0])
+            )
+            + "}"
+        )
+
+    if isinstance(value, (list, tuple)):
+        return "[" + ",".join(sorted(canonical_json(item) for item in value)) + "]"
+
+    return json.dumps(value)
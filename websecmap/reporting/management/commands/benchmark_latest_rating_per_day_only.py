@@ -0,0 +1,84 @@
+import logging
+import random
+import time
+from copy import copy
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from websecmap.reporting.report import START_DATE, latest_rating_per_day_only
+from websecmap.scanners import ENDPOINT_SCAN_TYPES, URL_SCAN_TYPES
+from websecmap.scanners.models import EndpointGenericScan, UrlGenericScan
+
+log = logging.getLogger(__package__)
+
+
+class Command(BaseCommand):
+    """
+    Micro benchmark of latest_rating_per_day_only on synthetic scans. The scans are not stored in the database, so
+    this can be run on any installation. About one in ten scans collides with another scan on the same moment.
+
+    Example: websecmap benchmark_latest_rating_per_day_only --sizes 10000 100000 1000000
+    """
+
+    help = __doc__
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", nargs="*", type=int, default=[10000, 100000, 1000000])
+        parser.add_argument("--subjects", type=int, default=500, help="Amount of endpoints and urls that are scanned.")
+        parser.add_argument("--seed", type=int, default=42)
+
+    def handle(self, *args, **options):
+        # Every filtered scan is logged on debug level, which would be measured instead of the filtering itself.
+        logging.getLogger("websecmap.reporting").setLevel(logging.INFO)
+
+        for size in options["sizes"]:
+            scans = synthetic_scans(size, options["subjects"], options["seed"])
+
+            start = time.perf_counter()
+            filtered_scans = latest_rating_per_day_only(scans)
+            list_duration = time.perf_counter() - start
+
+            # the same set, but streamed in via a generator
+            start = time.perf_counter()
+            latest_rating_per_day_only(scan for scan in scans)
+            stream_duration = time.perf_counter() - start
+
+            print(
+                f"{size:>9} scans -> {len(filtered_scans):>9} scans: "
+                f"list {list_duration:8.3f}s ({size / list_duration:,.0f} scans/s), "
+                f"stream {stream_duration:8.3f}s ({size / stream_duration:,.0f} scans/s)"
+            )
+
+
+def synthetic_scans(size: int, subjects: int, seed: int):
+    generator = random.Random(seed)
+    endpoint_scan_types = sorted(ENDPOINT_SCAN_TYPES)
+    url_scan_types = sorted(URL_SCAN_TYPES)
+
+    scans = []
+    for i in range(size):
+        if scans and generator.random() < 0.1:
+            # another scan on the same subject, type and moment, which has to be filtered out
+            earlier_scan = generator.choice(scans)
+            scan = copy(earlier_scan)
+            scan.id = i
+            scan.rating_determined_on = earlier_scan.rating_determined_on.replace(second=generator.randrange(60))
+        elif generator.random() < 0.1:
+            scan = UrlGenericScan(
+                id=i, url_id=generator.randrange(subjects), type=generator.choice(url_scan_types), rating="True"
+            )
+        else:
+            scan = EndpointGenericScan(
+                id=i,
+                endpoint_id=generator.randrange(subjects),
+                type=generator.choice(endpoint_scan_types),
+                rating="True",
+            )
+
+        if not scan.rating_determined_on:
+            scan.rating_determined_on = START_DATE + timedelta(minutes=generator.randrange(size), seconds=i % 60)
+        scan.last_scan_moment = scan.rating_determined_on
+        scans.append(scan)
+
+    return scans
@@ -19,7 +19,8 @@ def compose_task(**kwargs) -> Task:
         log.error("No urls found.")
         return group()
 
-    tasks = recreate_url_reports(urls)
+    # This is a rebuild, so don't continue from the latest reports but verify them using the full timeline.
+    tasks = recreate_url_reports([url.id for url in urls], full_rebuild=True)
 
     if not tasks:
         log.error("Could not rebuild reports, filters resulted in no tasks created.")
@@ -2,10 +2,11 @@ import logging
 from collections import defaultdict
 from copy import copy, deepcopy
 from datetime import datetime
-from typing import List, Union
+from typing import Any, Dict, List, Tuple, Union
 
 import pytz
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import Count, Max, Min, Q, Sum
 
 from websecmap.app.constance import constance_cached_value
 from websecmap.celery import app
@@ -22,6 +23,14 @@ log = logging.getLogger(__package__)
 
 START_DATE = datetime(year=2016, month=1, day=1, hour=13, minute=37, second=42, tzinfo=pytz.utc)
 
+# The amount of urls that are handled in a single task when creating url reports. Keep this below the sqlite
+# SQLITE_LIMIT_VARIABLE_NUMBER (999) for development.
+URL_REPORT_BATCH_SIZE = 500
+
+# The amount of url reports that are written in a single insert or update query. Reports contain a large calculation,
+# which has to fit in the maximum packet size of the database.
+URL_REPORT_WRITE_SIZE = 100
+
 """
 Warning: Make sure the output of a rebuild has ID's in chronological order.
 
@@ -46,42 +55,147 @@ def get_allowed_to_report():
 
 
 @app.task(queue="reporting")
-def recreate_url_reports(urls: List[int]) -> List[Task]:
+def recreate_url_reports(urls: List[int], full_rebuild: bool = False) -> List[Task]:
     """Remove the rating of one url and rebuild anew (not anymore)."""
     # to save many hours of computing and tons of IO, try a smarter approach on creating and saving reports.
-    return [(recreate_url_report.si(url_id)) for url_id in urls]
+    # Urls are handled in batches, so the timelines of all urls in a batch are retrieved in just a few queries.
+    return [
+        (recreate_url_report_batch.si(list(url_ids), full_rebuild))
+        for url_ids in in_chunks(list(urls), URL_REPORT_BATCH_SIZE)
+    ]
+
+
+@app.task(queue="reporting")
+def recreate_url_report_batch(url_ids: List[int], full_rebuild: bool = False):
+    """
+    The same as recreate_url_report, but for a batch of urls. Instead of running the five or six queries that make a
+    timeline for every url, the happenings of all urls are retrieved at once and are split per url in memory.
+    """
+    urls = list(
+        Url.objects.all()
+        .filter(id__in=url_ids)
+        .only("id", "url", "is_dead", "is_dead_since", "not_resolvable", "not_resolvable_since")
+    )
+    if not urls:
+        return
+
+    latest_reports = get_latest_url_reports(url_ids)
+    # Without a full rebuild, the timeline of a url is resumed from its latest report.
+    resumable_reports = {} if full_rebuild else latest_reports
+    since_per_url = {
+        url_id: report.at_when.replace(second=0, microsecond=0) for url_id, report in resumable_reports.items()
+    }
+    timelines = create_timelines(urls, since_per_url=since_per_url)
+    states = restore_url_report_states(urls, resumable_reports)
+
+    # A full rebuild only stores the reports that are not in the database yet, for that the amount is needed.
+    amount_of_reports = count_url_reports(url_ids) if full_rebuild else {}
+
+    # All reports of the batch are written at once at the end, instead of one query per report.
+    changes = empty_url_report_changes()
+    for url in urls:
+        if url.id in resumable_reports:
+            collect_new_url_reports(
+                changes, url, resumable_reports[url.id], timeline=timelines[url.id], state=states[url.id]
+            )
+        else:
+            collect_rebuilt_url_reports(
+                changes,
+                url,
+                create_url_reports(url, timeline=timelines[url.id]),
+                amount_of_existing_reports=amount_of_reports.get(url.id, 0),
+                latest_report=latest_reports.get(url.id, None),
+            )
+
+    save_url_report_changes(changes)
+
+
+def get_latest_url_reports(url_ids: List[int]) -> Dict[int, UrlReport]:
+    # The latest report has the highest id, as reports are added chronologically.
+    latest_ids = (
+        UrlReport.objects.all()
+        .filter(url__in=url_ids)
+        .values("url")
+        .annotate(latest_id=Max("id"))
+        .values_list("latest_id", flat=True)
+    )
+    return {report.url_id: report for report in UrlReport.objects.all().filter(id__in=list(latest_ids))}
+
+
+def count_url_reports(url_ids: List[int]) -> Dict[int, int]:
+    return {
+        row["url"]: row["amount"]
+        for row in UrlReport.objects.all().filter(url__in=url_ids).values("url").annotate(amount=Count("id"))
+    }
 
 
 @app.task(queue="reporting")
-def recreate_url_report(url_id):
+def recreate_url_report(url_id, full_rebuild: bool = False):
     """
     This used to rebuild all reports every night. This works fine until there are a lot of urls and a lot of
     scan moments to address. It would rebuild 816088 rows on production each night while there are only
     60.000 urls. Only adding the latest report, if anything changed at all, will reduce 90% of the workload.
+
+    Even only adding the latest report meant building the entire timeline of a url, which is slow for urls with
+    years of history. So by default only the moments after the latest report are built. The full rebuild is still
+    available (full_rebuild=True) to verify the incremental results or when the reported scan types changed.
     """
-    url = Url.objects.all().filter(id=url_id).only("id", "url").first()
+    url = (
+        Url.objects.all()
+        .filter(id=url_id)
+        .only("id", "url", "is_dead", "is_dead_since", "not_resolvable", "not_resolvable_since")
+        .first()
+    )
     if not url:
         return
 
+    # latest and last() are equivalent because of the sequential nature of adding reports to the database.
+    latest_report = UrlReport.objects.all().filter(url=url_id).last()
+    if latest_report and not full_rebuild:
+        return append_new_url_reports(url, latest_report)
+
     # Creating a timeline and rating it is much faster than doing an individual calculation.
     # Mainly because it gets all data in just a few queries and then builds upon that.
     # Returns chronologically ordered url reports:
     url_reports: List[Union[UrlReport, None]] = create_url_reports(url)
+    save_rebuilt_url_reports(url, url_reports)
+
+
+def save_rebuilt_url_reports(url: Url, url_reports: List[UrlReport]):
+    """Stores the reports of a complete timeline, only the reports that are not in the database are added."""
+    changes = empty_url_report_changes()
+    collect_rebuilt_url_reports(
+        changes,
+        url,
+        url_reports,
+        amount_of_existing_reports=UrlReport.objects.all().filter(url=url.id).count(),
+        latest_report=UrlReport.objects.all().filter(url=url.id).last(),
+    )
+    save_url_report_changes(changes)
+
+
+def collect_rebuilt_url_reports(
+    changes: Dict[str, List[UrlReport]],
+    url: Url,
+    url_reports: List[UrlReport],
+    amount_of_existing_reports: int,
+    latest_report: Union[UrlReport, None],
+):
+    """
+    Determines what to store of the reports of a complete timeline, see save_url_report_changes.
+
+    :param amount_of_existing_reports: the amount of reports of this url in the database.
+    :param latest_report: the report of this url with the highest id, if any.
+    """
 
     # in cases where there is nothing to report at all.
     if not url_reports:
         log.debug(f"Found no url reports for {url.url}. Skipping.")
         return
 
-    # log.debug(url_reports)
-
     # No new reports: the amount of items in the timeline(+rules) is the same as the existing reports.
-    amount_of_existing_reports = UrlReport.objects.all().filter(url=url_id).count()
     if amount_of_existing_reports == len(url_reports):
         log.debug(f"There are no new reports for {url.url}. Updating the latest one to contain latest scan info.")
-        # latest and last() are equivalent because of the sequential nature of adding reports to the database.
-        # Comparison on an integer is faster, so we're using last().
-        latest_report = UrlReport.objects.all().filter(url=url_id).last()
         if not latest_report.is_the_newest:
             # A bug introduced before made dead / not_resolvable ursl not the latest:
             if not url.is_dead and not url.not_resolvable:
@@ -91,10 +205,9 @@ def recreate_url_report(url_id):
                     "Attempting to delete not the latest report, this should not occur!",
                     extra={"url": url.url, "report_id": latest_report.id},
                 )
-        latest_report.delete()
+        changes["delete"].append(latest_report)
         # [1, 2, 3][-1:].pop()
-        new_latest_report = url_reports[-1:].pop()
-        new_latest_report.save()
+        changes["create"].append(url_reports[-1:].pop())
     else:
         # There are new reports, at least one. See how many are new and add them.
         # As there can be many scans a day, there will probably be many reports created that day.
@@ -102,16 +215,13 @@ def recreate_url_report(url_id):
         log.debug(f"Adding {amount_of_new_reports} to {url.url}.")
 
         # The current latest report isn't the latest anymore:
-        latest_report = UrlReport.objects.all().filter(url=url_id).last()
         if latest_report:
             latest_report.is_the_newest = False
-            latest_report.save()
+            changes["update"].append(latest_report)
 
         # the last N new_reports are probably actually new and should be added to the database. All prior reports
         # are kept as is. Should only save the few new scans of today.
-        new_reports = url_reports[-amount_of_new_reports:]
-        for new_report in new_reports:
-            new_report.save()
+        changes["create"].extend(url_reports[-amount_of_new_reports:])
 
     # Old logic of just deleting everything and saving it (not even in bulk)
     # UrlReport.objects.all().filter(url=url).delete()
@@ -119,7 +229,254 @@ def recreate_url_report(url_id):
     #   url_report.save()
 
 
-def significant_moments(urls: List[Url] = None, reported_scan_types: List[str] = None):
+def append_new_url_reports(url: Url, latest_report: UrlReport, timeline=None):
+    """
+    Adds the reports that happened after the latest report. The first new report can be on the same moment as the
+    latest report, when that happens the latest report is replaced. This is also what happens when there is nothing
+    new: the latest report is updated to contain the latest scan info.
+    """
+    changes = empty_url_report_changes()
+    collect_new_url_reports(changes, url, latest_report, timeline=timeline)
+    save_url_report_changes(changes)
+
+
+def collect_new_url_reports(
+    changes: Dict[str, List[UrlReport]], url: Url, latest_report: UrlReport, timeline=None, state=None
+):
+    """Determines what to store of the reports after the latest report, see append_new_url_reports."""
+    url_reports = create_url_reports_incrementally(url, latest_report, timeline=timeline, state=state)
+    if not url_reports:
+        log.debug(f"There are no new reports for {url.url}.")
+        return
+
+    # Deleting and saving again keeps the ID's in chronological order.
+    if is_same_moment(url_reports[0].at_when, latest_report.at_when):
+        changes["delete"].append(latest_report)
+    else:
+        latest_report.is_the_newest = False
+        changes["update"].append(latest_report)
+
+    log.debug(f"Adding {len(url_reports)} reports to {url.url}.")
+    changes["create"].extend(url_reports)
+
+
+def empty_url_report_changes() -> Dict[str, List[UrlReport]]:
+    return {"delete": [], "update": [], "create": []}
+
+
+def save_url_report_changes(changes: Dict[str, List[UrlReport]]):
+    """
+    Writes the collected reports of one or more urls in a single transaction: first the replaced reports are
+    deleted, then the reports that are not the newest anymore are updated and finally the new reports are inserted.
+
+    New reports are inserted in the order they were collected. As the reports of a url are collected
+    chronologically, the ID's of the reports of a url stay in chronological order.
+    """
+    if not any(changes.values()):
+        return
+
+    with transaction.atomic():
+        if changes["delete"]:
+            UrlReport.objects.all().filter(id__in=[report.id for report in changes["delete"]]).delete()
+        if changes["update"]:
+            UrlReport.objects.bulk_update(changes["update"], ["is_the_newest"], batch_size=URL_REPORT_WRITE_SIZE)
+        if changes["create"]:
+            UrlReport.objects.bulk_create(changes["create"], batch_size=URL_REPORT_WRITE_SIZE)
+
+
+def create_url_reports_incrementally(
+    url: Url, latest_report: UrlReport, timeline=None, state: Dict[str, Any] = None
+) -> List[UrlReport]:
+    """
+    Resumes the timeline of a url from the latest persisted report, instead of building the timeline from the
+    first scan ever. Only scans, dead endpoints and dead urls from the moment of the latest report are retrieved.
+
+    The moment of the latest report is always included in the result (if there is anything to report on that
+    moment), so the latest report gets the latest scan information. This is the same behaviour as the full rebuild.
+
+    Note that the state is restored from the latest report: if the scan types that are allowed to be reported
+    changed, run a full rebuild to get the same results.
+
+    A timeline that was already created from the moment of the latest report can be given, see create_timelines.
+    The same goes for the state that was restored from the latest report, see restore_url_report_states.
+    """
+    if state is None:
+        state = restore_url_report_state(url, latest_report)
+
+    # A url that died or became unresolvable after being rated has no more reports, the series ends there.
+    if state["url_was_once_rated"] and url_series_has_ended(url, latest_report.at_when):
+        return []
+
+    # Start at the beginning of the moment of the latest report, so scans that happened later on that same moment
+    # are added to that moment. Moments are rounded to the minute.
+    if timeline is None:
+        timeline = create_timeline(url, since=latest_report.at_when.replace(second=0, microsecond=0))
+
+    latest_moment = latest_moment_of_datetime(latest_report.at_when)
+    if latest_moment not in timeline:
+        timeline[latest_moment] = empty_timeline_moment()
+
+    return create_url_reports(url, timeline=timeline, state=state)
+
+
+def restore_url_report_state(url: Url, report: UrlReport) -> Dict[str, Any]:
+    """
+    Restores what create_url_reports knows about the past after creating the given report: the endpoints that are
+    in the report, the latest scans per endpoint and scan type, the latest url scans and the dead endpoints.
+    """
+    return restore_url_report_states([url], {url.id: report})[url.id]
+
+
+def restore_url_report_states(urls: List[Url], reports: Dict[int, UrlReport]) -> Dict[int, Dict[str, Any]]:
+    """
+    The same as restore_url_report_state, for every url that has a report. Instead of running a handful of queries
+    per url, the state of all urls is retrieved at once and is split per url in memory.
+
+    The scans are retrieved using the scan id's that are stored in the calculation. Repeated findings and older
+    reports do not contain these id's, those are looked up by their type and moment.
+    """
+    urls = [url for url in urls if url.id in reports]
+    states = {url.id: empty_url_report_state() for url in urls}
+    if not urls:
+        return states
+
+    url_ids = [url.id for url in urls]
+    endpoint_ids = [endpoint["id"] for url in urls for endpoint in reports[url.id].calculation["endpoints"]]
+    endpoints = {endpoint.id: endpoint for endpoint in Endpoint.objects.all().filter(id__in=endpoint_ids)}
+
+    scan_ids = [
+        rating["scan"]
+        for url in urls
+        for endpoint in reports[url.id].calculation["endpoints"]
+        for rating in endpoint["ratings"]
+        if rating.get("scan", None)
+    ]
+    endpoint_scans = {
+        scan.pk: scan for scan in EndpointGenericScan.objects.all().filter(pk__in=scan_ids).select_related("endpoint")
+    }
+
+    scan_ids = [
+        rating["scan"] for url in urls for rating in reports[url.id].calculation["ratings"] if rating.get("scan", None)
+    ]
+    url_scans = {scan.pk: scan for scan in UrlGenericScan.objects.all().filter(pk__in=scan_ids)}
+
+    # The scans that could not be found by their id are looked up for all urls in a single query per scan model.
+    missing_endpoint_scans = Q()
+    missing_url_scans = Q()
+    for url in urls:
+        report = reports[url.id]
+        missing_endpoint_ids, missing_endpoint_types = set(), set()
+        for endpoint in report.calculation["endpoints"]:
+            for rating in endpoint["ratings"]:
+                scan = endpoint_scans.get(rating.get("scan", None), None)
+                if not scan or scan.endpoint_id != endpoint["id"]:
+                    missing_endpoint_ids.add(endpoint["id"])
+                    missing_endpoint_types.add(rating["type"])
+        if missing_endpoint_ids:
+            missing_endpoint_scans |= Q(
+                endpoint__in=missing_endpoint_ids,
+                type__in=missing_endpoint_types,
+                rating_determined_on__lte=report.at_when,
+            )
+
+        missing_url_types = set()
+        for rating in report.calculation["ratings"]:
+            scan = url_scans.get(rating.get("scan", None), None)
+            if not scan or scan.url_id != url.id:
+                missing_url_types.add(rating["type"])
+        if missing_url_types:
+            missing_url_scans |= Q(url=url.id, type__in=missing_url_types, rating_determined_on__lte=report.at_when)
+
+    latest_endpoint_scans = {}
+    if missing_endpoint_scans:
+        for scan in (
+            EndpointGenericScan.objects.all()
+            .filter(missing_endpoint_scans)
+            .select_related("endpoint")
+            .order_by("rating_determined_on")
+        ):
+            latest_endpoint_scans[(scan.endpoint_id, scan.type)] = scan
+
+    latest_url_scans = {}
+    if missing_url_scans:
+        for scan in UrlGenericScan.objects.all().filter(missing_url_scans).order_by("rating_determined_on"):
+            latest_url_scans[(scan.url_id, scan.type)] = scan
+
+    dead_endpoints = defaultdict(set)
+    for endpoint in Endpoint.objects.all().filter(url__in=url_ids, is_dead=True, is_dead_since__isnull=False):
+        if endpoint.is_dead_since <= reports[endpoint.url_id].at_when:
+            dead_endpoints[endpoint.url_id].add(endpoint)
+
+    # Only reports with endpoints can have rated the url, which might have been in an earlier report.
+    first_rated = {
+        row["url"]: row["first_rated"]
+        for row in UrlReport.objects.all()
+        .filter(url__in=[url.id for url in urls if not reports[url.id].calculation["endpoints"]], total_endpoints__gt=0)
+        .values("url")
+        .annotate(first_rated=Min("at_when"))
+    }
+
+    for url in urls:
+        report, state = reports[url.id], states[url.id]
+
+        for endpoint in report.calculation["endpoints"]:
+            if endpoint["id"] not in endpoints:
+                # the endpoint was deleted since the report was made
+                continue
+
+            ratings = {}
+            for rating in endpoint["ratings"]:
+                scan = endpoint_scans.get(rating.get("scan", None), None)
+                if not scan or scan.endpoint_id != endpoint["id"]:
+                    scan = latest_endpoint_scans.get((endpoint["id"], rating["type"]), None)
+                if scan:
+                    ratings[rating["type"]] = scan
+
+            state["previous_endpoints"].append(endpoints[endpoint["id"]])
+            state["previous_endpoint_ratings"][endpoint["id"]] = ratings
+
+        ratings = {}
+        for rating in report.calculation["ratings"]:
+            scan = url_scans.get(rating.get("scan", None), None)
+            if not scan or scan.url_id != url.id:
+                scan = latest_url_scans.get((url.id, rating["type"]), None)
+            if scan:
+                ratings[rating["type"]] = scan
+        state["previous_url_ratings"][url.id] = ratings
+
+        state["dead_endpoints"] = dead_endpoints[url.id]
+        state["url_was_once_rated"] = bool(report.calculation["endpoints"]) or (
+            url.id in first_rated and first_rated[url.id] <= report.at_when
+        )
+
+    return states
+
+
+def url_series_has_ended(url: Url, moment: datetime) -> bool:
+    if url.not_resolvable and url.not_resolvable_since and url.not_resolvable_since <= moment:
+        return True
+
+    if url.is_dead and url.is_dead_since and url.is_dead_since <= moment:
+        return True
+
+    return False
+
+
+def is_same_moment(some_datetime: datetime, other_datetime: datetime) -> bool:
+    return latest_moment_of_datetime(some_datetime) == latest_moment_of_datetime(other_datetime)
+
+
+def empty_url_report_state() -> Dict[str, Any]:
+    return {
+        "previous_endpoint_ratings": {},
+        "previous_url_ratings": {},
+        "previous_endpoints": [],
+        "url_was_once_rated": False,
+        "dead_endpoints": set(),
+    }
+
+
+def significant_moments(urls: List[Url] = None, reported_scan_types: List[str] = None, since: datetime = None):
     """
     Searches for all significant point in times that something changed. The goal is to save
     unneeded queries when rebuilding ratings. When you know when things changed, you know
@@ -135,6 +492,8 @@ def significant_moments(urls: List[Url] = None, reported_scan_types: List[str] =
 
     Note: something is considered alive again after a scan has been found on the endpoint or url.
 
+    When since is given, only happenings from that moment on are retrieved. This is used to resume a timeline.
+
     :return:
     """
 
@@ -144,6 +503,57 @@ def significant_moments(urls: List[Url] = None, reported_scan_types: List[str] =
         log.info("No urls, so no moments")
         return []
 
+    happenings = retrieve_happenings(urls, reported_scan_types, since)
+    return moments_from_happenings(happenings)
+
+
+def significant_moments_per_url(
+    urls: List[Url], reported_scan_types: List[str], since_per_url: Dict[int, datetime] = None
+) -> Dict[int, Tuple[List[datetime], Dict[str, List]]]:
+    """
+    The same as significant_moments, but for a batch of urls: all happenings are retrieved in a few queries and
+    then split per url. The moments and happenings per url are exactly the same as from significant_moments.
+
+    :param since_per_url: url id -> moment, only happenings from this moment will be included for that url.
+    :return: url id -> (moments, happenings)
+    """
+    since_per_url = since_per_url or {}
+
+    # The entire history is only retrieved for the urls that need it, the others only from the earliest moment.
+    urls_with_since = [url for url in urls if url.id in since_per_url]
+    urls_without_since = [url for url in urls if url.id not in since_per_url]
+
+    happenings_per_url = {url.id: empty_happenings() for url in urls}
+    if urls_with_since:
+        since = min(since_per_url[url.id] for url in urls_with_since)
+        add_happenings_per_url(happenings_per_url, retrieve_happenings(urls_with_since, reported_scan_types, since))
+    if urls_without_since:
+        add_happenings_per_url(happenings_per_url, retrieve_happenings(urls_without_since, reported_scan_types))
+
+    moments_per_url = {}
+    for url_id, url_happenings in happenings_per_url.items():
+        url_since = since_per_url.get(url_id, None)
+        if url_since:
+            url_happenings = happenings_since(url_happenings, url_since)
+        moments_per_url[url_id] = moments_from_happenings(url_happenings)
+
+    return moments_per_url
+
+
+def add_happenings_per_url(happenings_per_url: Dict[int, Dict[str, List]], happenings: Dict[str, List]):
+    for scan in happenings["endpoint_scans"]:
+        happenings_per_url[scan.endpoint.url_id]["endpoint_scans"].append(scan)
+    for scan in happenings["url_scans"]:
+        happenings_per_url[scan.url_id]["url_scans"].append(scan)
+    for endpoint in happenings["dead_endpoints"]:
+        happenings_per_url[endpoint.url_id]["dead_endpoints"].append(endpoint)
+    for non_resolvable_url in happenings["non_resolvable_urls"]:
+        happenings_per_url[non_resolvable_url.id]["non_resolvable_urls"].append(non_resolvable_url)
+    for dead_url in happenings["dead_urls"]:
+        happenings_per_url[dead_url.id]["dead_urls"].append(dead_url)
+
+
+def retrieve_happenings(urls: List[Url], reported_scan_types: List[str], since: datetime = None) -> Dict[str, List]:
     # since we want to know all about these endpoints, get them at the same time, which is faster.
     # Otherwise related objects where requested at create timeline.
     # Difference:
@@ -164,21 +574,62 @@ def significant_moments(urls: List[Url] = None, reported_scan_types: List[str] =
         .prefetch_related("endpoint")
         .defer("endpoint__url")
     )
-    endpoint_scans = latest_rating_per_day_only(endpoint_scans)
+    url_scans = UrlGenericScan.objects.all().filter(type__in=reported_scan_types, url__in=urls).prefetch_related("url")
+    dead_endpoints = Endpoint.objects.all().filter(url__in=urls, is_dead=True)
+    non_resolvable_urls = Url.objects.filter(not_resolvable=True, url__in=urls)
+    dead_urls = Url.objects.filter(is_dead=True, url__in=urls)
+
+    if since:
+        endpoint_scans = endpoint_scans.filter(rating_determined_on__gte=since)
+        url_scans = url_scans.filter(rating_determined_on__gte=since)
+        dead_endpoints = dead_endpoints.filter(is_dead_since__gte=since)
+        non_resolvable_urls = non_resolvable_urls.filter(not_resolvable_since__gte=since)
+        dead_urls = dead_urls.filter(is_dead_since__gte=since)
+
+    return {
+        "endpoint_scans": list(endpoint_scans),
+        "url_scans": list(url_scans),
+        "dead_endpoints": list(dead_endpoints),
+        "non_resolvable_urls": list(non_resolvable_urls),
+        "dead_urls": list(dead_urls),
+    }
+
+
+def happenings_since(happenings: Dict[str, List], since: datetime) -> Dict[str, List]:
+    # The same filter as in retrieve_happenings, so a batch can be retrieved once and filtered per url.
+    return {
+        "endpoint_scans": [x for x in happenings["endpoint_scans"] if x.rating_determined_on >= since],
+        "url_scans": [x for x in happenings["url_scans"] if x.rating_determined_on >= since],
+        "dead_endpoints": [x for x in happenings["dead_endpoints"] if x.is_dead_since and x.is_dead_since >= since],
+        "non_resolvable_urls": [
+            x for x in happenings["non_resolvable_urls"] if x.not_resolvable_since and x.not_resolvable_since >= since
+        ],
+        "dead_urls": [x for x in happenings["dead_urls"] if x.is_dead_since and x.is_dead_since >= since],
+    }
+
+
+def empty_happenings() -> Dict[str, List]:
+    return {
+        "endpoint_scans": [],
+        "url_scans": [],
+        "dead_endpoints": [],
+        "non_resolvable_urls": [],
+        "dead_urls": [],
+    }
+
+
+def moments_from_happenings(happenings: Dict[str, List]):
+    endpoint_scans = latest_rating_per_day_only(happenings["endpoint_scans"])
     endpoint_scan_dates = [x.rating_determined_on for x in endpoint_scans]
 
-    url_scans = UrlGenericScan.objects.all().filter(type__in=reported_scan_types, url__in=urls).prefetch_related("url")
-    url_scans = latest_rating_per_day_only(url_scans)
+    url_scans = latest_rating_per_day_only(happenings["url_scans"])
     url_scan_dates = [x.rating_determined_on for x in url_scans]
 
-    dead_endpoints = Endpoint.objects.all().filter(url__in=urls, is_dead=True)
-    dead_scan_dates = [x.is_dead_since for x in dead_endpoints]
+    dead_scan_dates = [x.is_dead_since for x in happenings["dead_endpoints"]]
 
-    non_resolvable_urls = Url.objects.filter(not_resolvable=True, url__in=urls)
-    non_resolvable_dates = [x.not_resolvable_since for x in non_resolvable_urls]
+    non_resolvable_dates = [x.not_resolvable_since for x in happenings["non_resolvable_urls"]]
 
-    dead_urls = Url.objects.filter(is_dead=True, url__in=urls)
-    dead_url_dates = [x.is_dead_since for x in dead_urls]
+    dead_url_dates = [x.is_dead_since for x in happenings["dead_urls"]]
 
     # reduce this to one moment per day only, otherwise there will be a report for every change
     # which is highly inefficient. Using the latest possible time of the day is used.
@@ -188,13 +639,7 @@ def significant_moments(urls: List[Url] = None, reported_scan_types: List[str] =
 
     # If there are no scans at all, just return instead of storing useless junk or make other mistakes
     if not moments:
-        return [], {
-            "endpoint_scans": [],
-            "url_scans": [],
-            "dead_endpoints": [],
-            "non_resolvable_urls": [],
-            "dead_urls": [],
-        }
+        return [], empty_happenings()
 
     # make sure you don't save the scan for today at the end of the day (which would make it visible only at the end
     # of the day). Just make it "now" so you can immediately see the results.
@@ -208,9 +653,9 @@ def significant_moments(urls: List[Url] = None, reported_scan_types: List[str] =
     happenings = {
         "endpoint_scans": endpoint_scans,
         "url_scans": url_scans,
-        "dead_endpoints": dead_endpoints,
-        "non_resolvable_urls": non_resolvable_urls,
-        "dead_urls": dead_urls,
+        "dead_endpoints": happenings["dead_endpoints"],
+        "non_resolvable_urls": happenings["non_resolvable_urls"],
+        "dead_urls": happenings["dead_urls"],
     }
     # count_queries()
     return moments, happenings
@@ -263,66 +708,53 @@ def latest_rating_per_day_only(scans):
     It's possible to have scans from a series of endpoints/urls.
     """
     # we don't want to care about the order the scans came in: it can by any set of scans in any order, and it will
-    # get the correct result quickly. For this we use a hash table of all scans, matched with the scan.
-
-    hash_table = []
-    # build the hash table
+    # get the correct result quickly. For this we use an index of all scans, keyed on subject, type and moment.
+    # Every scan is looked at once, so any iterable of scans can be used, also a streaming one (queryset.iterator()).
+    index = {}
     for scan in scans:
         # A combination that is unique, enough to identify a scan, but that will cause a collision if we don't
         # filter out the problematic values.
-        hash = hash_scan_per_day_and_type(scan)
+        key = hash_scan_per_day_and_type(scan)
+        existing_scan = index.get(key, None)
+
         # use a high precision here, since we want to have the absolute latest scan
         # only when a rating changes, a new scan is added, this makes it fairly easy to get the latest
-        if not in_hash_table(hash_table, hash):
-            hash_table.append({"hash": hash, "scan": scan})
+        if existing_scan is None:
+            index[key] = scan
+            continue
+
+        # here is where the magic happens: only the scan with the highest rating_determined_on can stay
+        if existing_scan.rating_determined_on < scan.rating_determined_on:
+            # Due to the ordering of the scans, usually this message will NEVER appear and the first scan
+            # was always the latest. Perhaps per database this default ordering differs.
+            log.debug(
+                "Scan ID %s on %s had also another scan today that had a rating that lasted longer.", scan.pk, scan.type
+            )
+            # The replacing scan is placed at the end, which is the order this function always returned.
+            del index[key]
+            index[key] = scan
         else:
-            # here is where the magic happens: only the scan with the highest rating_determined_on can stay
-            # find the one, check it and replace it.
-            existing_item = in_hash_table(hash_table, hash)
-            if existing_item["scan"].rating_determined_on < scan.rating_determined_on:
-                # Due to the ordering of the scans, usually this message will NEVER appear and the first scan
-                # was always the latest. Perhaps per database this default ordering differs. Since we don't have
-                # testcases, i don't dare to touch the rest of this code.
-                log.debug(
-                    "Scan ID %s on %s had also another scan today that had a rating that lasted longer."
-                    % (scan.pk, scan.type)
-                )
-                hash_table.remove(existing_item)
-                hash_table.append({"hash": hash, "scan": scan})
-            else:
-                log.debug(
-                    "Scan ID %s on %s had also another scan today that had a rating that lasted shorter. IGNORED"
-                    % (scan.pk, scan.type)
-                )
+            log.debug(
+                "Scan ID %s on %s had also another scan today that had a rating that lasted shorter. IGNORED",
+                scan.pk,
+                scan.type,
+            )
 
     # return a list of scans:
-    filtered_scans = []
-    for hash in hash_table:
-        filtered_scans.append(hash["scan"])
-
-    return filtered_scans
-
+    return list(index.values())
 
-def in_hash_table(hash_table, hash):
-    # https://stackoverflow.com/questions/8653516/python-list-of-dictionaries-search
-    try:
-        return next((item for item in hash_table if item["hash"] == hash))
 
-    except StopIteration:
-        return False
-
-
-def hash_scan_per_day_and_type(scan):
-    # hopefully it doesn't run extra queries?
+def hash_scan_per_day_and_type(scan) -> Tuple[int, str, datetime]:
+    # Use the id's of the related objects instead of the objects, so no extra queries are performed.
     if scan.type in URL_SCAN_TYPES:
-        pk = scan.url.pk
+        pk = scan.url_id
     else:
-        pk = scan.endpoint.pk
+        pk = scan.endpoint_id
 
-    return "%s%s%s" % (pk, scan.type, scan.rating_determined_on.replace(second=59, microsecond=999999))
+    return pk, scan.type, scan.rating_determined_on.replace(second=59, microsecond=999999)
 
 
-def create_timeline(url: Url):
+def create_timeline(url: Url, since: datetime = None):
     """
     Maps happenings to moments.
 
@@ -341,21 +773,34 @@ def create_timeline(url: Url):
     01-04-2017 - TLS scan update
                  HTTP Scan update
 
+    :param since: only create the timeline from this moment, see significant_moments.
     :return:
     """
-    moments, happenings = significant_moments(urls=[url], reported_scan_types=get_allowed_to_report())
+    moments, happenings = significant_moments(urls=[url], reported_scan_types=get_allowed_to_report(), since=since)
+    return timeline_from_happenings(moments, happenings)
+
+
+def create_timelines(urls: List[Url], since_per_url: Dict[int, datetime] = None) -> Dict[int, Dict]:
+    """
+    Creates the timelines of a batch of urls, using significant_moments_per_url.
+
+    :param since_per_url: url id -> moment, only create the timeline of the url from this moment.
+    :return: url id -> timeline
+    """
+    moments_per_url = significant_moments_per_url(urls, get_allowed_to_report(), since_per_url=since_per_url)
+    return {
+        url_id: timeline_from_happenings(moments, happenings)
+        for url_id, (moments, happenings) in moments_per_url.items()
+    }
+
 
+def timeline_from_happenings(moments, happenings):
     timeline = {}
 
     # reduce to date only, it's not useful to show 100 things on a day when building history.
     for moment in moments:
         moment_date = moment.replace(second=59, microsecond=999999)
-        timeline[moment_date] = {}
-        timeline[moment_date]["endpoints"] = []
-        timeline[moment_date]["endpoint_scans"] = []
-        timeline[moment_date]["url_scans"] = []
-        timeline[moment_date]["dead_endpoints"] = []
-        timeline[moment_date]["urls"] = []
+        timeline[moment_date] = empty_timeline_moment()
 
     # sometimes there have been scans on dead endpoints. This is a problem in the database.
     # this code is correct with retrieving those endpoints again.
@@ -411,12 +856,22 @@ def create_timeline(url: Url):
     return timeline
 
 
+def empty_timeline_moment():
+    return {"endpoints": [], "endpoint_scans": [], "url_scans": [], "dead_endpoints": [], "urls": []}
+
+
 def latest_moment_of_datetime(datetime_: datetime):
     return datetime_.replace(second=59, microsecond=999999, tzinfo=pytz.utc)
 
 
-def create_url_reports(url: Url) -> List[UrlReport]:
-    timeline = create_timeline(url)
+def create_url_reports(url: Url, timeline=None, state: Dict[str, Any] = None) -> List[UrlReport]:
+    if timeline is None:
+        timeline = create_timeline(url)
+
+    # The state contains what is known from before the timeline, which allows to continue a timeline.
+    if state is None:
+        state = empty_url_report_state()
+
     url_reports: List[Union[UrlReport, None]] = []
 
     """
@@ -437,11 +892,11 @@ def create_url_reports(url: Url) -> List[UrlReport]:
     """
 
     log.info("Rebuilding ratings for url %s on %s moments" % (url, len(timeline)))
-    previous_endpoint_ratings = {}
-    previous_url_ratings = {}
-    previous_endpoints = []
-    url_was_once_rated = False
-    dead_endpoints = set()
+    previous_endpoint_ratings = state["previous_endpoint_ratings"]
+    previous_url_ratings = state["previous_url_ratings"]
+    previous_endpoints = state["previous_endpoints"]
+    url_was_once_rated = state["url_was_once_rated"]
+    dead_endpoints = state["dead_endpoints"]
 
     # work on a sorted timeline as otherwise this code is non-deterministic!
     for index, moment in enumerate(sorted(timeline)):
@@ -1145,6 +1600,111 @@ def aggegrate_url_rating_scores(url_ratings: List, only_include_issues: List[str
     return scores
 
 
+# Statistics of an organization report that are the sum of the same statistic of its url reports.
+SUMMED_URL_REPORT_STATISTICS = [
+    "high",
+    "medium",
+    "low",
+    "ok",
+    "explained_high",
+    "explained_medium",
+    "explained_low",
+    "explained_high_endpoints",
+    "explained_medium_endpoints",
+    "explained_low_endpoints",
+    "explained_total_url_issues",
+    "explained_url_issues_high",
+    "explained_url_issues_medium",
+    "explained_url_issues_low",
+    "explained_total_endpoint_issues",
+    "explained_endpoint_issues_high",
+    "explained_endpoint_issues_medium",
+    "explained_endpoint_issues_low",
+    "total_endpoints",
+    "high_endpoints",
+    "medium_endpoints",
+    "low_endpoints",
+    "ok_endpoints",
+    "total_url_issues",
+    "total_endpoint_issues",
+    "url_issues_high",
+    "url_issues_medium",
+    "url_issues_low",
+    "endpoint_issues_high",
+    "endpoint_issues_medium",
+    "endpoint_issues_low",
+]
+
+
+def aggegrate_latest_url_report_scores(urls: List[int], when: datetime):
+    """
+    The same as aggegrate_url_rating_scores(get_latest_urlratings_fast(urls, when)), but the statistics are summed
+    by the database, using the statistic columns of the url reports. Only the calculations that are added to the
+    list of urls are loaded.
+
+    :param urls: ids of urls
+    :param when: the latest url report at or before this moment is used.
+    :return: the same scores as aggegrate_url_rating_scores.
+    """
+    scores = {statistic: 0 for statistic in SUMMED_URL_REPORT_STATISTICS}
+    for statistic in ["total_urls", "high_urls", "medium_urls", "low_urls", "ok_urls"]:
+        scores[statistic] = 0
+    for statistic in ["explained_high_urls", "explained_medium_urls", "explained_low_urls"]:
+        scores[statistic] = 0
+
+    # url can only be in one category (otherwise there are urls in multiple categories which makes it
+    # hard to display)
+    high_url = Q(high_endpoints__gt=0) | Q(url_issues_high__gt=0)
+    medium_url = ~high_url & (Q(medium_endpoints__gt=0) | Q(url_issues_medium__gt=0))
+    low_url = ~high_url & ~medium_url & (Q(low_endpoints__gt=0) | Q(url_issues_low__gt=0))
+
+    url_reports = []
+    for chunk in in_chunks(urls, 100):
+        latest_ids = list(
+            UrlReport.objects.all()
+            .filter(url__in=chunk, at_when__lte=when)
+            .values("url")
+            .annotate(latest_id=Max("id"))
+            .values_list("latest_id", flat=True)
+        )
+        if not latest_ids:
+            continue
+
+        sums = (
+            UrlReport.objects.all()
+            .filter(id__in=latest_ids)
+            .aggregate(
+                *[Sum(statistic) for statistic in SUMMED_URL_REPORT_STATISTICS],
+                ok_urls=Sum("url_ok"),
+                total_urls=Count("id"),
+                high_urls=Count("id", filter=high_url),
+                medium_urls=Count("id", filter=medium_url),
+                low_urls=Count("id", filter=low_url),
+                explained_high_urls=Count("id", filter=Q(explained_url_issues_high__gt=0)),
+                explained_medium_urls=Count("id", filter=Q(explained_url_issues_medium__gt=0)),
+                explained_low_urls=Count("id", filter=Q(explained_url_issues_low__gt=0)),
+            )
+        )
+        for statistic in SUMMED_URL_REPORT_STATISTICS:
+            scores[statistic] += sums.pop(f"{statistic}__sum") or 0
+        for statistic, value in sums.items():
+            scores[statistic] += value or 0
+
+        url_reports += list(
+            UrlReport.objects.all()
+            .filter(id__in=latest_ids)
+            .values_list("high", "medium", "low", "url_id", "calculation")
+        )
+
+    scores["total_issues"] = scores["high"] + scores["medium"] + scores["low"]
+
+    # the worst urls first, the same order as get_latest_urlratings_fast
+    url_reports.sort(key=lambda url_report: (-url_report[0], -url_report[1], -url_report[2], url_report[3]))
+    scores["urls"] = [url_report[4] for url_report in url_reports]
+
+    return scores
+
+
 def remove_issues_from_calculation(calculation, issues):
     # todo: also recalculate here?
     new_url_ratings = []
@@ -0,0 +1,49 @@
+from websecmap.reporting.digest import calculation_digest
+
+
+def test_calculation_digest():
+    calculation = {
+        "organization": {
+            "name": "Test",
+            "high": 1,
+            "urls": [
+                {"url": "example.com", "endpoints": [{"port": 443}, {"port": 80}]},
+                {"url": "example.nl", "endpoints": []},
+            ],
+        }
+    }
+    digest = calculation_digest(calculation)
+
+    # the order of keys and list items does not matter
+    assert digest == calculation_digest(
+        {
+            "organization": {
+                "urls": [
+                    {"endpoints": [], "url": "example.nl"},
+                    {"endpoints": [{"port": 80}, {"port": 443}], "url": "example.com"},
+                ],
+                "high": 1,
+                "name": "Test",
+            }
+        }
+    )
+
+    # repetitions do matter
+    assert digest != calculation_digest(
+        {
+            "organization": {
+                "name": "Test",
+                "high": 1,
+                "urls": [
+                    {"url": "example.com", "endpoints": [{"port": 443}, {"port": 443}, {"port": 80}]},
+                    {"url": "example.nl", "endpoints": []},
+                ],
+            }
+        }
+    )
+
+    # as do values and types
+    assert digest != calculation_digest({"organization": {**calculation["organization"], "high": 2}})
+    assert digest != calculation_digest({"organization": {**calculation["organization"], "high": "1"}})
+    assert calculation_digest([]) != calculation_digest({})
+    assert calculation_digest(None) != calculation_digest({})
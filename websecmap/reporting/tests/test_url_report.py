@@ -3,9 +3,23 @@ from datetime import datetime
 import pytz
 
 from websecmap.organizations.models import Url
+from websecmap.reporting import report
 from websecmap.reporting.models import UrlReport
-from websecmap.reporting.report import create_url_reports, recreate_url_report
-from websecmap.scanners.models import Endpoint, EndpointGenericScan
+from websecmap.reporting.report import (
+    aggegrate_latest_url_report_scores,
+    aggegrate_url_rating_scores,
+    create_timeline,
+    create_timelines,
+    create_url_reports,
+    get_latest_url_reports,
+    get_latest_urlratings_fast,
+    latest_rating_per_day_only,
+    recreate_url_report,
+    recreate_url_report_batch,
+    restore_url_report_states,
+    significant_moments_per_url,
+)
+from websecmap.scanners.models import Endpoint, EndpointGenericScan, UrlGenericScan
 
 
 def test_url_report(db):
@@ -166,3 +180,283 @@ def test_aggegrate_error_in_report(db):
     # This is 0 because this is not an endpoint level error, but an url_level_error
     assert report.url_error_in_test == 0
     assert report.error_in_test == 1
+
+
+def test_incremental_url_report(db):
+    # The incremental reports should be the same as the reports from a full rebuild.
+    day_0 = datetime(day=1, month=1, year=2000, tzinfo=pytz.utc)
+    day_1 = datetime(day=2, month=1, year=2000, tzinfo=pytz.utc)
+    day_2 = datetime(day=3, month=1, year=2000, tzinfo=pytz.utc)
+    day_3 = datetime(day=4, month=1, year=2000, tzinfo=pytz.utc)
+    day_4 = datetime(day=5, month=1, year=2000, tzinfo=pytz.utc)
+
+    url, created = Url.objects.all().get_or_create(url="test.nl", created_on=day_0, not_resolvable=False)
+    first_endpoint, created = Endpoint.objects.all().get_or_create(
+        url=url, protocol="https", port="443", ip_version=4, discovered_on=day_1, is_dead=False
+    )
+
+    def add_scan(endpoint, scan_type, rating, moment):
+        EndpointGenericScan.objects.all().create(
+            endpoint=endpoint,
+            type=scan_type,
+            rating=rating,
+            rating_determined_on=moment,
+            last_scan_moment=moment,
+            comply_or_explain_is_explained=False,
+            is_the_latest_scan=True,
+        )
+
+    add_scan(first_endpoint, "tls_qualys_encryption_quality", "A+", day_1)
+    add_scan(first_endpoint, "tls_qualys_certificate_trusted", "trusted", day_1)
+    recreate_url_report(url.id)
+    assert UrlReport.objects.all().count() == 1
+
+    # A new rating, and a new endpoint with a rating that is the same as on the first endpoint: a repeated finding.
+    add_scan(first_endpoint, "tls_qualys_encryption_quality", "F", day_2)
+    second_endpoint, created = Endpoint.objects.all().get_or_create(
+        url=url, protocol="https", port="443", ip_version=4, discovered_on=day_2, is_dead=False
+    )
+    add_scan(second_endpoint, "tls_qualys_encryption_quality", "B", day_2)
+    recreate_url_report(url.id)
+    assert UrlReport.objects.all().count() == 2
+
+    # Nothing changed, only the latest report is updated
+    recreate_url_report(url.id)
+    assert UrlReport.objects.all().count() == 2
+
+    # The first endpoint dies, scans after that are ignored.
+    first_endpoint.is_dead = True
+    first_endpoint.is_dead_since = day_3
+    first_endpoint.save()
+    add_scan(first_endpoint, "tls_qualys_encryption_quality", "A", day_4)
+    add_scan(second_endpoint, "tls_qualys_certificate_trusted", "not trusted", day_4)
+    recreate_url_report(url.id)
+
+    incremental_reports = list(UrlReport.objects.all().order_by("pk"))
+    full_reports = create_url_reports(url)
+    assert len(incremental_reports) == len(full_reports) == 4
+
+    for incremental_report, full_report in zip(incremental_reports, full_reports):
+        assert incremental_report.at_when == full_report.at_when
+        assert incremental_report.is_the_newest == full_report.is_the_newest
+        assert incremental_report.calculation == full_report.calculation
+
+    # A full rebuild of an up to date url does not add anything
+    recreate_url_report(url.id, full_rebuild=True)
+    assert UrlReport.objects.all().count() == 4
+
+
+def test_url_report_batch(db):
+    # Reports created in a batch are the same as the reports created per url.
+    day_0 = datetime(day=1, month=1, year=2000, tzinfo=pytz.utc)
+    day_1 = datetime(day=2, month=1, year=2000, tzinfo=pytz.utc)
+    day_2 = datetime(day=3, month=1, year=2000, tzinfo=pytz.utc)
+    day_3 = datetime(day=4, month=1, year=2000, tzinfo=pytz.utc)
+
+    urls = []
+    for index, address in enumerate(["test.nl", "example.nl", "nothing.nl"]):
+        url, created = Url.objects.all().get_or_create(url=address, created_on=day_0, not_resolvable=False)
+        urls.append(url)
+
+        # the last url has no endpoints and scans, and will not get any reports
+        if address == "nothing.nl":
+            continue
+
+        endpoint, created = Endpoint.objects.all().get_or_create(
+            url=url, protocol="https", port="443", ip_version=4, discovered_on=day_1, is_dead=False
+        )
+        for moment, rating in [(day_1, "A"), (day_2 if index else day_3, "F")]:
+            EndpointGenericScan.objects.all().create(
+                endpoint=endpoint,
+                type="tls_qualys_encryption_quality",
+                rating=rating,
+                rating_determined_on=moment,
+                last_scan_moment=moment,
+                comply_or_explain_is_explained=False,
+                is_the_latest_scan=True,
+            )
+
+    timelines = create_timelines(urls)
+    for url in urls:
+        assert timelines[url.id] == create_timeline(url)
+
+    recreate_url_report_batch([url.id for url in urls])
+    assert UrlReport.objects.all().count() == 4
+
+    # the second url becomes not resolvable, which adds a report for that url only.
+    urls[1].not_resolvable = True
+    urls[1].not_resolvable_since = day_3
+    urls[1].save()
+    recreate_url_report_batch([url.id for url in urls])
+
+    for url in urls:
+        batch_reports = list(UrlReport.objects.all().filter(url=url).order_by("pk"))
+        full_reports = create_url_reports(url)
+        assert len(batch_reports) == len(full_reports)
+        for batch_report, full_report in zip(batch_reports, full_reports):
+            assert batch_report.at_when == full_report.at_when
+            assert batch_report.calculation == full_report.calculation
+
+    # a full rebuild of the batch changes nothing, except for the latest reports being stored again.
+    recreate_url_report_batch([url.id for url in urls], full_rebuild=True)
+    assert UrlReport.objects.all().count() == 5
+
+    for url in urls:
+        # reports are written in bulk, the ID's are still in chronological order and only the last one is the newest.
+        reports = list(UrlReport.objects.all().filter(url=url).order_by("pk"))
+        assert [report.at_when for report in reports] == sorted(report.at_when for report in reports)
+        assert [report.is_the_newest for report in reports] == [False] * (len(reports) - 1) + [True] * bool(reports)
+
+
+def test_restore_url_report_states(db, django_assert_num_queries):
+    # The state of a batch of urls is restored with the same amount of queries, no matter the size of the batch.
+    day_0 = datetime(day=1, month=1, year=2000, tzinfo=pytz.utc)
+    day_1 = datetime(day=2, month=1, year=2000, tzinfo=pytz.utc)
+    day_2 = datetime(day=3, month=1, year=2000, tzinfo=pytz.utc)
+    day_3 = datetime(day=4, month=1, year=2000, tzinfo=pytz.utc)
+
+    urls, endpoint_scans, url_scans, dead_endpoints = [], {}, {}, {}
+    for address in ["a.nl", "b.nl", "c.nl"]:
+        url = Url.objects.all().create(url=address, created_on=day_0, not_resolvable=False)
+        urls.append(url)
+        endpoint = Endpoint.objects.all().create(
+            url=url, protocol="https", port="443", ip_version=4, discovered_on=day_0, is_dead=False
+        )
+        dead_endpoints[url.id] = Endpoint.objects.all().create(
+            url=url, protocol="http", port="80", ip_version=4, discovered_on=day_0, is_dead=True, is_dead_since=day_1
+        )
+        Endpoint.objects.all().create(url=url, protocol="http", port="8080", ip_version=4, discovered_on=day_0)
+        for moment in [day_0, day_1]:
+            endpoint_scans[url.id] = EndpointGenericScan.objects.all().create(
+                endpoint=endpoint,
+                type="tls_qualys_encryption_quality",
+                rating="A",
+                rating_determined_on=moment,
+                last_scan_moment=moment,
+                comply_or_explain_is_explained=False,
+                is_the_latest_scan=True,
+            )
+            url_scans[url.id] = UrlGenericScan.objects.all().create(
+                url=url,
+                type="DNSSEC",
+                rating="ERROR",
+                rating_determined_on=moment,
+                last_scan_moment=moment,
+                comply_or_explain_is_explained=False,
+                is_the_latest_scan=True,
+            )
+    recreate_url_report_batch([url.id for url in urls])
+
+    # scans and dead endpoints after the report are not part of the restored state
+    Endpoint.objects.all().filter(port="8080").update(is_dead=True, is_dead_since=day_3)
+    for url in urls:
+        EndpointGenericScan.objects.all().create(
+            endpoint=endpoint_scans[url.id].endpoint,
+            type="tls_qualys_encryption_quality",
+            rating="F",
+            rating_determined_on=day_2,
+            last_scan_moment=day_2,
+            comply_or_explain_is_explained=False,
+            is_the_latest_scan=True,
+        )
+
+    # older reports do not contain scan id's, those scans are looked up by their type and moment
+    reports = get_latest_url_reports([url.id for url in urls])
+    for rating in reports[urls[0].id].calculation["ratings"]:
+        rating.pop("scan", None)
+    for endpoint in reports[urls[0].id].calculation["endpoints"]:
+        for rating in endpoint["ratings"]:
+            rating.pop("scan", None)
+
+    with django_assert_num_queries(6):
+        states = restore_url_report_states(urls, reports)
+
+    for url in urls:
+        endpoint = endpoint_scans[url.id].endpoint
+        assert states[url.id]["previous_endpoints"] == [endpoint]
+        assert states[url.id]["previous_endpoint_ratings"] == {
+            endpoint.id: {"tls_qualys_encryption_quality": endpoint_scans[url.id]}
+        }
+        assert states[url.id]["previous_url_ratings"] == {url.id: {"DNSSEC": url_scans[url.id]}}
+        assert states[url.id]["dead_endpoints"] == {dead_endpoints[url.id]}
+        assert states[url.id]["url_was_once_rated"]
+
+
+def test_significant_moments_per_url_since(db, monkeypatch):
+    # Urls without a report need their entire history, the other urls in the batch only the recent history.
+    day_1 = datetime(day=2, month=1, year=2000, tzinfo=pytz.utc)
+    day_2 = datetime(day=3, month=1, year=2000, tzinfo=pytz.utc)
+    reported, new, also_reported = [Url.objects.all().create(url=address) for address in ["a.nl", "b.nl", "c.nl"]]
+
+    retrieved = []
+    retrieve_happenings = report.retrieve_happenings
+
+    def record_retrieve_happenings(urls, reported_scan_types, since=None):
+        retrieved.append(([url.url for url in urls], since))
+        return retrieve_happenings(urls, reported_scan_types, since)
+
+    monkeypatch.setattr(report, "retrieve_happenings", record_retrieve_happenings)
+    moments = significant_moments_per_url(
+        [reported, new, also_reported], ["tls_qualys_encryption_quality"], {reported.id: day_2, also_reported.id: day_1}
+    )
+
+    assert sorted(moments) == sorted([reported.id, new.id, also_reported.id])
+    assert retrieved == [(["a.nl", "c.nl"], day_1), (["b.nl"], None)]
+
+
+def test_latest_rating_per_day_only():
+    moment = datetime(day=1, month=1, year=2000, hour=12, minute=30, tzinfo=pytz.utc)
+
+    # no database needed: only the ids of the related endpoints and urls are used.
+    first = EndpointGenericScan(id=1, endpoint_id=1, type="tls_qualys_encryption_quality", rating_determined_on=moment)
+    latest = EndpointGenericScan(
+        id=2, endpoint_id=1, type="tls_qualys_encryption_quality", rating_determined_on=moment.replace(second=30)
+    )
+    other_type = EndpointGenericScan(
+        id=3, endpoint_id=1, type="http_security_header_x_frame_options", rating_determined_on=moment
+    )
+    other_endpoint = EndpointGenericScan(
+        id=4, endpoint_id=2, type="tls_qualys_encryption_quality", rating_determined_on=moment
+    )
+    next_minute = EndpointGenericScan(
+        id=5, endpoint_id=1, type="tls_qualys_encryption_quality", rating_determined_on=moment.replace(minute=31)
+    )
+    url_scan = UrlGenericScan(id=6, url_id=1, type="DNSSEC", rating_determined_on=moment)
+
+    scans = [latest, other_type, first, other_endpoint, next_minute, url_scan]
+    assert [scan.id for scan in latest_rating_per_day_only(scans)] == [2, 3, 4, 5, 6]
+
+    # the order of the scans does not matter, the latest scan on a moment stays. Also works on a generator.
+    assert sorted(scan.id for scan in latest_rating_per_day_only(scan for scan in reversed(scans))) == [2, 3, 4, 5, 6]
+
+
+def test_aggegrate_latest_url_report_scores(db):
+    day_0 = datetime(day=1, month=1, year=2000, tzinfo=pytz.utc)
+    day_1 = datetime(day=2, month=1, year=2000, tzinfo=pytz.utc)
+    day_2 = datetime(day=3, month=1, year=2000, tzinfo=pytz.utc)
+
+    urls = []
+    for address, ratings in [("a.nl", ["A", "F"]), ("b.nl", ["F", "B"]), ("c.nl", ["C"])]:
+        url = Url.objects.all().create(url=address, created_on=day_0, not_resolvable=False)
+        urls.append(url)
+        endpoint = Endpoint.objects.all().create(
+            url=url, protocol="https", port="443", ip_version=4, discovered_on=day_0, is_dead=False
+        )
+        for moment, rating in zip([day_1, day_2], ratings):
+            EndpointGenericScan.objects.all().create(
+                endpoint=endpoint,
+                type="tls_qualys_encryption_quality",
+                rating=rating,
+                rating_determined_on=moment,
+                last_scan_moment=moment,
+                comply_or_explain_is_explained=False,
+                is_the_latest_scan=True,
+            )
+    recreate_url_report_batch([url.id for url in urls])
+
+    url_ids = [url.id for url in urls]
+    for when in [day_1, day_2, datetime(day=3, month=1, year=2000, hour=23, tzinfo=pytz.utc)]:
+        scores = aggegrate_latest_url_report_scores(url_ids, when)
+        expected_scores = aggegrate_url_rating_scores(get_latest_urlratings_fast(url_ids, when))
+        assert scores == expected_scores
+    assert scores["total_urls"] == 3
@@ -6,7 +6,7 @@ from jet.admin import CompactInline
 from jet.filters import RelatedFieldAjaxListFilter
 
 from websecmap.scanners import models
-from websecmap.scanners.models import State
+from websecmap.scanners.plannedscan import change_state
 from websecmap.scanners.proxy import check_proxy
 from websecmap.scanners.scanner.internet_nl_v2_websecmap import progress_running_scan, recover_and_retry
 
@@ -336,6 +336,7 @@ class ScanProxyAdmin(ImportExportModelAdmin, admin.ModelAdmin):
         "check_result_date",
         "currently_used_in_tls_qualys_scan",
         "last_claim_at",
+        "lease_until",
         "manually_disabled",
         "is_dead",
         "request_speed_in_ms",
@@ -367,6 +368,7 @@ class ScanProxyAdmin(ImportExportModelAdmin, admin.ModelAdmin):
         "qualys_capacity_max",
         "qualys_capacity_this_client",
         "last_claim_at",
+        "lease_until",
     )
 
     actions = []
@@ -443,18 +445,14 @@ class PlannedScanAdmin(ImportExportModelAdmin, admin.ModelAdmin):
     actions = []
 
     def set_state_requested(self, request, queryset):
-        for plannedscan in queryset:
-            plannedscan.state = State.requested.value
-            plannedscan.save()
+        change_state(queryset, "requested")
         self.message_user(request, "Set to requested.")
 
     set_state_requested.short_description = "Set to Requested"
     actions.append("set_state_requested")
 
     def set_state_finished(self, request, queryset):
-        for plannedscan in queryset:
-            plannedscan.state = State.finished.value
-            plannedscan.save()
+        change_state(queryset, "finished")
         self.message_user(request, "Set to finished.")
 
     set_state_finished.short_description = "Set to Finished"
@@ -20,6 +20,16 @@ def add_scanner_fields(constance_config):
                 int,
             )
 
+    # Add the fairness of picking up planned scans per scanner:
+    for scanner in SCANNERS:
+        if scanner["plannable_activities"]:
+            constance_config[f"SCAN_FAIRNESS_{scanner['name'].upper()}"] = (
+                20,
+                f"Percentage of planned {scanner['name'].upper()} tasks that is picked up by age, regardless of "
+                f"priority. Prevents that older requests are never handled when higher priority requests keep coming.",
+                int,
+            )
+
     # Generate Scanner Settings:
     for scanner in SCANNERS:
 
@@ -122,4 +132,14 @@ def add_scanner_fieldsets(constance_config_fieldsets):
         ]
     )
 
+    fairness = tuple(
+        f"SCAN_FAIRNESS_{scanner['name'].upper()}" for scanner in SCANNERS if scanner["plannable_activities"]
+    )
+
+    constance_config_fieldsets.update(
+        [
+            ("Fairness of picking up planned activities per scanner", fairness),
+        ]
+    )
+
     return constance_config_fieldsets
@@ -1,6 +1,9 @@
 from datetime import timedelta
 
-from websecmap.scanners.models import Endpoint, EndpointGenericScan, Screenshot
+from django.db import transaction
+from django.db.models import Max
+
+from websecmap.scanners.models import Endpoint, EndpointGenericScan, LatestEndpointScan, Screenshot
 import logging
 
 log = logging.getLogger(__package__)
@@ -55,9 +58,27 @@ def delete_endpoint(endpoint: Endpoint):
 
 
 def transfer_endpoint_data(fromm: Endpoint, to: Endpoint):
-    updated = EndpointGenericScan.objects.all().filter(endpoint=fromm).update(endpoint=to)
-    log.info(updated)
-    Screenshot.objects.all().filter(endpoint=fromm).update(endpoint=to)
+    with transaction.atomic():
+        updated = EndpointGenericScan.objects.all().filter(endpoint=fromm).update(endpoint=to)
+        log.info(updated)
+        Screenshot.objects.all().filter(endpoint=fromm).update(endpoint=to)
+        transfer_latest_scans(fromm=fromm, to=to)
+
+
+def transfer_latest_scans(fromm: Endpoint, to: Endpoint):
+    # Both endpoints can have a latest scan of the same type, the newest of those (the highest id, as in
+    # set_latest_scan) becomes the latest scan of the older endpoint. The latest scans of the newer endpoint
+    # would otherwise be deleted together with that endpoint.
+    LatestEndpointScan.objects.all().filter(endpoint__in=[fromm, to]).delete()
+
+    scans = EndpointGenericScan.objects.all().filter(endpoint=to)
+    latest_scans = dict(scans.values("type").annotate(scan_id=Max("id")).order_by().values_list("type", "scan_id"))
+
+    scans.exclude(id__in=latest_scans.values()).update(is_the_latest_scan=False)
+    scans.filter(id__in=latest_scans.values()).update(is_the_latest_scan=True)
+    LatestEndpointScan.objects.bulk_create(
+        LatestEndpointScan(endpoint=to, type=scan_type, scan_id=scan_id) for scan_type, scan_id in latest_scans.items()
+    )
 
 
 def transfer_endpoint_state(fromm: Endpoint, to: Endpoint):
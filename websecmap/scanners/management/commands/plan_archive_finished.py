@@ -0,0 +1,25 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from websecmap.scanners import plannedscan
+
+log = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    Moves finished planned scans to the archive, and optionally counts the progress of all planned scans again.
+    """
+
+    help = __doc__
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=7, help="Archive scans that finished more than days ago.")
+        parser.add_argument("--recalculate", action="store_true", help="Count the progress of all scans again.")
+
+    def handle(self, *args, **options):
+        log.info(f"Archived {plannedscan.archive_finished_scans(options['days'])} finished planned scans.")
+
+        if options["recalculate"]:
+            plannedscan.recalculate_progress()
@@ -3,9 +3,11 @@ from datetime import datetime
 
 import pytz
 from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
 
 from websecmap.scanners import ENDPOINT_SCAN_TYPES, URL_SCAN_TYPES
-from websecmap.scanners.models import EndpointGenericScan, UrlGenericScan
+from websecmap.scanners.models import EndpointGenericScan, LatestEndpointScan, LatestUrlScan, UrlGenericScan
 
 log = logging.getLogger(__name__)
 
@@ -15,14 +17,26 @@ class Command(BaseCommand):
     using the scan manager. But the flags are empty in older systems.
 
     The queries used allow sliding through time, for example setting the latest on a certain date. Which does not
-    make sense at all, but works."""
+    make sense at all, but works.
+
+    After this the latest scan tables (LatestUrlScan and LatestEndpointScan) are rebuilt from the flags. Use
+    --rebuild-only to only rebuild these tables."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rebuild-only", action="store_true", help="Only rebuild the latest scan tables from the current flags."
+        )
 
     def handle(self, *args, **options):
         for scan_type in URL_SCAN_TYPES:
-            reflag_urlgenericscan(type=scan_type)
+            if not options["rebuild_only"]:
+                reflag_urlgenericscan(type=scan_type)
+            rebuild_latest_scans(UrlGenericScan, LatestUrlScan, "url", scan_type)
 
         for scan_type in ENDPOINT_SCAN_TYPES:
-            reflag_endpointgenericscan(type=scan_type)
+            if not options["rebuild_only"]:
+                reflag_endpointgenericscan(type=scan_type)
+            rebuild_latest_scans(EndpointGenericScan, LatestEndpointScan, "endpoint", scan_type)
 
 
 def reflag_urlgenericscan(type):
@@ -78,3 +92,22 @@ def updatescans(scans):
     for scan in scans:
         scan.is_the_latest_scan = True
         scan.save()
+
+
+def rebuild_latest_scans(scan_model, latest_scan_model, subject: str, type):
+    log.debug("Rebuilding %s of type: %s" % (latest_scan_model.__name__, type))
+
+    # the latest flag is set on the highest id, as in reflag_urlgenericscan and reflag_endpointgenericscan
+    latest_scans = (
+        scan_model.objects.all()
+        .filter(type=type, is_the_latest_scan=True, **{f"{subject}__isnull": False})
+        .values(f"{subject}_id")
+        .annotate(scan_id=Max("id"))
+        .order_by()
+    )
+
+    with transaction.atomic():
+        latest_scan_model.objects.all().filter(type=type).delete()
+        latest_scan_model.objects.bulk_create(
+            (latest_scan_model(type=type, **latest_scan) for latest_scan in latest_scans), batch_size=1000
+        )
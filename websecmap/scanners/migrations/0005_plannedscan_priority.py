@@ -0,0 +1,35 @@
+# Generated by Django 3.1.13 on 2026-10-18 14:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("scanners", "0004_auto_20210626_1313"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="plannedscan",
+            name="priority",
+            field=models.PositiveSmallIntegerField(
+                choices=[(1, "onboarding"), (2, "outdated"), (5, "normal")],
+                default=5,
+                help_text="Requested scans with a lower priority are picked up first: onboarding, outdated, normal.",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="plannedscan",
+            index=models.Index(
+                fields=["scanner", "activity", "state", "priority", "requested_at_when"],
+                name="scanners_pl_scanner_f35de0_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="plannedscan",
+            index=models.Index(
+                fields=["scanner", "activity", "state", "requested_at_when"], name="scanners_pl_scanner_a7ed13_idx"
+            ),
+        ),
+    ]
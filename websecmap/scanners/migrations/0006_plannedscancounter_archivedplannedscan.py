@@ -0,0 +1,154 @@
+# Generated by Django 3.1.13 on 2026-10-18 14:38
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def forward(apps, schema_editor):
+    """Counts the existing planned scans once, after this the counters are updated on every change of state."""
+    PlannedScan = apps.get_model("scanners", "PlannedScan")
+    PlannedScanCounter = apps.get_model("scanners", "PlannedScanCounter")
+
+    PlannedScanCounter.objects.bulk_create(
+        [
+            PlannedScanCounter(
+                scanner=row["scanner"], activity=row["activity"], state=row["state"], amount=row["amount"]
+            )
+            for row in PlannedScan.objects.all()
+            .values("scanner", "activity", "state")
+            .annotate(amount=Count("id"))
+            .order_by()
+        ]
+    )
+
+
+def noop(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("scanners", "0005_plannedscan_priority"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ArchivedPlannedScan",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("url_id", models.PositiveIntegerField()),
+                (
+                    "scanner",
+                    models.PositiveSmallIntegerField(
+                        choices=[
+                            (0, "unknown"),
+                            (1, "tls_qualys"),
+                            (2, "dnssec"),
+                            (3, "security_headers"),
+                            (4, "plain_http"),
+                            (5, "internet_nl_mail"),
+                            (6, "ftp"),
+                            (7, "dns_endpoints"),
+                            (8, "internet_nl_web"),
+                            (9, "subdomains"),
+                            (10, "dns_known_subdomains"),
+                            (11, "dns_clean_wildcards"),
+                            (12, "http"),
+                            (13, "verify_unresolvable"),
+                            (14, "onboard"),
+                            (15, "ipv6"),
+                            (16, "dns_wildcards"),
+                            (17, "dummy"),
+                            (18, "screenshot"),
+                            (100, "autoexplain_dutch_untrusted_cert"),
+                            (101, "autoexplain_trust_microsoft"),
+                            (102, "autoexplain_no_https_microsoft"),
+                            (103, "autoexplain_microsoft_neighboring_services"),
+                        ]
+                    ),
+                ),
+                (
+                    "activity",
+                    models.PositiveSmallIntegerField(
+                        choices=[(0, "unknown"), (1, "discover"), (2, "verify"), (3, "scan")]
+                    ),
+                ),
+                (
+                    "state",
+                    models.PositiveSmallIntegerField(
+                        choices=[
+                            (0, "unknown"),
+                            (1, "requested"),
+                            (2, "picked_up"),
+                            (3, "finished"),
+                            (4, "error"),
+                            (5, "timeout"),
+                        ]
+                    ),
+                ),
+                ("requested_at_when", models.DateTimeField()),
+                ("finished_at_when", models.DateTimeField(null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="PlannedScanCounter",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                (
+                    "scanner",
+                    models.PositiveSmallIntegerField(
+                        choices=[
+                            (0, "unknown"),
+                            (1, "tls_qualys"),
+                            (2, "dnssec"),
+                            (3, "security_headers"),
+                            (4, "plain_http"),
+                            (5, "internet_nl_mail"),
+                            (6, "ftp"),
+                            (7, "dns_endpoints"),
+                            (8, "internet_nl_web"),
+                            (9, "subdomains"),
+                            (10, "dns_known_subdomains"),
+                            (11, "dns_clean_wildcards"),
+                            (12, "http"),
+                            (13, "verify_unresolvable"),
+                            (14, "onboard"),
+                            (15, "ipv6"),
+                            (16, "dns_wildcards"),
+                            (17, "dummy"),
+                            (18, "screenshot"),
+                            (100, "autoexplain_dutch_untrusted_cert"),
+                            (101, "autoexplain_trust_microsoft"),
+                            (102, "autoexplain_no_https_microsoft"),
+                            (103, "autoexplain_microsoft_neighboring_services"),
+                        ]
+                    ),
+                ),
+                (
+                    "activity",
+                    models.PositiveSmallIntegerField(
+                        choices=[(0, "unknown"), (1, "discover"), (2, "verify"), (3, "scan")]
+                    ),
+                ),
+                (
+                    "state",
+                    models.PositiveSmallIntegerField(
+                        choices=[
+                            (0, "unknown"),
+                            (1, "requested"),
+                            (2, "picked_up"),
+                            (3, "finished"),
+                            (4, "error"),
+                            (5, "timeout"),
+                        ]
+                    ),
+                ),
+                ("amount", models.IntegerField(default=0)),
+            ],
+            options={
+                "unique_together": {("scanner", "activity", "state")},
+            },
+        ),
+        migrations.RunPython(forward, noop),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 3.1.13 on 2026-10-18 14:50
+
+from django.db import migrations, models
+from django.db.models import Max
+import django.db.models.deletion
+
+
+def forward(apps, schema_editor):
+    """Points to the scans that are flagged as the latest scan, the scan manager maintains this from now on."""
+    for scan_model, latest_model, subject in [
+        ("EndpointGenericScan", "LatestEndpointScan", "endpoint"),
+        ("UrlGenericScan", "LatestUrlScan", "url"),
+    ]:
+        latest_scans = (
+            apps.get_model("scanners", scan_model)
+            .objects.all()
+            .filter(is_the_latest_scan=True, **{f"{subject}__isnull": False})
+            .values(f"{subject}_id", "type")
+            .annotate(scan_id=Max("id"))
+            .order_by()
+        )
+        LatestScan = apps.get_model("scanners", latest_model)
+        LatestScan.objects.bulk_create((LatestScan(**latest_scan) for latest_scan in latest_scans), batch_size=1000)
+
+
+def noop(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("organizations", "0060_auto_20200908_1055"),
+        ("scanners", "0006_plannedscancounter_archivedplannedscan"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="LatestUrlScan",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("type", models.CharField(max_length=60)),
+                (
+                    "scan",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="latest_scan",
+                        to="scanners.urlgenericscan",
+                    ),
+                ),
+                ("url", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to="organizations.url")),
+            ],
+            options={
+                "unique_together": {("url", "type")},
+            },
+        ),
+        migrations.CreateModel(
+            name="LatestEndpointScan",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("type", models.CharField(max_length=60)),
+                ("endpoint", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to="scanners.endpoint")),
+                (
+                    "scan",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="latest_scan",
+                        to="scanners.endpointgenericscan",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("endpoint", "type")},
+            },
+        ),
+        migrations.RunPython(forward, noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.1.13 on 2026-10-18 15:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("scanners", "0007_latest_scans"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="scanproxy",
+            name="lease_until",
+            field=models.DateTimeField(
+                blank=True,
+                help_text="A claimed proxy is released automatically at this moment, also when the scan using it crashed.",
+                null=True,
+            ),
+        ),
+    ]
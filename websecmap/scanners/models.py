@@ -186,6 +186,12 @@ class ScanProxy(models.Model):
 
     last_claim_at = models.DateTimeField(blank=True, null=True)
 
+    lease_until = models.DateTimeField(
+        blank=True,
+        null=True,
+        help_text="A claimed proxy is released automatically at this moment, also when the scan using it crashed.",
+    )
+
     request_speed_in_ms = models.IntegerField(
         default=-1,
     )
@@ -440,6 +446,13 @@ class State(models.IntegerChoices):
     timeout = 5, "timeout"
 
 
+class Priority(models.IntegerChoices):
+    # Lower is handled earlier.
+    onboarding = 1, "onboarding"
+    outdated = 2, "outdated"
+    normal = 5, "normal"
+
+
 class PlannedScan(models.Model):
     """
     A planned scan is always performed per url, even if the scan itself is about endpoints. The endpoints can be
@@ -475,10 +488,50 @@ class PlannedScan(models.Model):
 
     finished_at_when = models.DateTimeField(null=True, help_text="when finished, timeout, error")
 
-    # add joined index over scanner, activity, state, so queries are faster:
+    priority = models.PositiveSmallIntegerField(
+        choices=Priority.choices,
+        default=Priority.normal,
+        help_text="Requested scans with a lower priority are picked up first: onboarding, outdated, normal.",
+    )
+
+    # add joined index over scanner, activity, state, so queries are faster. Picking up requested scans in the order
+    # of priority and age, or only age, is a range scan on the last two indexes.
     # see: https://docs.djangoproject.com/en/3.0/ref/models/options/#indexes
     class Meta:
-        indexes = [models.Index(fields=["scanner", "activity", "state"])]
+        indexes = [
+            models.Index(fields=["scanner", "activity", "state"]),
+            models.Index(fields=["scanner", "activity", "state", "priority", "requested_at_when"]),
+            models.Index(fields=["scanner", "activity", "state", "requested_at_when"]),
+        ]
+
+
+class PlannedScanCounter(models.Model):
+    """
+    The amount of planned scans per scanner, activity and state. These are updated on every change of state, so the
+    progress can be retrieved without counting all planned scans. Archived scans are still counted.
+    """
+
+    scanner = models.PositiveSmallIntegerField(choices=Scanner.choices)
+    activity = models.PositiveSmallIntegerField(choices=Activity.choices)
+    state = models.PositiveSmallIntegerField(choices=State.choices)
+    amount = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = [["scanner", "activity", "state"]]
+
+
+class ArchivedPlannedScan(models.Model):
+    """
+    Finished planned scans are moved here after a while, so the planned scan table only contains recent scans.
+    This has no relations and indexes, to keep it compact.
+    """
+
+    url_id = models.PositiveIntegerField()
+    scanner = models.PositiveSmallIntegerField(choices=Scanner.choices)
+    activity = models.PositiveSmallIntegerField(choices=Activity.choices)
+    state = models.PositiveSmallIntegerField(choices=State.choices)
+    requested_at_when = models.DateTimeField()
+    finished_at_when = models.DateTimeField(null=True)
 
 
 class PlannedScanError(models.Model):
@@ -570,6 +623,34 @@ class UrlGenericScan(GenericScanMixin):
         return "%s: %s %s on %s" % (self.rating_determined_on.date(), self.type, self.rating, self.url)
 
 
+class LatestEndpointScan(models.Model):
+    """
+    Points to the latest scan of each type on an endpoint. Reading the latest scans is a join on this table, instead
+    of a filter on is_the_latest_scan over all scans. The scan manager maintains this table together with the
+    is_the_latest_scan flag. The set_latest_scan command rebuilds it.
+    """
+
+    endpoint = models.ForeignKey(Endpoint, on_delete=models.CASCADE)
+    type = models.CharField(max_length=60)
+    scan = models.OneToOneField(EndpointGenericScan, on_delete=models.CASCADE, related_name="latest_scan")
+
+    class Meta:
+        unique_together = ("endpoint", "type")
+
+
+class LatestUrlScan(models.Model):
+    """
+    Points to the latest scan of each type on an url. See LatestEndpointScan.
+    """
+
+    url = models.ForeignKey(Url, on_delete=models.CASCADE)
+    type = models.CharField(max_length=60)
+    scan = models.OneToOneField(UrlGenericScan, on_delete=models.CASCADE, related_name="latest_scan")
+
+    class Meta:
+        unique_together = ("url", "type")
+
+
 class EndpointGenericScanScratchpad(models.Model):
     """
     A debugging channel for generic scans.
@@ -1,10 +1,17 @@
+import json
 import logging
+from collections import Counter, defaultdict
 from datetime import datetime, timedelta
-from typing import Dict, List, Tuple
+from functools import lru_cache
+from random import random
+from typing import Dict, Iterable, List, Set, Tuple, Union
 
 import dateutil.parser
 import pytz
-from django.db import connection
+import redis
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, F, Q
 from statshog.defaults.django import statsd
 
 from websecmap.app.constance import constance_cached_value
@@ -14,10 +21,37 @@ from websecmap.map.map_configs import filter_map_configs
 from websecmap.map.report import PUBLISHED_SCAN_TYPES
 from websecmap.organizations.models import Organization, Url
 from websecmap.scanners import SCAN_TYPES_TO_SCANNER, SCANNERS_BY_NAME
-from websecmap.scanners.models import Endpoint, PlannedScan, PlannedScanStatistic, Activity, Scanner, State
+from websecmap.scanners.models import (
+    ArchivedPlannedScan,
+    Endpoint,
+    EndpointGenericScan,
+    PlannedScan,
+    PlannedScanCounter,
+    PlannedScanStatistic,
+    Activity,
+    Priority,
+    Scanner,
+    State,
+    UrlGenericScan,
+)
+from websecmap.scanners.scanner.utils import in_chunks
 
 log = logging.getLogger(__name__)
 
+# Claimed scans are updated and retrieved in chunks, so large claims stay below query parameter limits.
+CLAIM_CHUNK_SIZE = 500
+
+# Requests are inserted in batches of this size. Smaller requests only look up their own urls.
+REQUEST_CHUNK_SIZE = 500
+
+# Finished scans are buffered in this redis list, and written in batches a while after the first one was added.
+FINISH_BUFFER_KEY = "websecmap:plannedscan:finished"
+FINISH_BUFFER_BATCH_SIZE = 1000
+FINISH_BUFFER_FLUSH_INTERVAL = 10
+
+# Finished scans are archived in batches of this size.
+ARCHIVE_BATCH_SIZE = 1000
+
 
 @app.task(queue="storage")
 def store_progress():
@@ -46,79 +80,98 @@ def get_latest_progress():
 
 def calculate_progress() -> List[Dict[str, int]]:
     """
-    Retrieves the progress of all scans in the past 7 days. Will show how many are requested and how many
-    are at what state.
+    Retrieves the amount of planned scans per scanner, activity and state. Will show how many are requested and
+    how many are at what state. These amounts are kept up to date in PlannedScanCounter on every change of state.
 
     This routine is as simple and fast as it gets. The consumer will have to iterated and aggregate where needed.
     """
+    rows = (
+        PlannedScanCounter.objects.all()
+        .filter(amount__gt=0)
+        .values_list("scanner", "activity", "state", "amount")
+        .order_by("scanner", "activity", "state")
+    )
 
-    # i'm _DONE_ with the obscuring of group_by and counts using terrible abstractions.
-    # so here is a raw query that just works on all databases and is trivially simple to understand.
-    sql = """SELECT
-                scanner, activity, state, count(id) as amount
-            FROM
-                scanners_plannedscan
-            GROUP BY
-                scanner, activity, state
-            """
-
-    cursor = connection.cursor()
-    cursor.execute(sql)
-    rows = cursor.fetchall()
-
-    # when there are 0 records, there is of course no row created. But there might have been in the past.
-    overview = []
-    for row in rows:
-        overview.append({"scanner": row[0], "activity": row[1], "state": row[2], "amount": row[3]})
-
-    for scanner_id, scanner_name in Scanner.choices:
-        # unknown is not used because it is not used
-        if scanner_id == 0:
-            continue
-
-        if scanner_has_finished_tasks(scanner_id, overview):
-            # scan, discover and verify, not all scanners will perform all three.
-            for activity in activities_from_finished_tasks(scanner_id, overview):
-                # unknown error and timeout are ignored because they are not used
-                for state in [State["requested"].value, State["picked_up"].value, State["finished"].value]:
+    # when there are 0 planned scans, there is no row. But there might have been in the past.
+    overview = {(scanner, activity, state): amount for scanner, activity, state, amount in rows}
 
-                    # it's not in the overview when we're here, so add it:
-                    if not already_in_overview(overview, scanner_id, activity, state):
-                        overview.append({"scanner": scanner_id, "activity": activity, "state": state, "amount": 0})
+    # For scanners with finished tasks, all the states of these activities are shown. Unknown, error and timeout are
+    # ignored because they are not used.
+    finished_activities = {
+        (scanner, activity) for scanner, activity, state in overview if state == State["finished"].value
+    }
+    for scanner, activity in finished_activities:
+        for state in [State["requested"].value, State["picked_up"].value, State["finished"].value]:
+            overview.setdefault((scanner, activity, state), 0)
 
     # Sort by scanner for easier human comprehension.
-    overview = sorted(overview, key=lambda o: (o["scanner"], o["activity"], o["state"]))
+    return [
+        {"scanner": scanner, "activity": activity, "state": state, "amount": amount}
+        for (scanner, activity, state), amount in sorted(overview.items())
+    ]
 
-    return overview
 
+def recalculate_progress():
+    """
+    Counts all planned and archived scans again, for when the counters are off. For example when urls with planned
+    scans have been deleted.
+    """
+    amounts = Counter()
+    for model in [PlannedScan, ArchivedPlannedScan]:
+        for row in model.objects.all().values("scanner", "activity", "state").annotate(amount=Count("id")).order_by():
+            amounts[(row["scanner"], row["activity"], row["state"])] += row["amount"]
+
+    with transaction.atomic():
+        PlannedScanCounter.objects.all().delete()
+        PlannedScanCounter.objects.bulk_create(
+            [
+                PlannedScanCounter(scanner=scanner, activity=activity, state=state, amount=amount)
+                for (scanner, activity, state), amount in amounts.items()
+            ]
+        )
 
-def already_in_overview(overview, scanner, activity, state):
-    return sum(
-        [
-            True if row["scanner"] == scanner and row["activity"] == activity and row["state"] == state else False
-            for row in overview
-        ]
-    )
 
+def count_progress(scanner: int, activity: int, state: int, amount: int):
+    """Adds amount (which can be negative) to the amount of planned scans of this scanner, activity and state."""
+    if not amount:
+        return
 
-def scanner_has_finished_tasks(scanner_id, overview):
-    return activities_from_finished_tasks(scanner_id, overview)
+    counters = PlannedScanCounter.objects.all().filter(scanner=scanner, activity=activity, state=state)
+    if counters.update(amount=F("amount") + amount):
+        return
 
+    try:
+        with transaction.atomic():
+            PlannedScanCounter.objects.create(scanner=scanner, activity=activity, state=state, amount=amount)
+    except IntegrityError:
+        # created in the meantime
+        counters.update(amount=F("amount") + amount)
 
-def activities_from_finished_tasks(scanner_id, overview):
-    return [
-        row["activity"] for row in overview if row["scanner"] == scanner_id and row["state"] == State["finished"].value
-    ]
+
+def change_state(scans, state: str, **fields) -> int:
+    """
+    Changes the state of a queryset of planned scans, and updates the progress counters accordingly. Returns the
+    amount of changed scans.
+    """
+    with transaction.atomic():
+        groups = list(scans.values("scanner", "activity", "state").annotate(amount=Count("id")).order_by())
+        changed = scans.update(state=State[state].value, **fields)
+        for group in groups:
+            count_progress(group["scanner"], group["activity"], group["state"], -group["amount"])
+            count_progress(group["scanner"], group["activity"], State[state].value, group["amount"])
+    return changed
 
 
 def reset():
-    PlannedScan.objects.all().delete()
+    with transaction.atomic():
+        PlannedScan.objects.all().delete()
+        PlannedScanCounter.objects.all().delete()
 
 
 @app.task(queue="storage")
 def force_retry():
     # just retry everything that is picked up now:
-    PlannedScan.objects.all().filter(state=State["picked_up"].value).update(state=State["requested"].value)
+    change_state(PlannedScan.objects.all().filter(state=State["picked_up"].value), "requested")
 
 
 @app.task(queue="storage")
@@ -147,11 +200,14 @@ def retry():
 
     # apply the policy:
     for policy in retry_policy:
-        PlannedScan.objects.all().filter(
-            state=State["picked_up"].value,
-            last_state_change_at__lte=datetime.now(pytz.utc) - timedelta(hours=policy["hours"]),
-            scanner__in=policy["scanners"],
-        ).update(state=State["requested"].value)
+        change_state(
+            PlannedScan.objects.all().filter(
+                state=State["picked_up"].value,
+                last_state_change_at__lte=datetime.now(pytz.utc) - timedelta(hours=policy["hours"]),
+                scanner__in=policy["scanners"],
+            ),
+            "requested",
+        )
 
 
 def pickup(activity: str, scanner: str, amount: int = 10) -> List[Url]:
@@ -184,67 +240,179 @@ def pickup(activity: str, scanner: str, amount: int = 10) -> List[Url]:
     amount = amount if amount <= headroom else headroom
     log.debug(f"Picking up maximum {amount} of total {headroom} free slots.")
 
-    # oldest first, so ascending dates.-> removed because that makes picking up very slow and complex.
-    # whatever is requested should just be handled asap and the things that are requestes should just be empy
-    # at the end of the day. So no .order_by("requested_at_when")
-    scans = PlannedScan.objects.all().filter(
-        activity=Activity[activity].value, scanner=Scanner[scanner].value, state=State["requested"].value
-    )[0:amount]
-
-    # cannot update once a slice has been taken
-    for scan in scans:
-        scan.state = State["picked_up"].value
-        scan.last_state_change_at = datetime.now(pytz.utc)
-        scan.save()
-
-    urls = []
-    for scan in scans:
-        # There are plannedscans on http without an url reference. The url show up blank in the admin, even when
-        # there is cascading deletion. So there might be a database error somewhere.
-        # scan still exists (weirdly enough). Even if there is an on delete cascade. We see that in issue 2424378050.
-        try:
-            # Use this debug message to retrieve the Url.DoesNotExist as django has to query the ID.
-            log.debug(f"Picking up scan {scan.id} with url id: {scan.url.id}.")
-            urls.append(scan.url)
-        except Url.DoesNotExist:
-            # Delete this scan as the url id cannot be found, so it cannot be finished.
-            log.error("Deleting a scan without an url. The scan will be deleted.", extra={"scan_id": scan.id})
-            scan.delete()
+    urls = [scan.url for scan in claim(activity, scanner, amount)]
 
     log.debug(f"Picked up {len(urls)} to {activity} with {scanner}.")
     statsd.incr("scan_planned", len(urls), tags={"state": "pickup", "scanner": scanner, "activity": activity})
     return urls
 
 
-def request(activity: str, scanner: str, urls: List[int]):
-    # should it be deduplicated? i mean: if there already is a specific planned scan, it doesn't
-    # need to be created again: that would just be more work. Think so, otherwise the finish and start will
-    # mix for different scans. So we can't do bulk inserts, but we can do better state logging
+def claim(activity: str, scanner: str, amount: int = 10) -> List[PlannedScan]:
+    """
+    Marks up to amount requested scans as picked up and returns them with their url. Concurrent claims never return
+    the same scans. Which scans are claimed is decided by scheduled_scan_ids.
 
-    for url in urls:
-        if already_requested(activity, scanner, url):
-            statsd.incr("scan_planned", tags={"state": "duplicate_request", "scanner": scanner, "activity": activity})
-            log.debug(f"Already registered: {activity} on {scanner} for {url}.")
-            continue
+    On databases that support it the requested scans are locked with SELECT ... FOR UPDATE SKIP LOCKED: rows locked
+    by another claim are skipped instead of waited for. On other databases (sqlite, older MySQL) the state of the
+    scans is only flipped when they are still requested, with an update per chunk. The scans that were flipped by
+    this claim are selected again by their state change moment, and only those are returned.
+    """
+    requested_scans = PlannedScan.objects.all().filter(
+        activity=Activity[activity].value, scanner=Scanner[scanner].value, state=State["requested"].value
+    )
+    amount_by_age = fair_share(amount, constance_cached_value(f"SCAN_FAIRNESS_{scanner.upper()}"))
+    now = datetime.now(pytz.utc)
+
+    with transaction.atomic():
+        if connection.features.has_select_for_update_skip_locked:
+            scan_ids = scheduled_scan_ids(requested_scans.select_for_update(skip_locked=True), amount, amount_by_age)
+            for chunk in in_chunks(scan_ids, CLAIM_CHUNK_SIZE):
+                PlannedScan.objects.all().filter(id__in=chunk).update(
+                    state=State["picked_up"].value, last_state_change_at=now
+                )
+        else:
+            candidate_ids = scheduled_scan_ids(requested_scans, amount, amount_by_age)
+            scan_ids = []
+            for chunk in in_chunks(candidate_ids, CLAIM_CHUNK_SIZE):
+                if (
+                    PlannedScan.objects.all()
+                    .filter(id__in=chunk, state=State["requested"].value)
+                    .update(state=State["picked_up"].value, last_state_change_at=now)
+                ):
+                    scan_ids += (
+                        PlannedScan.objects.all()
+                        .filter(id__in=chunk, state=State["picked_up"].value, last_state_change_at=now)
+                        .values_list("id", flat=True)
+                    )
+
+        count_progress(Scanner[scanner].value, Activity[activity].value, State["requested"].value, -len(scan_ids))
+        count_progress(Scanner[scanner].value, Activity[activity].value, State["picked_up"].value, len(scan_ids))
+
+    scans = []
+    for chunk in in_chunks(scan_ids, CLAIM_CHUNK_SIZE):
+        scans += list(PlannedScan.objects.all().filter(id__in=chunk).select_related("url"))
+
+    # There are plannedscans on http without an url reference. The url show up blank in the admin, even when
+    # there is cascading deletion. So there might be a database error somewhere.
+    # scan still exists (weirdly enough). Even if there is an on delete cascade. We see that in issue 2424378050.
+    # These scans cannot be finished, so they are deleted.
+    scans_without_url = set(scan_ids) - {scan.id for scan in scans}
+    if scans_without_url:
+        log.error("Deleting scans without an url.", extra={"scan_ids": sorted(scans_without_url)})
+        PlannedScan.objects.all().filter(id__in=scans_without_url).delete()
+        count_progress(
+            Scanner[scanner].value, Activity[activity].value, State["picked_up"].value, -len(scans_without_url)
+        )
 
-        now = datetime.now(pytz.utc)
+    return scans
 
-        ps = PlannedScan()
-        ps.activity = Activity[activity].value
-        ps.scanner = Scanner[scanner].value
-        ps.url = url
-        ps.state = State["requested"].value
-        ps.last_state_change_at = now
-        # To use the index on requested_at_when times are reduced to whole hours.
-        # This is sane enough to allow tons of scans per day still, but the creation
-        # of status reports is much faster. Still gives an idea of how many scans are made.
-        # The minutes are rounded to every 10 minutes. So there is still a sense of progress and use the index
-        discard = timedelta(minutes=now.minute % 10, seconds=now.second, microseconds=now.microsecond)
-        ps.requested_at_when = now - discard
-        ps.save()
-        statsd.incr("scan_planned", tags={"state": "request", "scanner": scanner, "activity": activity})
 
-    log.debug(f"Requested {activity} with {scanner} on {len(urls)} urls.")
+def scheduled_scan_ids(requested_scans, amount: int, amount_by_age: int) -> List[int]:
+    """
+    The ids of the requested scans that are handled next: the oldest requests of the highest priority first. To make
+    sure requests with a lower priority are not starved by a flood of higher priority requests, the first
+    amount_by_age scans are the oldest requests regardless of their priority.
+
+    Both orderings are a range scan on an index of PlannedScan.
+    """
+    scan_ids = []
+    if amount_by_age:
+        scan_ids += requested_scans.order_by("requested_at_when").values_list("id", flat=True)[0:amount_by_age]
+
+    scan_ids += (
+        requested_scans.exclude(id__in=scan_ids)
+        .order_by("priority", "requested_at_when")
+        .values_list("id", flat=True)[0 : amount - len(scan_ids)]
+    )
+    return scan_ids
+
+
+def fair_share(amount: int, fairness: int) -> int:
+    """
+    The part of amount that is the fairness percentage. Fractions are rounded up or down at random, so small
+    amounts also get their share over time.
+    """
+    share = amount * max(0, min(fairness, 100)) / 100
+    return min(amount, int(share + random()))  # nosec, no cryptography expected here
+
+
+def request(activity: str, scanner: str, urls: List[Union[Url, int]], priority: str = "normal"):
+    """
+    Requests the activity on the urls, except on urls where the same activity is already requested or picked up.
+    Otherwise the finish and start would mix for different scans. Requests on urls that are not onboarded yet
+    always have the onboarding priority. Requested scans that get a higher priority are updated.
+
+    The open requests are retrieved in one query and the new requests are inserted in bulk, so tens of thousands of
+    urls can be requested at once.
+    """
+    url_ids = [url.id if isinstance(url, Url) else url for url in urls]
+
+    open_requests = PlannedScan.objects.all().filter(
+        activity=Activity[activity].value,
+        scanner=Scanner[scanner].value,
+        state__in=[State["requested"].value, State["picked_up"].value],
+    )
+    onboarding_urls = Url.objects.all().filter(onboarded=False)
+    # For a few urls only those are checked, for many urls it is cheaper to retrieve all open requests.
+    if len(url_ids) <= REQUEST_CHUNK_SIZE:
+        open_requests = open_requests.filter(url__in=url_ids)
+        onboarding_urls = onboarding_urls.filter(id__in=url_ids)
+    open_requests = {
+        url_id: (scan_id, state, scan_priority)
+        for scan_id, url_id, state, scan_priority in (open_requests.values_list("id", "url", "state", "priority"))
+    }
+    onboarding_url_ids = set(onboarding_urls.values_list("id", flat=True))
+
+    now = datetime.now(pytz.utc)
+    # To use the index on requested_at_when times are reduced to whole hours.
+    # This is sane enough to allow tons of scans per day still, but the creation
+    # of status reports is much faster. Still gives an idea of how many scans are made.
+    # The minutes are rounded to every 10 minutes. So there is still a sense of progress and use the index
+    discard = timedelta(minutes=now.minute % 10, seconds=now.second, microseconds=now.microsecond)
+
+    new_requests = []
+    raised_priorities = defaultdict(list)
+    for url_id in url_ids:
+        url_priority = Priority["onboarding"].value if url_id in onboarding_url_ids else Priority[priority].value
+
+        if url_id in open_requests:
+            log.debug(f"Already registered: {activity} on {scanner} for {url_id}.")
+            scan_id, state, scan_priority = open_requests[url_id]
+            if state == State["requested"].value and url_priority < scan_priority:
+                raised_priorities[url_priority].append(scan_id)
+                open_requests[url_id] = (scan_id, state, url_priority)
+            continue
+
+        new_request = PlannedScan(
+            activity=Activity[activity].value,
+            scanner=Scanner[scanner].value,
+            url_id=url_id,
+            state=State["requested"].value,
+            priority=url_priority,
+            last_state_change_at=now,
+            requested_at_when=now - discard,
+        )
+        new_requests.append(new_request)
+        open_requests[url_id] = (None, new_request.state, new_request.priority)
+
+    with transaction.atomic():
+        PlannedScan.objects.bulk_create(new_requests, batch_size=REQUEST_CHUNK_SIZE)
+        count_progress(Scanner[scanner].value, Activity[activity].value, State["requested"].value, len(new_requests))
+    for url_priority, scan_ids in raised_priorities.items():
+        for chunk in in_chunks(scan_ids, REQUEST_CHUNK_SIZE):
+            PlannedScan.objects.all().filter(id__in=chunk).update(priority=url_priority)
+
+    duplicates = len(url_ids) - len(new_requests)
+    if duplicates:
+        statsd.incr(
+            "scan_planned", duplicates, tags={"state": "duplicate_request", "scanner": scanner, "activity": activity}
+        )
+    if new_requests:
+        statsd.incr(
+            "scan_planned", len(new_requests), tags={"state": "request", "scanner": scanner, "activity": activity}
+        )
+
+    log.debug(f"Requested {activity} with {scanner} on {len(new_requests)} of {len(url_ids)} urls.")
 
 
 def already_requested(activity: str, scanner: str, url_id: int):
@@ -262,9 +430,68 @@ def already_requested(activity: str, scanner: str, url_id: int):
 
 @app.task(queue="storage")
 def finish(activity: str, scanner: str, url_id: int):
-    set_scan_state(activity, scanner, url_id, "finished")
+    """
+    Finishes the oldest picked up scan of this activity and scanner on the url.
+
+    With a finish buffer the scan is added to the buffer, which is written to the database in batches by
+    flush_finished_scans. That task is scheduled when the first scan is added to an empty buffer.
+    """
     statsd.incr("scan_planned", tags={"state": "finished", "scanner": scanner, "activity": activity})
 
+    buffer = finish_buffer()
+    if not buffer:
+        set_scan_state(activity, scanner, url_id, "finished")
+        return
+
+    if buffer.rpush(FINISH_BUFFER_KEY, json.dumps([activity, scanner, url_id, "finished"])) == 1:
+        flush_finished_scans.apply_async(countdown=FINISH_BUFFER_FLUSH_INTERVAL)
+
+
+@lru_cache(maxsize=1)
+def finish_buffer():
+    if not settings.PLANNED_SCAN_FINISH_BUFFER:
+        return None
+    return redis.Redis.from_url(settings.PLANNED_SCAN_FINISH_BUFFER)
+
+
+@app.task(queue="storage")
+def flush_finished_scans():
+    """
+    Writes all buffered finished scans to the database, with an update per activity and scanner per batch. This
+    also runs periodically, in case a scheduled flush got lost. Otherwise the buffer would never be written, as a
+    flush is only scheduled when the buffer was empty.
+    """
+    buffer = finish_buffer()
+    if not buffer:
+        return
+
+    while True:
+        pipeline = buffer.pipeline()
+        pipeline.lrange(FINISH_BUFFER_KEY, 0, FINISH_BUFFER_BATCH_SIZE - 1)
+        pipeline.ltrim(FINISH_BUFFER_KEY, FINISH_BUFFER_BATCH_SIZE, -1)
+        events, _ = pipeline.execute()
+        if not events:
+            return
+
+        urls_per_group = defaultdict(list)
+        for event in events:
+            activity, scanner, url_id, state = json.loads(event)
+            urls_per_group[(activity, scanner, state)].append(url_id)
+
+        try:
+            # all or nothing, otherwise the groups that were written would be written again
+            with transaction.atomic():
+                for (activity, scanner, state), url_ids in urls_per_group.items():
+                    set_scan_states(activity, scanner, url_ids, state)
+        except Exception:
+            # Don't lose these scans, they will be flushed again later. The buffer is not empty now, so finish will
+            # not schedule a flush: that is done here.
+            buffer.rpush(FINISH_BUFFER_KEY, *events)
+            flush_finished_scans.apply_async(countdown=FINISH_BUFFER_FLUSH_INTERVAL)
+            raise
+
+        log.debug(f"Flushed {len(events)} finished scans in {len(urls_per_group)} groups.")
+
 
 def set_scan_state(activity: str, scanner: str, url_id: int, state="finished"):
     oldest_scan = (
@@ -281,17 +508,99 @@ def set_scan_state(activity: str, scanner: str, url_id: int, state="finished"):
         oldest_scan.state = State[state].value
         oldest_scan.last_state_change_at = datetime.now(pytz.utc)
         oldest_scan.finished_at_when = datetime.now(pytz.utc)
-        oldest_scan.save()
+        with transaction.atomic():
+            oldest_scan.save()
+            count_progress(oldest_scan.scanner, oldest_scan.activity, State["picked_up"].value, -1)
+            count_progress(oldest_scan.scanner, oldest_scan.activity, State[state].value, 1)
 
         log.debug(f"Altered planned scan state for {url_id}. Changing it to {activity} with {scanner}.")
     else:
         log.debug(f"No planned scan found for {url_id}. Ignored.")
 
 
+def set_scan_states(activity: str, scanner: str, url_ids: List[int], state="finished") -> int:
+    """
+    set_scan_state for many urls at once. An url that is in the list multiple times changes that many scans,
+    oldest first. Returns the amount of altered scans.
+    """
+    altered = 0
+    for chunk in in_chunks(sorted(url_ids), CLAIM_CHUNK_SIZE):
+        remaining = Counter(chunk)
+        picked_up_scans = (
+            PlannedScan.objects.all()
+            .filter(
+                activity=Activity[activity].value,
+                scanner=Scanner[scanner].value,
+                url__in=remaining.keys(),
+                state=State["picked_up"].value,
+            )
+            .order_by("id")
+            .values_list("id", "url")
+        )
+
+        scan_ids = []
+        for scan_id, url_id in picked_up_scans:
+            if remaining[url_id]:
+                remaining[url_id] -= 1
+                scan_ids.append(scan_id)
+
+        now = datetime.now(pytz.utc)
+        with transaction.atomic():
+            altered_in_chunk = (
+                PlannedScan.objects.all()
+                .filter(id__in=scan_ids, state=State["picked_up"].value)
+                .update(state=State[state].value, last_state_change_at=now, finished_at_when=now)
+            )
+            count_progress(
+                Scanner[scanner].value, Activity[activity].value, State["picked_up"].value, -altered_in_chunk
+            )
+            count_progress(Scanner[scanner].value, Activity[activity].value, State[state].value, altered_in_chunk)
+        altered += altered_in_chunk
+
+    log.debug(f"Altered {altered} planned scans of {len(url_ids)} urls to {state} for {activity} with {scanner}.")
+    return altered
+
+
 @app.task(queue="storage")
 def finish_multiple(activity: str, scanner: str, urls: List[int]):
-    for url in urls:
-        finish(activity, scanner, url)
+    set_scan_states(activity, scanner, urls, "finished")
+    statsd.incr("scan_planned", len(urls), tags={"state": "finished", "scanner": scanner, "activity": activity})
+
+
+@app.task(queue="storage")
+def archive_finished_scans(days: int = 7) -> int:
+    """
+    Moves planned scans that finished more than days ago to ArchivedPlannedScan. This keeps the planned scan table
+    small, as it would otherwise grow with every scan. Returns the amount of archived scans.
+    """
+    before = datetime.now(pytz.utc) - timedelta(days=days)
+    finished_scans = PlannedScan.objects.all().filter(
+        Q(finished_at_when__lt=before) | Q(finished_at_when__isnull=True, requested_at_when__lt=before),
+        state=State["finished"].value,
+    )
+
+    archived = 0
+    while True:
+        with transaction.atomic():
+            scans = list(
+                finished_scans.values(
+                    "id", "url_id", "scanner", "activity", "state", "requested_at_when", "finished_at_when"
+                )[0:ARCHIVE_BATCH_SIZE]
+            )
+            if not scans:
+                break
+
+            ArchivedPlannedScan.objects.bulk_create(
+                [
+                    ArchivedPlannedScan(**{field: value for field, value in scan.items() if field != "id"})
+                    for scan in scans
+                ]
+            )
+            PlannedScan.objects.all().filter(id__in=[scan["id"] for scan in scans]).delete()
+        archived += len(scans)
+
+    log.debug(f"Archived {archived} finished planned scans.")
+    return archived
 
 
 def retrieve_endpoints_from_urls(
@@ -401,65 +710,97 @@ def deduplicate_plan(planned_items):
 
 @app.task(queue="storage")
 def plan_outdated_scans(published_scan_types):
+    # Outdated is earlier than the map_health says something is outdated. Otherwise we're always
+    # one day behind with scans, and thus is always something outdated.
+    cutoff = datetime.now(pytz.utc) - timedelta(hours=24 * 5)
+
+    outdated = set()
     for map_configuration in filter_map_configs():
         log.debug(f"Retrieving outdated scans from config: {map_configuration}.")
-
-        organizations_on_map = Organization.objects.all().filter(
-            country=map_configuration["country"], type=map_configuration["organization_type"]
+        outdated |= find_outdated_scans(
+            published_scan_types, map_configuration["country"], map_configuration["organization_type"], cutoff
         )
 
-        log.debug(f"There are {len(organizations_on_map)} organizations on this map.")
+    # and finally, plan it, in one go per activity and scanner.
+    plan = plan_for_outdated_scans(outdated)
+    for (activity, scanner), url_ids in plan.items():
+        request(activity, scanner, sorted(url_ids), priority="outdated")
 
-        # Outdated is earlier than the map_health says something is outdated. Otherwise we're always
-        # one day behind with scans, and thus is always something outdated.
-        outdated = get_outdated_ratings(organizations_on_map, 24 * 5)
-        relevant_outdated = [item for item in outdated if item.get("scan_type", "unknown") in published_scan_types]
+    log.debug(f"Planned {sum(len(url_ids) for url_ids in plan.values())} scans / verify and discovery tasks.")
 
-        # plan scans for outdated results:
-        plan = []
-        for outdated_result in relevant_outdated:
-            scanner = SCAN_TYPES_TO_SCANNER[outdated_result["scan_type"]]
-            plan.append(
-                {
-                    "scanner": scanner["name"],
-                    "url": outdated_result["url"],
-                    "activity": "scan",
-                }
-            )
 
-            # see if there are requirements for verification or discovery from other scanners:
-            # log.debug(f"There are {len(scanner['needs results from'])} underlaying scanners.")
-            for underlaying_scanner in scanner["needs results from"]:
-                underlaying_scanner_details = SCANNERS_BY_NAME[underlaying_scanner]
+def find_outdated_scans(
+    published_scan_types, country: str, organization_type: int, cutoff: datetime
+) -> Set[Tuple[str, int]]:
+    """
+    The scan types and urls of the latest scans that were last performed before the cutoff, on the alive endpoints
+    and urls of the organizations on a map. Only plan for alive urls anyway.
+    """
+    alive_urls = {
+        "is_dead": False,
+        "not_resolvable": False,
+        "organization__country": country,
+        "organization__type": organization_type,
+    }
+
+    endpoint_scans = EndpointGenericScan.objects.all().filter(
+        latest_scan__isnull=False,
+        last_scan_moment__lt=cutoff,
+        type__in=published_scan_types,
+        endpoint__is_dead=False,
+        **{f"endpoint__url__{field}": value for field, value in alive_urls.items()},
+    )
+    url_scans = UrlGenericScan.objects.all().filter(
+        latest_scan__isnull=False,
+        last_scan_moment__lt=cutoff,
+        type__in=published_scan_types,
+        **{f"url__{field}": value for field, value in alive_urls.items()},
+    )
+
+    outdated = set(endpoint_scans.values_list("type", "endpoint__url_id").distinct())
+    outdated |= set(url_scans.values_list("type", "url_id").distinct())
+    return outdated
 
-                if any(
-                    [
-                        underlaying_scanner_details["can discover endpoints"],
-                        underlaying_scanner_details["can discover urls"],
-                    ]
-                ):
-                    plan.append({"scanner": underlaying_scanner, "url": outdated_result["url"], "activity": "discover"})
-                if any(
-                    [
-                        underlaying_scanner_details["can verify endpoints"],
-                        underlaying_scanner_details["can verify urls"],
-                    ]
-                ):
-                    plan.append({"scanner": underlaying_scanner, "url": outdated_result["url"], "activity": "verify"})
 
-        # there can be many duplicate tasks, especially when there are multiple scan results from a single scanner.
-        clean_plan = deduplicate_plan(plan)
+def plan_for_outdated_scans(outdated: Iterable[Tuple[str, int]]) -> Dict[Tuple[str, str], Set[int]]:
+    """
+    The urls per activity and scanner to get new results for outdated scan types on urls. Scans from scanners that
+    need results from other scanners also need discovery and verification by those scanners.
+    """
+    activities_per_scan_type = {}
+    plan = defaultdict(set)
+    for scan_type, url_id in outdated:
+        if scan_type not in activities_per_scan_type:
+            activities_per_scan_type[scan_type] = activities_for_scan_type(scan_type)
+
+        for activity_and_scanner in activities_per_scan_type[scan_type]:
+            plan[activity_and_scanner].add(url_id)
+    return plan
 
-        # make sure the urls are actual urls. Only plan for alive urls anyway.
-        clean_plan_with_urls = []
-        for item in clean_plan:
-            url = Url.objects.all().filter(url=item["url"], is_dead=False, not_resolvable=False).first()
-            if url:
-                item["url"] = url
-                clean_plan_with_urls.append(item)
 
-        # and finally, plan it...
-        for item in clean_plan_with_urls:
-            request(item["activity"], item["scanner"], [item["url"]])
+def activities_for_scan_type(scan_type: str) -> List[Tuple[str, str]]:
+    if scan_type not in SCAN_TYPES_TO_SCANNER:
+        return []
 
-        log.debug(f"Planned {len(clean_plan_with_urls)} scans / verify and discovery tasks.")
+    scanner = SCAN_TYPES_TO_SCANNER[scan_type]
+    activities = [("scan", scanner["name"])]
+
+    # see if there are requirements for verification or discovery from other scanners:
+    for underlaying_scanner in scanner["needs results from"]:
+        underlaying_scanner_details = SCANNERS_BY_NAME[underlaying_scanner]
+
+        if any(
+            [
+                underlaying_scanner_details["can discover endpoints"],
+                underlaying_scanner_details["can discover urls"],
+            ]
+        ):
+            activities.append(("discover", underlaying_scanner))
+        if any(
+            [
+                underlaying_scanner_details["can verify endpoints"],
+                underlaying_scanner_details["can verify urls"],
+            ]
+        ):
+            activities.append(("verify", underlaying_scanner))
+    return activities
@@ -1,14 +1,14 @@
 import logging
+import random
 from datetime import datetime, timedelta
 from http.client import BadStatusLine
 from multiprocessing.pool import ThreadPool
-from time import sleep
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional
 
 import pytz
 import requests
 from constance import config
-from django.db import transaction
+from django.db.models import Q
 from requests.exceptions import ConnectTimeout, ProxyError, SSLError
 from tenacity import RetryError, before_log, retry, stop_after_attempt, wait_fixed
 from urllib3.exceptions import ProtocolError
@@ -22,92 +22,131 @@ PROXY_SERVER_TIMEOUT = 30
 log = logging.getLogger(__name__)
 
 
-@app.task(queue="claim_proxy")
-def claim_proxy(tracing_label="") -> Dict[str, Any]:
+# A claimed proxy is released after this time, also when the scan using it never releases it. A scan of 25 addresses
+# takes about 45 minutes, and in bad cases double that. So let's quadruple that time.
+LEASE_DURATION = timedelta(hours=3)
+
+# Seconds to wait before trying to claim a proxy again, when all proxies are claimed.
+CLAIM_RETRY_DELAY = 60
+
+# The capacity of a proxy at qualys, when it has not been checked yet.
+DEFAULT_QUALYS_CAPACITY = 25
+
+
+def available_proxies():
+    """Proxies that can be claimed: alive and not claimed, or claimed with an expired lease."""
+    return ScanProxy.objects.all().filter(
+        Q(currently_used_in_tls_qualys_scan=False) | Q(lease_until__lt=datetime.now(pytz.utc)),
+        is_dead=False,
+        manually_disabled=False,
+        # proxies that are too slow tend to have timeout errors
+        # self hosted proxies are between 150 and 300 ms.
+        # more proxy checks at the same time make slower results... disabled for now
+        # request_speed_in_ms__lte=2000
+        request_speed_in_ms__gte=1,
+    )
+
+
+@app.task(queue="claim_proxy", bind=True)
+def claim_proxy(self, tracing_label="") -> Dict[str, Any]:
     """A proxy should first be claimed and then checked. If not, several scans might use the same proxy and thus
     crash.
 
-    This is run on a dedicated worker as this is a blocking task.
+    When no proxy is available the task is retried later, so the worker can continue with other tasks. A claim is a
+    lease: it expires after LEASE_DURATION, so proxies of crashed scans become available again.
 
     There used to be rate limiting to 30/hour. But that is not needed anymore since all scan tasks are now planned.
     These planned tasks claim whatever free proxy is available, if there are none, no proxies are even attempted to
     be claimed.
     """
+    log.debug(f"Attempting to claim a proxy to scan {tracing_label} et al...")
 
-    # try to get the first available, fastest, proxy
-    while True:
+    proxy = lease_proxy(tracing_label)
+    if proxy:
+        # we can't check for proxy quality here, as that will fill up the strorage with long tasks.
+        # instead run the proxy checking worker every hour or so to make sure the list stays fresh.
+        return proxy
 
-        log.debug(f"Attempting to claim a proxy to scan {tracing_label} et al...")
+    # do not log an error here, when forgetting to add proxies or if there are no clean proxies anymore,
+    # the queue might fill up with too many claim_proxy tasks. This can lead up to 30.000 issues per day.
+    log.debug(
+        f"No proxies available for {tracing_label} et al. "
+        f"You can add more proxies to solve this. Will try again in {CLAIM_RETRY_DELAY} seconds."
+    )
+    # waiting for a proxy is not an error, so it can happen any number of times
+    raise self.retry(countdown=CLAIM_RETRY_DELAY, max_retries=float("inf"))
 
-        try:
 
-            with transaction.atomic():
-
-                # proxies can die if they are limited too often.
-                proxy = (
-                    ScanProxy.objects.all()
-                    .filter(
-                        is_dead=False,
-                        currently_used_in_tls_qualys_scan=False,
-                        manually_disabled=False,
-                        request_speed_in_ms__gte=1,
-                        # proxies that are too slow tend to have timeout errors
-                        # self hosted proxies are between 150 and 300 ms.
-                        # more proxy checks at the same time make slower results... disabled for now
-                        # request_speed_in_ms__lte=2000
-                    )
-                    .order_by("request_speed_in_ms")
-                    .first()
-                )
-
-                if proxy:
-
-                    # first claim to prevent duplicate claims
-                    log.debug(f"Proxy {proxy.id} claimed for {tracing_label} et al...")
-                    proxy.currently_used_in_tls_qualys_scan = True
-                    proxy.last_claim_at = datetime.now(pytz.utc)
-                    proxy.save(update_fields=["currently_used_in_tls_qualys_scan", "last_claim_at"])
-
-                    # we can't check for proxy quality here, as that will fill up the strorage with long tasks.
-                    # instead run the proxy checking worker every hour or so to make sure the list stays fresh.
-                    # if check_proxy(proxy):
-                    #    log.debug('Using proxy %s for scan.' % proxy)
-                    return {"id": proxy.pk, "address": proxy.address, "protocol": proxy.protocol}
-                    # else:
-                    #     log.debug('Proxy %s was not suitable for scanning. Trying another one in 60 seconds.' % proxy)
-
-                else:
-                    # do not log an error here, when forgetting to add proxies or if there are no clean proxies anymore,
-                    # the queue might fill up with too many claim_proxy tasks. Each of them continuing in their own
-                    # thread
-                    # to get a proxy every 2 minutes (30/h). This can lead up to 30.000 issues per day.
-                    # When you have over 500 proxy requests, things are off. It's better to start with a clean
-                    # slate then.
-                    log.debug(
-                        f"No proxies available for {tracing_label} et al. "
-                        f"You can add more proxies to solve this. Will try again in 60 seconds."
-                    )
-
-        except BaseException as e:
-            # In some rare cases this method crashes, while it should be as reliable as can be.
-            log.error(f"Exception occurred when requesting a proxy for {tracing_label} et al")
-            log.exception(e)
-            raise e
-
-        sleep(60)
+def lease_proxy(tracing_label="") -> Optional[Dict[str, Any]]:
+    """Claims one of the available proxies, healthier proxies are claimed more often. Returns None if there is none."""
+    return lease_first(health_weighted_order(list(available_proxies())), tracing_label)
+
+
+def health_weighted_order(proxies: List[ScanProxy]) -> List[ScanProxy]:
+    """
+    A random order where faster proxies with more free capacity at qualys are more likely to come first. Spreading
+    claims over the proxies, instead of all claiming the fastest one, makes that simultaneous claims rarely collide.
+
+    This is a weighted random sample: https://en.wikipedia.org/wiki/Reservoir_sampling#Algorithm_A-Res
+    """
+    if not proxies:
+        return []
+
+    weights = [proxy_health(proxy) for proxy in proxies]
+    highest = max(weights)
+    keys = [random.random() ** (highest / weight) for weight in weights]  # nosec not used for security
+    return [proxy for key, proxy in sorted(zip(keys, proxies), key=lambda key_and_proxy: -key_and_proxy[0])]
+
+
+def proxy_health(proxy: ScanProxy) -> float:
+    capacity = proxy.qualys_capacity_this_client
+    if capacity < 1:
+        capacity = DEFAULT_QUALYS_CAPACITY
+    free_capacity = min(max(capacity - max(proxy.qualys_capacity_current, 0), 0) / capacity, 1)
+
+    # Capacity is only checked once in a while, so a full proxy is still claimed once in a while.
+    return (0.1 + free_capacity) / proxy.request_speed_in_ms
+
+
+def lease_first(proxies: List[ScanProxy], tracing_label="") -> Optional[Dict[str, Any]]:
+    """
+    Leases the first proxy that is still available, others might have claimed the other proxies in the meantime. The
+    end of the lease is added to the proxy, so only this lease can be released.
+    """
+    now = datetime.now(pytz.utc)
+    lease_until = now + LEASE_DURATION
+
+    for proxy in proxies:
+        # The claim only succeeds if the proxy is still available, this is atomic for every database.
+        claimed = (
+            available_proxies()
+            .filter(pk=proxy.pk)
+            .update(currently_used_in_tls_qualys_scan=True, last_claim_at=now, lease_until=lease_until)
+        )
+        if claimed:
+            log.debug(f"Proxy {proxy.id} claimed for {tracing_label} et al...")
+            return {**proxy.as_dict(), "lease_until": lease_until.isoformat()}
+
+    return None
 
 
 @app.task(queue="storage")
 def release_proxy(proxy: Dict[str, Any], tracing_label=""):
-    """As the claim proxy queue is ALWAYS filled, you cannot insert release proxy commands there..."""
+    """
+    As the claim proxy queue is ALWAYS filled, you cannot insert release proxy commands there...
+
+    A scan that took longer than its lease might release the proxy after another scan claimed it. Only the lease of
+    the proxy is released, so the proxy stays claimed by the other scan.
+    """
     log.debug(f"Releasing proxy {proxy['id']} claimed for {tracing_label} et al...")
 
-    db_proxy = ScanProxy.objects.all().filter(pk=proxy["id"]).first()
-    if not db_proxy:
-        return
+    lease = ScanProxy.objects.all().filter(pk=proxy["id"])
+    # proxies that are claimed without a lease, are released unconditionally
+    if proxy.get("lease_until"):
+        lease = lease.filter(lease_until=datetime.fromisoformat(proxy["lease_until"]))
 
-    db_proxy.currently_used_in_tls_qualys_scan = False
-    db_proxy.save(update_fields=["currently_used_in_tls_qualys_scan"])
+    if not lease.update(currently_used_in_tls_qualys_scan=False, lease_until=None):
+        log.warning(f"Proxy {proxy['id']} was not released for {tracing_label}: the lease expired and was taken over.")
 
 
 @app.task(queue="storage")
@@ -127,29 +166,18 @@ def check_all_proxies():
 
 
 def timeout_claims():
-    for proxy in ScanProxy.objects.all():
-        release_claim_after_timeout(proxy.as_dict())
-
-
-def release_claim_after_timeout(proxy: Dict[str, Any]):
-    # Release all proxies that have been claimed a few hours before. As a scan of 25 addresss takes about 45 minutes.
-    # And in bad cases only double that. So let's quadruple that time and then just release the proxy automatically
-    # because of a timeout. Last claim at can be empty.
-
-    db_proxy = ScanProxy.objects.all().filter(pk=proxy["id"]).first()
-    if not db_proxy:
-        return
-
-    if db_proxy.last_claim_at:
-        if all(
-            [
-                db_proxy.last_claim_at < datetime.now(pytz.utc) - timedelta(hours=3),
-                db_proxy.currently_used_in_tls_qualys_scan,
-            ]
-        ):
-            log.warning(f"Force released proxy {db_proxy.pk} because of a claim timeout period of 3 hours.")
-            db_proxy.currently_used_in_tls_qualys_scan = False
-            db_proxy.save(update_fields=["currently_used_in_tls_qualys_scan"])
+    """
+    Expired leases are available to claim already, this also shows them as released. Claims from before leases
+    existed are released three hours after they have been claimed. Last claim at can be empty.
+    """
+    now = datetime.now(pytz.utc)
+    expired = ScanProxy.objects.all().filter(
+        Q(lease_until__lt=now) | Q(lease_until__isnull=True, last_claim_at__lt=now - LEASE_DURATION),
+        currently_used_in_tls_qualys_scan=True,
+    )
+    for proxy_id in expired.values_list("id", flat=True):
+        log.warning(f"Force released proxy {proxy_id} because of a claim timeout period of 3 hours.")
+    expired.update(currently_used_in_tls_qualys_scan=False, lease_until=None)
 
 
 @app.task(queue="internet")
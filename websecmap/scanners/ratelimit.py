@@ -0,0 +1,191 @@
+"""
+Rate limits of scanners that are shared by all workers, so adding workers does not add load on the scanned networks
+and the services that are used.
+
+Celery rate limits apply per worker, and a rate limited task blocks the worker for other tasks. Instead the scanner
+tasks take a token from a bucket before scanning. When the bucket is empty, the next token is reserved for the task and
+the task is retried at the moment of that token. The worker continues with other tasks. Every waiting task has its own
+token, so waiting tasks don't compete for the same token over and over.
+
+Tokens are reserved at most RESERVATION_HORIZON ahead. The redis broker delivers a task again when it is not
+acknowledged within its visibility timeout, one hour by default, which includes the time that a retry with a countdown
+is held by a worker. A task that is delivered again would still have its reservation, and scan twice. When the token is
+further ahead, nothing is reserved and the task is retried later to try again.
+
+There is a bucket per scanner and target. The target is the network of the scanned ip address, the used service or
+nothing for a scanner-wide limit. When settings.SCANNER_RATE_LIMIT_REDIS is set, the buckets are stored in redis and
+shared between workers. Otherwise, or when redis can't be reached, every worker process has its own buckets.
+"""
+import ipaddress
+import logging
+import threading
+import time
+from functools import lru_cache
+
+import redis
+from celery.utils.time import rate
+from django.conf import settings
+from statshog.defaults.django import statsd
+
+from websecmap.scanners.resolver import LRUCache
+
+log = logging.getLogger(__name__)
+
+# The budgets, in the notation of celery rate limits.
+RATES = {
+    # per network
+    "can_connect": "120/s",
+    # per service
+    "certificate_transparency_scan": "2/m",
+    "make_screenshot": "60/m",
+    # for all targets: 60/h = 10.000 scans / week.
+    "wordlist_scan": "60/h",
+    "nsec_scan": "4/m",
+}
+
+# The size of the networks that share a bucket, the size of networks given to a single organization or hosting party.
+IPV4_NETWORK_PREFIX = 24
+IPV6_NETWORK_PREFIX = 48
+
+BUCKET_KEY = "rate_limit:{scanner}:{target}"
+
+# Seconds, well within the visibility timeout of the redis broker.
+RESERVATION_HORIZON = 30 * 60
+
+# Buckets of a worker process, of at most this many targets. Buckets that are full again are removed.
+LOCAL_BUCKETS = 10000
+
+# Mirrors TokenBucket.take. The time is given by the worker, as scripts may not write after reading the time of redis.
+TAKE_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local fill_rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local horizon = tonumber(ARGV[4])
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "updated")
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * fill_rate) - 1
+local wait = math.max(0, -tokens / fill_rate)
+if horizon >= 0 and wait > horizon then
+    return tostring(wait)
+end
+redis.call("HMSET", KEYS[1], "tokens", tokens, "updated", now)
+redis.call("EXPIRE", KEYS[1], math.ceil((capacity - tokens) / fill_rate) + 1)
+return tostring(wait)
+"""
+
+# A task that is retried for its reserved token has this header, so it does not take another token.
+RESERVATION_HEADER = "rate_limit_reservation"
+
+
+class TokenBucket:
+    """As the token bucket of celery, which holds one token: tasks are spread evenly over time without bursts."""
+
+    capacity = 1
+
+    def __init__(self, fill_rate: float):
+        self.fill_rate = fill_rate
+        self.tokens = self.capacity
+        self.updated = time.time()
+
+    def take(self, horizon: float = -1) -> float:
+        """
+        Takes a token, returns 0. When there is no token, the next free token is reserved and the seconds until that
+        token are returned. The tokens go below zero for the reserved tokens. When a horizon is given and the next
+        free token is further ahead, nothing is reserved.
+        """
+        now = time.time()
+        tokens = min(self.capacity, self.tokens + max(0, now - self.updated) * self.fill_rate) - 1
+        wait = max(0, -tokens / self.fill_rate)
+        if 0 <= horizon < wait:
+            return wait
+
+        self.tokens = tokens
+        self.updated = now
+        return wait
+
+    def refill_time(self) -> float:
+        return (self.capacity - self.tokens) / self.fill_rate
+
+
+local_buckets = LRUCache(LOCAL_BUCKETS)
+local_buckets_lock = threading.Lock()
+
+
+@lru_cache(maxsize=1)
+def redis_buckets():
+    if not settings.SCANNER_RATE_LIMIT_REDIS:
+        return None
+    return redis.Redis.from_url(settings.SCANNER_RATE_LIMIT_REDIS).register_script(TAKE_SCRIPT)
+
+
+def target_network(ip: str) -> str:
+    """The network of an ip address, networks of organizations and hosting parties share their rate limit."""
+    address = ipaddress.ip_address(ip)
+    prefix = IPV4_NETWORK_PREFIX if address.version == 4 else IPV6_NETWORK_PREFIX
+    return str(ipaddress.ip_network(f"{ip}/{prefix}", strict=False))
+
+
+def acquire(scanner: str, target: str = "", horizon: float = -1) -> float:
+    """
+    Takes a token of the scanner for the target. Returns 0, or the seconds until the token that is reserved for the
+    caller. Wait that long and continue, without acquiring again.
+
+    When a horizon is given and the token is further ahead, nothing is reserved: acquire again later.
+    """
+    fill_rate = rate(RATES[scanner])
+
+    take = redis_buckets()
+    if take:
+        try:
+            wait = float(
+                take(
+                    keys=[BUCKET_KEY.format(scanner=scanner, target=target)],
+                    args=[TokenBucket.capacity, fill_rate, time.time(), horizon],
+                )
+            )
+            statsd.incr("rate_limit", tags={"scanner": scanner, "result": result(wait), "backend": "redis"})
+            return wait
+        except redis.RedisError as error:
+            log.warning("Could not use rate limits in redis, using the rate limits of this worker: %s" % error)
+
+    key = BUCKET_KEY.format(scanner=scanner, target=target)
+    with local_buckets_lock:
+        bucket = local_buckets.get(key) or TokenBucket(fill_rate)
+        wait = bucket.take(horizon)
+        local_buckets.set(key, bucket, bucket.refill_time())
+
+    statsd.incr("rate_limit", tags={"scanner": scanner, "result": result(wait), "backend": "memory"})
+    return wait
+
+
+def result(wait: float) -> str:
+    return "limited" if wait else "allowed"
+
+
+def limit(task, scanner: str, target: str = ""):
+    """
+    Call this in a bound task before scanning. When the rate limit is reached, the task is retried at the moment of
+    the token that is reserved for it. Tasks that are called directly or eagerly, so not via a worker, wait for the
+    token instead.
+    """
+    bucket = BUCKET_KEY.format(scanner=scanner, target=target)
+    # custom headers of a message are attributes of the request
+    if getattr(task.request, RESERVATION_HEADER, None) == bucket:
+        return
+
+    if task.request.called_directly or task.request.is_eager:
+        time.sleep(acquire(scanner, target))
+        return
+
+    wait = acquire(scanner, target, horizon=RESERVATION_HORIZON)
+    if not wait:
+        return
+
+    if wait > RESERVATION_HORIZON:
+        # Too many tasks are waiting. Try again when the next free token is within the horizon, without reservation.
+        raise task.retry(countdown=min(wait - RESERVATION_HORIZON, RESERVATION_HORIZON), max_retries=float("inf"))
+
+    # Waiting for a token is not an error, so it can happen any number of times. Only the retry for the reserved
+    # token has the header, a retry for another reason takes a new token.
+    raise task.retry(countdown=wait, max_retries=float("inf"), headers={RESERVATION_HEADER: bucket})
@@ -0,0 +1,156 @@
+"""
+A cache for the A and AAAA lookups of the scanners, so the same hostname is not resolved over and over again.
+
+Lookups are cached as long as the ttl of the record says, with a maximum of MAX_TTL. Hostnames that do not exist or
+do not have an address are cached as well, as long as the SOA record of the zone says (RFC 2308). Failed lookups, such
+as timeouts, are not cached.
+
+Every worker process has its own in-memory cache. When settings.DNS_CACHE_REDIS is set, lookups are also shared
+between workers via redis. When redis can't be reached, only the in-memory cache is used.
+"""
+import ipaddress
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, List, Optional, Tuple
+
+import redis
+from django.conf import settings
+from dns.exception import DNSException
+from dns.rdatatype import SOA
+from dns.resolver import NXDOMAIN, NoAnswer, Resolver
+from statshog.defaults.django import statsd
+
+log = logging.getLogger(__name__)
+
+RECORD_TYPES = {4: "A", 6: "AAAA"}
+
+# Addresses are cached at most this amount of seconds, even if their records say otherwise.
+MAX_TTL = 3600
+
+# Missing hostnames and addresses are cached this amount of seconds when the response does not contain an SOA record.
+NEGATIVE_TTL = 300
+
+CACHE_KEY = "dns_cache:{record_type}:{hostname}"
+
+
+class LRUCache:
+    """A thread safe cache of a maximum size, which removes the least recently used entry when it is full."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self.lock:
+            if key not in self.entries:
+                return None
+
+            value, expires = self.entries[key]
+            if expires <= time.time():
+                del self.entries[key]
+                return None
+
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: int):
+        with self.lock:
+            self.entries[key] = (value, time.time() + ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+
+@lru_cache(maxsize=1)
+def memory_cache() -> LRUCache:
+    return LRUCache(settings.DNS_CACHE_SIZE)
+
+
+@lru_cache(maxsize=1)
+def redis_cache():
+    if not settings.DNS_CACHE_REDIS:
+        return None
+    return redis.Redis.from_url(settings.DNS_CACHE_REDIS)
+
+
+@lru_cache(maxsize=1)
+def system_resolver() -> Resolver:
+    # the nameservers of the system, as with socket.gethostbyname
+    return Resolver()
+
+
+def resolve(hostname: str, ip_version: int) -> List[str]:
+    """Returns the IPv4 or IPv6 addresses of a hostname. There are no addresses if the hostname can't be resolved."""
+
+    record_type = RECORD_TYPES[ip_version]
+    key = CACHE_KEY.format(record_type=record_type, hostname=hostname.lower())
+
+    addresses = memory_cache().get(key)
+    if addresses is not None:
+        statsd.incr("dns_cache", tags={"result": "hit", "backend": "memory", "record_type": record_type})
+        return addresses
+
+    shared_cache = redis_cache()
+    if shared_cache:
+        try:
+            cached_addresses, ttl = shared_cache.pipeline().get(key).ttl(key).execute()
+        except redis.RedisError as error:
+            log.warning("Could not read the dns cache in redis: %s" % error)
+            cached_addresses, ttl = None, 0
+
+        # the entry can have expired in between
+        if cached_addresses is not None and ttl > 0:
+            statsd.incr("dns_cache", tags={"result": "hit", "backend": "redis", "record_type": record_type})
+            addresses = json.loads(cached_addresses)
+            memory_cache().set(key, addresses, ttl)
+            return addresses
+
+    statsd.incr("dns_cache", tags={"result": "miss", "record_type": record_type})
+    addresses, ttl = lookup(hostname, record_type)
+    if ttl > 0:
+        memory_cache().set(key, addresses, ttl)
+        if shared_cache:
+            try:
+                shared_cache.set(key, json.dumps(addresses), ex=ttl)
+            except redis.RedisError as error:
+                log.warning("Could not write the dns cache in redis: %s" % error)
+
+    return addresses
+
+
+def lookup(hostname: str, record_type: str) -> Tuple[List[str], int]:
+    """Returns the addresses of the hostname and the amount of seconds they can be cached."""
+
+    # ip addresses resolve to themselves
+    try:
+        address = ipaddress.ip_address(hostname)
+        return ([hostname] if RECORD_TYPES[address.version] == record_type else []), MAX_TTL
+    except ValueError:
+        pass
+
+    try:
+        answer = system_resolver().resolve(hostname, record_type)
+        return [rdata.address for rdata in answer], min(answer.rrset.ttl, MAX_TTL)
+    except NXDOMAIN as error:
+        log.debug("%s does not exist." % hostname)
+        return [], negative_ttl(error.responses().values())
+    except NoAnswer as error:
+        log.debug("%s has no %s record." % (hostname, record_type))
+        return [], negative_ttl([error.kwargs.get("response")])
+    except DNSException as error:
+        # timeouts, unreachable nameservers, invalid hostnames. These might be different on the next attempt.
+        log.debug("Could not resolve %s %s: %s" % (hostname, record_type, error))
+        return [], 0
+
+
+def negative_ttl(responses) -> int:
+    for response in responses:
+        for rrset in getattr(response, "authority", []):
+            if rrset.rdtype == SOA:
+                return min(rrset.ttl, rrset[0].minimum, MAX_TTL)
+    return NEGATIVE_TTL
@@ -1,71 +1,154 @@
 import logging
 from datetime import datetime
+from typing import Iterable, Tuple
 
 import pytz
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
 
-from websecmap.scanners.models import Endpoint, EndpointGenericScan, Url, UrlGenericScan
+from websecmap.scanners.models import EndpointGenericScan, LatestEndpointScan, LatestUrlScan, Url, UrlGenericScan
+from websecmap.scanners.scanner.utils import in_chunks
 
 log = logging.getLogger(__package__)
 
 
 def store_endpoint_scan_result(scan_type: str, endpoint_id: int, rating: str, message: str, evidence: str = ""):
+    store_endpoint_scan_results([(scan_type, endpoint_id, rating, message, evidence)])
 
-    # Check if the latest scan has the same rating or not:
-    try:
-        gs = EndpointGenericScan.objects.all().filter(type=scan_type, endpoint=endpoint_id).latest("last_scan_moment")
-        exists = True
-    except ObjectDoesNotExist:
-        exists = False
-        gs = EndpointGenericScan()
 
-    # To deduplicate data, only store changes to scans. We'll update just the scan moment, and the rest stays the same.
-    # The amount of data saved runs in the gigabytes. So it's worth the while doing it like this :)
-    if gs.explanation == str(message) and gs.rating == str(rating):
-        log.debug("Scan had the same rating and message, updating last_scan_moment only.")
-        gs.last_scan_moment = datetime.now(pytz.utc)
-        gs.save(update_fields=["last_scan_moment"])
-        return
+def store_endpoint_scan_results(results: Iterable[Tuple[str, int, str, str, str]]):
+    """
+    Stores many (scan_type, endpoint_id, rating, message, evidence) results at once. The latest scans of all results
+    are retrieved at once, after which unchanged scans are updated and changed scans are inserted in bulk.
 
-    # message and rating changed for this scan_type, so it's worth while to save the scan.
-    if not exists:
-        log.debug("No prior scan result found, creating a new one.")
-    else:
-        log.debug("Message or rating changed compared to previous scan. Saving the new scan result.")
-
-    gs = EndpointGenericScan()
-    # very long csp headers for example
-    gs.explanation = message[0:255]
-    gs.rating = rating
-    gs.endpoint = Endpoint.objects.all().filter(id=endpoint_id).first()
-    gs.type = scan_type
-    # Very long CSP headers for example take a lot of space.
-    gs.evidence = evidence[0:9000]
-    gs.last_scan_moment = datetime.now(pytz.utc)
-    gs.rating_determined_on = datetime.now(pytz.utc)
-    gs.is_the_latest_scan = True
-    gs.save()
+    To deduplicate data, only changes to scans are stored. For the same rating and message only the scan moment of
+    the latest scan is updated. The amount of data saved runs in the gigabytes. So it's worth the while doing it
+    like this :)
+    """
+    results = list(results)
+    now = datetime.now(pytz.utc)
+
+    latest_scans = {}
+    scan_types = {result[0] for result in results}
+    for endpoint_ids in in_chunks(sorted({result[1] for result in results}), 500):
+        for latest_scan in (
+            LatestEndpointScan.objects.all()
+            .filter(endpoint__in=endpoint_ids, type__in=scan_types)
+            .select_related("scan")
+            .only("id", "endpoint_id", "type", "scan__id", "scan__rating", "scan__explanation")
+        ):
+            latest_scans[(latest_scan.type, latest_scan.endpoint_id)] = latest_scan
+
+    unchanged_scan_ids = set()
+    replaced_scan_ids = set()
+    new_scans = []
+    new_latest_scans = {}
+    for scan_type, endpoint_id, rating, message, evidence in results:
+        key = (scan_type, endpoint_id)
+        scan = new_latest_scans.get(key, latest_scans[key].scan if key in latest_scans else None)
+
+        if scan and scan.explanation == str(message) and scan.rating == str(rating):
+            log.debug("Scan had the same rating and message, updating last_scan_moment only.")
+            if scan.pk:
+                unchanged_scan_ids.add(scan.pk)
+            continue
+
+        # message and rating changed for this scan_type, so it's worth while to save the scan.
+        if not scan:
+            log.debug("No prior scan result found, creating a new one.")
+        elif scan.pk:
+            log.debug("Message or rating changed compared to previous scan. Saving the new scan result.")
+            replaced_scan_ids.add(scan.pk)
+        else:
+            # the same endpoint and scan type can occur multiple times in the results
+            scan.is_the_latest_scan = False
+
+        new_latest_scans[key] = EndpointGenericScan(
+            type=scan_type,
+            endpoint_id=endpoint_id,
+            rating=str(rating),
+            # very long csp headers for example
+            explanation=str(message)[0:255],
+            # Very long CSP headers for example take a lot of space.
+            evidence=evidence[0:9000],
+            last_scan_moment=now,
+            rating_determined_on=now,
+            is_the_latest_scan=True,
+        )
+        new_scans.append(new_latest_scans[key])
+
+    with transaction.atomic():
+        for scan_ids in in_chunks(sorted(unchanged_scan_ids), 500):
+            EndpointGenericScan.objects.all().filter(pk__in=scan_ids).update(last_scan_moment=now)
+
+        # Set the previous scans of the changed endpoints + types to NOT be the latest scan.
+        for scan_ids in in_chunks(sorted(replaced_scan_ids), 500):
+            EndpointGenericScan.objects.all().filter(pk__in=scan_ids).update(is_the_latest_scan=False)
+
+        EndpointGenericScan.objects.bulk_create(new_scans, batch_size=500)
+
+        # Not all databases return the ids of bulk inserted rows, so the new latest scans are retrieved.
+        new_latest_scan_ids = {}
+        for endpoint_ids in in_chunks(sorted({key[1] for key in new_latest_scans}), 500):
+            new_latest_scan_ids.update(
+                ((scan_type, endpoint_id), scan_id)
+                for scan_id, scan_type, endpoint_id in EndpointGenericScan.objects.all()
+                .filter(
+                    endpoint__in=endpoint_ids,
+                    type__in=scan_types,
+                    # last_scan_moment is set on insert
+                    rating_determined_on=now,
+                    is_the_latest_scan=True,
+                )
+                .values_list("id", "type", "endpoint_id")
+                if (scan_type, endpoint_id) in new_latest_scans
+            )
+
+        changed_latest_scans = []
+        for key, scan_id in new_latest_scan_ids.items():
+            if key in latest_scans:
+                latest_scans[key].scan_id = scan_id
+                changed_latest_scans.append(latest_scans[key])
+        LatestEndpointScan.objects.bulk_update(changed_latest_scans, ["scan"], batch_size=500)
+
+        first_scan_ids = {key: scan_id for key, scan_id in new_latest_scan_ids.items() if key not in latest_scans}
+        LatestEndpointScan.objects.bulk_create(
+            [
+                LatestEndpointScan(type=scan_type, endpoint_id=endpoint_id, scan_id=scan_id)
+                for (scan_type, endpoint_id), scan_id in first_scan_ids.items()
+            ],
+            batch_size=500,
+            ignore_conflicts=True,
+        )
 
-    # Set all the previous endpoint scans of this endpoint + type to NOT be the latest scan.
-    EndpointGenericScan.objects.all().filter(endpoint=gs.endpoint, type=gs.type).exclude(pk=gs.pk).update(
-        is_the_latest_scan=False
-    )
+        # Another worker can store the first scan of the same endpoint and type at the same time. The latest scan
+        # of that worker was inserted first and is kept, it is replaced with the scan stored here.
+        conflicting_latest_scans = []
+        conflicting_scan_ids = []
+        for endpoint_ids in in_chunks(sorted({key[1] for key in first_scan_ids}), 500):
+            for latest_scan in (
+                LatestEndpointScan.objects.all()
+                .select_for_update()
+                .filter(endpoint__in=endpoint_ids, type__in=scan_types)
+                .only("id", "endpoint_id", "type", "scan_id")
+            ):
+                scan_id = first_scan_ids.get((latest_scan.type, latest_scan.endpoint_id))
+                if scan_id and latest_scan.scan_id != scan_id:
+                    conflicting_scan_ids.append(latest_scan.scan_id)
+                    latest_scan.scan_id = scan_id
+                    conflicting_latest_scans.append(latest_scan)
+
+        if conflicting_latest_scans:
+            log.debug(f"Replacing {len(conflicting_latest_scans)} latest scans that were stored at the same time.")
+            EndpointGenericScan.objects.all().filter(pk__in=conflicting_scan_ids).update(is_the_latest_scan=False)
+            LatestEndpointScan.objects.bulk_update(conflicting_latest_scans, ["scan"], batch_size=500)
 
 
 def store_url_scan_result(scan_type: str, url_id: int, rating: str, message: str, evidence: str = ""):
 
     # Check if the latest scan has the same rating or not:
-    try:
-        gs = (
-            UrlGenericScan.objects.all()
-            .filter(
-                type=scan_type,
-                url=url_id,
-            )
-            .latest("last_scan_moment")
-        )
-    except ObjectDoesNotExist:
-        gs = UrlGenericScan()
+    latest_scan = LatestUrlScan.objects.all().filter(type=scan_type, url=url_id).select_related("scan").first()
+    gs = latest_scan.scan if latest_scan else UrlGenericScan()
 
     # here we figured out that you can still pass a bool while type hinting.
     # log.debug("Explanation new: '%s', old: '%s' eq: %s, Rating new: '%s', old: '%s', eq: %s" %
@@ -77,21 +160,35 @@ def store_url_scan_result(scan_type: str, url_id: int, rating: str, message: str
         log.debug("Scan had the same rating and message, updating last_scan_moment only.")
         gs.last_scan_moment = datetime.now(pytz.utc)
         gs.save(update_fields=["last_scan_moment"])
-    else:
-        # message and rating changed for this scan_type, so it's worth while to save the scan.
-        log.debug("Message or rating changed: making a new generic scan.")
-        gs = UrlGenericScan()
-        gs.explanation = message
-        gs.rating = rating
-        gs.url = Url.objects.all().filter(id=url_id).first()
-        gs.evidence = evidence
-        gs.type = scan_type
-        gs.last_scan_moment = datetime.now(pytz.utc)
-        gs.rating_determined_on = datetime.now(pytz.utc)
-        gs.is_the_latest_scan = True
+        return
+
+    # message and rating changed for this scan_type, so it's worth while to save the scan.
+    log.debug("Message or rating changed: making a new generic scan.")
+    gs = UrlGenericScan()
+    gs.explanation = message
+    gs.rating = rating
+    gs.url = Url.objects.all().filter(id=url_id).first()
+    gs.evidence = evidence
+    gs.type = scan_type
+    gs.last_scan_moment = datetime.now(pytz.utc)
+    gs.rating_determined_on = datetime.now(pytz.utc)
+    gs.is_the_latest_scan = True
+
+    with transaction.atomic():
         gs.save()
 
-        UrlGenericScan.objects.all().filter(url=gs.url, type=gs.type).exclude(pk=gs.pk).update(is_the_latest_scan=False)
+        if not latest_scan:
+            # Another worker can store the first scan of this type on the url at the same time, its latest scan is
+            # then replaced by this scan.
+            latest_scan, created = LatestUrlScan.objects.select_for_update().get_or_create(
+                url_id=url_id, type=scan_type, defaults={"scan": gs}
+            )
+            if created:
+                return
+
+        UrlGenericScan.objects.all().filter(pk=latest_scan.scan_id).update(is_the_latest_scan=False)
+        latest_scan.scan = gs
+        latest_scan.save(update_fields=["scan"])
 
 
 def endpoint_has_scans(scan_type: str, endpoint_id: int):
@@ -22,6 +22,7 @@ from websecmap.scanners import plannedscan
 from websecmap.scanners.scanner import q_configurations_to_scan, unique_and_random, url_filters
 from websecmap.scanners.scanner.http import get_random_user_agent
 from websecmap.scanners.scanner.subdomains import discover_wildcard
+from websecmap.scanners.sessions import get_session
 
 log = logging.getLogger(__name__)
 
@@ -92,7 +93,7 @@ def site_content(url) -> Dict[str, Any]:
     try:
         # Sites as deventer.nl have a different page every load.
         # Sites as hollandskroon.nl have a different page every load. So can't check that automatically.
-        response = requests.get(
+        response = get_session().get(
             f"https://{url}/",
             allow_redirects=True,
             verify=False,  # nosec: certificate validity is checked elsewhere, having some https > none
@@ -24,21 +24,26 @@ HTTP: 80, 280, 591, 593, 2480, 4444, 4445, 4567, 5000, 5104, 5800, 5988, 7001, 8
 Likely: 80, 8080, 8008, 8888, 8088
 
 """
+import asyncio
 import ipaddress
+import json
 import logging
 import random
 import socket
+import ssl
 from datetime import datetime
+from functools import lru_cache
 from ipaddress import AddressValueError
-from typing import List
+from typing import Any, Dict, List, Optional
 
 import pytz
+import redis
 import requests
 
 import urllib3
 from celery import Task, group
 from django.conf import settings
-from requests import HTTPError, ReadTimeout, Request, Session, Timeout
+from requests import HTTPError, ReadTimeout, Request, Timeout
 from requests.exceptions import ConnectionError, SSLError, ChunkedEncodingError, ContentDecodingError, ConnectTimeout
 
 from websecmap.celery import app
@@ -46,13 +51,16 @@ from websecmap.organizations.models import Organization, Url
 from websecmap.scanners import plannedscan
 from websecmap.scanners.models import Endpoint, UrlIp
 from websecmap.scanners.plannedscan import retrieve_endpoints_from_urls
+from websecmap.scanners.ratelimit import acquire, limit, target_network
+from websecmap.scanners.resolver import LRUCache, resolve
+from websecmap.scanners.sessions import get_session
 from websecmap.scanners.scanner.__init__ import (
     allowed_to_discover_endpoints,
     endpoint_filters,
     q_configurations_to_scan,
     unique_and_random,
 )
-from websecmap.scanners.scanner.utils import CELERY_IP_VERSION_QUEUE_NAMES
+from websecmap.scanners.scanner.utils import CELERY_IP_VERSION_QUEUE_NAMES, in_chunks
 from websecmap.scanners.timeout import timeout
 
 # suppress InsecureRequestWarning, we do those request on purpose.
@@ -93,6 +101,33 @@ READ_TIMEOUT = 30
 
 RDNS_TIMEOUT = 30
 
+# The amount of urls that are probed by one discovery task. See discover_endpoints.
+DISCOVERY_BATCH_SIZE = 250
+
+# Errors that show there is a server, although we're not able to communicate with it correctly.
+SERVER_ERRORS = [
+    "BadStatusLine",
+    "CertificateError",
+    "certificate verify failed",
+    "bad handshake",
+    # Handshake failure: so there is an option to create a handshake, but perhaps the server wont respond.
+    # Still a valid endpoint.
+    "SSLV3_ALERT_HANDSHAKE_FAILURE",
+    # When connecting based on ip address and separate host header, the error returned
+    # might not be an SSLV3_ALERT_HANDSHAKE_FAILURE but an TLSV1_ALERT_INTERNAL_ERROR.
+    # In that case there is still a connection, although there is something going wrong with TLS.
+    # in general all SSLErrors mean there is a connection.
+    "TLSV1_ALERT_INTERNAL_ERROR",
+    # Done: what to do with a connection reset. It denotes that there is a service running
+    #  because otherwise there would not be a RST from the TCP handshake. It frequently happens
+    #  that a http site redirects to https and the https gives a connection reset.
+    #  In this case we follow what nmap does; it means the port is open. So perhaps this method
+    #  should be called 'has open port' or 'runs a service'. While we can't connect there is
+    #  definitely a service running there, which means scans should take place.
+    #  -> this will move 'missing https' endpoint warnings to 'could not test' errors.
+    "Connection aborted",
+]
+
 
 def filter_discover(organizations_filter: dict = dict(), urls_filter: dict = dict(), **kwargs):
     # ignore administratively dead domains by default.
@@ -150,24 +185,25 @@ def compose_manual_discover_task(organizations_filter: dict = dict(), urls_filte
 
 
 def compose_discover_task(urls: List[Url]):
+    """
+    Probes all preferred ports of the urls in batches of DISCOVERY_BATCH_SIZE urls per ip version. Each batch is
+    probed concurrently by discover_endpoints, the results are stored by a single store_discovered_endpoints task.
+    """
+    targets = [[url.pk, url.url, PORT_TO_PROTOCOL[port], port] for url in urls for port in PREFERRED_PORT_ORDER]
+    return compose_discover_endpoints_task(targets, origin="http_discover", activity="discover")
+
+
+def compose_discover_endpoints_task(targets: List[List], origin: str, activity: str):
     tasks = []
 
+    # the ports of an url are kept in the same batch, so the url is only resolved once
+    batch_size = DISCOVERY_BATCH_SIZE * len(PREFERRED_PORT_ORDER)
     for ip_version in [4, 6]:
-        for port in PREFERRED_PORT_ORDER:
-            for url in urls:
-                tasks.append(
-                    can_connect.si(protocol=PORT_TO_PROTOCOL[port], url=url.url, port=port, ip_version=ip_version).set(
-                        queue=CELERY_IP_VERSION_QUEUE_NAMES[ip_version]
-                    )
-                    | connect_result.s(
-                        protocol=PORT_TO_PROTOCOL[port],
-                        url_id=url.pk,
-                        port=port,
-                        ip_version=ip_version,
-                        origin="http_discover",
-                    )
-                    | plannedscan.finish.si("discover", "http", url.pk)
-                )
+        for batch in in_chunks(targets, batch_size):
+            tasks.append(
+                discover_endpoints.si(batch, ip_version).set(queue=CELERY_IP_VERSION_QUEUE_NAMES[ip_version])
+                | store_discovered_endpoints.s(ip_version=ip_version, origin=origin, activity=activity)
+            )
 
     return group(tasks)
 
@@ -227,24 +263,23 @@ def compose_verify_task(urls):
     for url_id in urls_without_endpoints:
         plannedscan.finish("verify", "http", url_id)
 
-    tasks = group(
-        can_connect.si(
-            protocol=endpoint.protocol, url=endpoint.url.url, port=endpoint.port, ip_version=endpoint.ip_version
-        ).set(queue=CELERY_IP_VERSION_QUEUE_NAMES[endpoint.ip_version])
-        | connect_result.s(
-            protocol=endpoint.protocol,
-            url_id=endpoint.url.pk,
-            port=endpoint.port,
-            ip_version=endpoint.ip_version,
-            origin="http_verify",
+    tasks = []
+    for ip_version in [4, 6]:
+        # sorted, so the endpoints of an url end up in the same batch
+        targets = sorted(
+            [endpoint.url.pk, endpoint.url.url, endpoint.protocol, endpoint.port]
+            for endpoint in endpoints
+            if endpoint.ip_version == ip_version
         )
-        | plannedscan.finish.si("verify", "http", endpoint.url.pk)
-        for endpoint in endpoints
-    )
+        for batch in in_chunks(targets, DISCOVERY_BATCH_SIZE):
+            tasks.append(
+                discover_endpoints.si(batch, ip_version).set(queue=CELERY_IP_VERSION_QUEUE_NAMES[ip_version])
+                | store_discovered_endpoints.s(ip_version=ip_version, origin="http_verify", activity="verify")
+            )
 
     log.info(f"Verifying {len(endpoints)} http/https endpoints.")
 
-    return tasks
+    return group(tasks)
 
 
 @app.task(queue="4and6")
@@ -266,12 +301,10 @@ def get_ipv4(url: str):
     # https://www.iana.org/assignments/iana-ipv4-special-registry/iana-ipv4-special-registry.xhtml
     ipv4 = ""
 
-    try:
-        ipv4 = socket.gethostbyname(url)
+    addresses = resolve(url, 4)
+    if addresses:
+        ipv4 = addresses[0]
         log.debug("%s has IPv4 address: %s" % (url, ipv4))
-    except Exception as ex:
-        # when not known: [Errno 8] nodename nor servname provided, or not known
-        log.debug("Get IPv4 error on %s: %s" % (url, ex))
 
     # the contents of the DNS record can be utter garbage, there is absolutely no guarantee that this is an IP
     # it could be an entire novel, or images
@@ -292,10 +325,10 @@ def get_ipv6(url: str):
     # https://www.iana.org/assignments/iana-ipv6-special-registry/iana-ipv6-special-registry.xhtml
     ipv6 = ""
 
-    try:
-        # dig AAAA faalkaart.nl +short (might be used for debugging)
-        x = socket.getaddrinfo(url, None, socket.AF_INET6)
-        ipv6 = x[0][4][0]
+    # dig AAAA faalkaart.nl +short (might be used for debugging)
+    addresses = resolve(url, 6)
+    if addresses:
+        ipv6 = addresses[0]
 
         # six to four addresses make no sense
         if str(ipv6).startswith("::ffff:"):
@@ -308,9 +341,6 @@ def get_ipv6(url: str):
             ipv6 = ""
         else:
             log.debug("%s has IPv6 address: %s" % (url, ipv6))
-    except Exception as ex:
-        # when not known: [Errno 8nodename nor servname provided, or not known
-        log.debug("Get IPv6 error on %s: %s" % (url, ex))
 
     try:
         if ipv6:
@@ -345,7 +375,7 @@ def get_ipv6(url: str):
 """
 
 
-@app.task(queue="4and6", rate_limit="120/s", bind=True)
+@app.task(queue="4and6", bind=True)
 def can_connect(self, protocol: str, url: str, port: int, ip_version: int) -> bool:
     """
     Searches for both IPv4 and IPv6 IP addresses / types.
@@ -390,6 +420,8 @@ def can_connect(self, protocol: str, url: str, port: int, ip_version: int) -> bo
     if not ip:
         return False
 
+    limit(self, "can_connect", target_network(ip))
+
     log.debug("Attempting connect on: %s: host: %s IP: %s" % (uri, url, ip))
 
     try:
@@ -417,7 +449,7 @@ def can_connect(self, protocol: str, url: str, port: int, ip_version: int) -> bo
         # Certificate did not match expected hostname: 85.119.104.84.
         Certificate: {'subject': ((('commonName', 'webdiensten.drechtsteden.nl'),),)
         """
-        r = requests.get(
+        r = get_session().get(
             uri,
             timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
             allow_redirects=False,  # redirect = connection
@@ -455,30 +487,7 @@ def can_connect(self, protocol: str, url: str, port: int, ip_version: int) -> bo
         log.debug("%s: Exception returned: %s" % (url, Ex))
         strerror = Ex.args  # this can be multiple.  # zit in nested exception?
         strerror = str(strerror)  # Cast whatever we get back to a string. Instead of trace.
-        if any(
-            [
-                "BadStatusLine" in strerror,
-                "CertificateError" in strerror,
-                "certificate verify failed" in strerror,
-                "bad handshake" in strerror,
-                # Handshake failure: so there is an option to create a handshake, but perhaps the server wont respond.
-                # Still a valid endpoint.
-                "SSLV3_ALERT_HANDSHAKE_FAILURE" in strerror,
-                # When connecting based on ip address and separate host header, the error returned
-                # might not be an SSLV3_ALERT_HANDSHAKE_FAILURE but an TLSV1_ALERT_INTERNAL_ERROR.
-                # In that case there is still a connection, although there is something going wrong with TLS.
-                # in general all SSLErrors mean there is a connection.
-                "TLSV1_ALERT_INTERNAL_ERROR" in strerror,
-                # Done: what to do with a connection reset. It denotes that there is a service running
-                #  because otherwise there would not be a RST from the TCP handshake. It frequently happens
-                #  that a http site redirects to https and the https gives a connection reset.
-                #  In this case we follow what nmap does; it means the port is open. So perhaps this method
-                #  should be called 'has open port' or 'runs a service'. While we can't connect there is
-                #  definitely a service running there, which means scans should take place.
-                #  -> this will move 'missing https' endpoint warnings to 'could not test' errors.
-                "Connection aborted" in strerror,
-            ]
-        ):
+        if any(error in strerror for error in SERVER_ERRORS):
             log.debug(
                 "Exception indicates that there is a server, but we're not able to "
                 "communicate with it correctly. Error: %s" % strerror
@@ -498,7 +507,7 @@ def can_connect(self, protocol: str, url: str, port: int, ip_version: int) -> bo
             try:
                 log.debug("Trying again with a matching url and host header -> No connection to IP with a host header.")
 
-                s = Session()
+                s = get_session()
 
                 uri = "%s://%s:%s" % (protocol, url, port)
 
@@ -539,6 +548,121 @@ def can_connect(self, protocol: str, url: str, port: int, ip_version: int) -> bo
             return False
 
 
+@app.task(queue="4and6")
+def discover_endpoints(targets: List[List], ip_version: int) -> List[List]:
+    """
+    Probes a batch of [url_id, url, protocol, port] targets concurrently, with at most
+    settings.HTTP_DISCOVERY_CONCURRENCY connections at the same time on this worker.
+
+    This gives the same outcome as can_connect on every target, but each url is resolved only once and the worker
+    is not blocked waiting on timeouts. Returns [url_id, protocol, port, connected] per target, which is stored by
+    store_discovered_endpoints.
+    """
+    return asyncio.run(probe_targets(targets, ip_version, settings.HTTP_DISCOVERY_CONCURRENCY))
+
+
+async def probe_targets(targets: List[List], ip_version: int, concurrency: int) -> List[List]:
+    semaphore = asyncio.Semaphore(concurrency)
+    loop = asyncio.get_running_loop()
+    get_ip = get_ipv4 if ip_version == 4 else get_ipv6
+
+    async def resolve(url: str):
+        async with semaphore:
+            return url, await loop.run_in_executor(None, get_ip, url)
+
+    async def probe_target(url_id: int, url: str, protocol: str, port: int):
+        # security_headers or plain_http might have fetched this endpoint already
+        outcome = cached_probe_uri(f"{protocol}://{url}:{port}", ip_version)
+        if outcome is not None:
+            return [url_id, protocol, port, outcome["connected"]]
+
+        if not ips[url]:
+            return [url_id, protocol, port, False]
+
+        # The rate limit of can_connect applies to these connections as well. The token is reserved, so it is
+        # waited for once. Acquiring can use redis, which blocks, so it is done outside of the event loop.
+        wait = await loop.run_in_executor(None, acquire, "can_connect", target_network(ips[url]))
+        if wait:
+            await asyncio.sleep(wait)
+
+        async with semaphore:
+            return [url_id, protocol, port, await probe(protocol, url, ips[url], port)]
+
+    ips = dict(await asyncio.gather(*[resolve(url) for url in {target[1] for target in targets}]))
+    return await asyncio.gather(*[probe_target(*target) for target in targets])
+
+
+async def probe(protocol: str, url: str, ip: str, port: int) -> bool:
+    """
+    The asyncio equivalent of can_connect: any response, or an error that shows there is a server, means there is
+    an endpoint. Connections are made to the ip address with the url as server name, so the right certificate and
+    virtual host are used. Therefore can_connect's second attempt on the url itself is not needed.
+    """
+    context = None
+    if protocol == "https":
+        # any tls = connection
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE  # nosec
+
+    try:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(ip, port, ssl=context, server_hostname=url if context else None),
+            timeout=CONNECT_TIMEOUT,
+        )
+    except asyncio.TimeoutError:
+        log.debug("%s:%s: Timeout!" % (url, port))
+        return False
+    except (ssl.SSLError, ssl.CertificateError, ConnectionResetError) as Ex:
+        return indicates_server(url, port, Ex)
+    except OSError as Ex:
+        log.debug("%s:%s: Exception indicates we could not connect to server. Error: %s" % (url, port, Ex))
+        return False
+
+    try:
+        # If we get a redirect, it means there is a server. Any status line, or even garbage, is enough.
+        writer.write(
+            f"GET / HTTP/1.1\r\nHost: {url}\r\nUser-Agent: {get_random_user_agent()}\r\n"
+            f"Connection: close\r\n\r\n".encode()
+        )
+        await writer.drain()
+        status_line = await asyncio.wait_for(reader.readline(), timeout=READ_TIMEOUT)
+        log.debug("%s:%s: Status: %s" % (url, port, status_line[:40]))
+        return True
+    except asyncio.TimeoutError:
+        log.debug("%s:%s: Timeout!" % (url, port))
+        return False
+    except (ssl.SSLError, ConnectionResetError) as Ex:
+        return indicates_server(url, port, Ex)
+    except OSError as Ex:
+        log.debug("%s:%s: Exception indicates we could not connect to server. Error: %s" % (url, port, Ex))
+        return False
+    finally:
+        writer.close()
+
+
+def indicates_server(url: str, port: int, Ex: Exception) -> bool:
+    # a reset is what requests calls "Connection aborted"
+    strerror = "Connection aborted" if isinstance(Ex, ConnectionResetError) else str(Ex.args)
+    if any(error in strerror for error in SERVER_ERRORS):
+        log.debug(
+            "%s:%s: Exception indicates that there is a server, but we're not able to "
+            "communicate with it correctly. Error: %s" % (url, port, strerror)
+        )
+        return True
+
+    log.debug("%s:%s: Exception indicates we could not connect to server. Error: %s" % (url, port, strerror))
+    return False
+
+
+@app.task(queue="storage")
+def store_discovered_endpoints(results: List[List], ip_version: int, origin: str, activity: str):
+    for url_id, protocol, port, connected in results:
+        connect_result(connected, protocol, url_id, port, ip_version, origin)
+
+    plannedscan.finish_multiple(activity, "http", sorted({result[0] for result in results}))
+
+
 # thank you https://stackoverflow.com/questions/20658572/python-requests-print-entire-http-request-raw
 def pretty_print_request(req):
     """
@@ -766,68 +890,190 @@ def check_network(code_location=""):
         log.info("IPv6 could be reached via %s" % code_location)
 
 
-def redirects_to_safety(url: str):
+def redirects_to_safety(outcome: Dict[str, Any]) -> bool:
+    """
+    Any safety over any network is accepted now, both A and AAAA records. Uses the outcome of probe_uri on the http
+    endpoint, which follows all redirects.
     """
-    Also includes the ip-version of the endpoint. Implies that the endpoint resolves.
-    Any safety over any network is accepted now, both A and AAAA records.
+    if not outcome["redirects"]:
+        log.debug("Request was not redirected, so not going to a safe url.")
+        return False
 
-    To enable debugging: logging.basicConfig(level=logging.DEBUG)
+    log.debug("Request was redirected, there is hope. Redirect path:")
+    for index, redirect in enumerate(outcome["redirects"]):
+        log.debug(f"- Redirect {index}: {redirect}.")
+    log.debug("Final destination:")
+    log.debug(f"{outcome['status_code']}: {outcome['url']}")
 
-    :param endpoint:
-    :return:
+    if outcome["url"].startswith("https://"):
+        log.debug("Url starts with https, so it redirects to safety.")
+        return True
+    log.debug("Url is not redirecting to a safe url.")
+    return False
+
+
+"""
+The shared probe: security_headers, plain_http and the verification of endpoints all need a response of the same
+endpoint. The probe fetches an endpoint once and keeps the outcome for PROBE_TTL seconds, so the other scanners don't
+have to connect, resolve and follow redirects again. The outcome is kept per ip version, as the probe runs on the
+queue of the ip version of the endpoint.
+
+Every worker process keeps outcomes in memory. When settings.HTTP_PROBE_CACHE is set, outcomes are shared between
+workers via redis.
+"""
+# About one scan cycle: the scanners that use the probe are planned at about the same moment.
+PROBE_TTL = 4 * 3600
+PROBE_CACHE_SIZE = 10000
+PROBE_CACHE_KEY = "http_probe:{ip_version}:{uri_url}"
+
+# Bodies up to this size are read, so the connection can be used again. Connections of larger bodies are closed.
+PROBE_DRAIN_SIZE = 256 * 1024
+
+
+@lru_cache(maxsize=1)
+def probe_memory_cache() -> LRUCache:
+    return LRUCache(PROBE_CACHE_SIZE)
+
+
+@lru_cache(maxsize=1)
+def probe_redis_cache():
+    if not settings.HTTP_PROBE_CACHE:
+        return None
+    return redis.Redis.from_url(settings.HTTP_PROBE_CACHE)
+
+
+def probe_uri(uri_url: str, ip_version: int, refresh: bool = False) -> Dict[str, Any]:
+    """
+    The outcome of a GET request on the uri that follows all redirects, see fetch. The connections are made to the
+    addresses of the ip version. Use refresh to not use an earlier outcome, for example when retrying.
+    """
+    if not refresh:
+        outcome = cached_probe_uri(uri_url, ip_version)
+        if outcome is not None:
+            return outcome
+
+    outcome = fetch(uri_url, ip_version)
+
+    key = PROBE_CACHE_KEY.format(ip_version=ip_version, uri_url=uri_url)
+    probe_memory_cache().set(key, outcome, PROBE_TTL)
+    shared_cache = probe_redis_cache()
+    if shared_cache:
+        try:
+            shared_cache.set(key, json.dumps(outcome), ex=PROBE_TTL)
+        except redis.RedisError as error:
+            log.warning("Could not write the http probe cache in redis: %s" % error)
+
+    return outcome
+
+
+def cached_probe_uri(uri_url: str, ip_version: int) -> Optional[Dict[str, Any]]:
+    key = PROBE_CACHE_KEY.format(ip_version=ip_version, uri_url=uri_url)
+
+    outcome = probe_memory_cache().get(key)
+    if outcome is not None:
+        return outcome
+
+    shared_cache = probe_redis_cache()
+    if shared_cache:
+        try:
+            cached_outcome = shared_cache.get(key)
+        except redis.RedisError as error:
+            log.warning("Could not read the http probe cache in redis: %s" % error)
+            return None
+
+        if cached_outcome is not None:
+            outcome = json.loads(cached_outcome)
+            probe_memory_cache().set(key, outcome, PROBE_TTL)
+
+    return outcome
+
+
+def fetch(uri_url: str, ip_version: Optional[int] = None) -> Dict[str, Any]:
     """
-    import requests
-    from requests import ConnectionError, ConnectTimeout, HTTPError, ReadTimeout, Timeout
+    Requests the uri and follows all redirects, via the addresses of the ip version if given. The outcome contains:
 
-    # A feature of requests is to send any headers you've sent when there are redirects.
-    # This becomes problematic when you set the Host header. This prevents
+    connected: if there is a server, using the same heuristics as can_connect.
+    status_code, url and headers: of the final response.
+    redirects: the urls that redirected to the final url.
+    tls: "ok" when the tls handshake on the uri succeeded, the error when it failed, empty for http.
+    error: the error that prevented a response.
+    """
+    outcome = {
+        "connected": False,
+        "status_code": None,
+        "url": uri_url,
+        "headers": {},
+        "redirects": [],
+        "tls": "",
+        "error": "",
+    }
 
     try:
-        session = requests.Session()
-        response = session.get(
-            url,
-            timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),  # allow for insane network lag
-            allow_redirects=True,  # point is: redirects to safety
-            verify=False,  # certificate validity is checked elsewhere, having some https > none
-            # redirects do NOT overwrite the host headers. Meaning that following a redirect, the
-            # host header is set, which is incorrect. The Host header should only be set in the first
-            # request, and should be overwritten by all subsequent requests.
-            # The reason we set the host header explicitly, is because we want to contact the webserver
-            # via the IP address, so we can explicitly contect IPv4 and IPv6 addresses of this domain.
-            # issue was logged here: https://github.com/psf/requests/issues/5196
+        response = get_session(ip_version).get(
+            uri_url,
+            timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+            allow_redirects=True,
+            verify=False,  # nosec any tls = connection, certificates are checked elsewhere
             headers={
                 "User-Agent": get_random_user_agent(),
                 # Give some instructions that we want a secure address...
                 "Upgrade-Insecure-Requests": "1",
             },
+            # only the headers are needed, the body is not kept
+            stream=True,
         )
-
-        if response.history:
-            log.debug("Request was redirected, there is hope. Redirect path:")
-            for index, resp in enumerate(response.history):
-                log.debug(f"- Redirect {index}: {resp.url}.")
-            log.debug("Final destination:")
-            log.debug(f"{response.status_code}: {response.url}")
-
-            if response.url.startswith("https://"):
-                log.debug("Url starts with https, so it redirects to safety.")
-                return True
-            log.debug("Url is not redirecting to a safe url.")
-            return False
-        else:
-            log.debug("Request was not redirected, so not going to a safe url.")
-            return False
+        drain(response)
+    except (ConnectTimeout, Timeout, ReadTimeout) as Ex:
+        log.debug("%s: Timeout! - %s" % (uri_url, Ex))
+        outcome["error"] = str(Ex)
+        return outcome
     except (
-        ConnectTimeout,
-        HTTPError,
-        ReadTimeout,
-        Timeout,
         ConnectionError,
-        requests.exceptions.TooManyRedirects,
-    ) as e:
-        log.debug("Request resulted into an error, it's not redirecting properly.")
-        log.debug(f"The error retrieved was: {e}")
-        return False
+        HTTPError,
+        SSLError,
+        ChunkedEncodingError,
+        ContentDecodingError,
+        requests.TooManyRedirects,
+        # redirects to something like https:/// (with three slashes)
+        ValueError,
+    ) as Ex:
+        strerror = str(Ex.args)
+        log.debug("%s: Exception returned: %s" % (uri_url, strerror))
+        outcome["error"] = strerror
+        # redirects and content that can't be handled still come from a server
+        outcome["connected"] = isinstance(
+            Ex, (ChunkedEncodingError, ContentDecodingError, requests.TooManyRedirects, ValueError)
+        ) or any(error in strerror for error in SERVER_ERRORS)
+        if isinstance(Ex, SSLError):
+            outcome["tls"] = strerror
+        return outcome
+
+    outcome["connected"] = True
+    outcome["status_code"] = response.status_code
+    outcome["url"] = response.url
+    # Object of type CaseInsensitiveDict is not JSON serializable.
+    outcome["headers"] = dict(response.headers)
+    outcome["redirects"] = [redirect.url for redirect in response.history]
+    outcome["tls"] = "ok" if uri_url.startswith("https://") else ""
+    return outcome
+
+
+def drain(response: requests.Response):
+    """
+    Reads the body of a streamed response of at most PROBE_DRAIN_SIZE, so the connection is returned to the pool of
+    the session. Closing a response with an unread body closes its connection.
+    """
+    read = 0
+    try:
+        for chunk in response.iter_content(chunk_size=16 * 1024):
+            read += len(chunk)
+            if read > PROBE_DRAIN_SIZE:
+                break
+    except requests.RequestException as Ex:
+        # the headers are there, that is what matters
+        log.debug("%s: Could not read the body: %s" % (response.url, Ex))
+    finally:
+        response.close()
 
 
 # http://useragentstring.com/pages/useragentstring.php/
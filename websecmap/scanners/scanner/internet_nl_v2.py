@@ -16,6 +16,7 @@ import requests
 from requests.auth import HTTPBasicAuth
 
 from websecmap.celery import app
+from websecmap.scanners.sessions import get_session
 
 log = logging.getLogger(__name__)
 
@@ -42,7 +43,7 @@ def register(domains: List[str], scan_type: str, tracking_information: str, sett
     data = {"type": scan_type, "name": tracking_information, "domains": domains}
 
     try:
-        response = requests.post(
+        response = get_session().post(
             f"{settings['url']}/requests",
             json=data,
             auth=HTTPBasicAuth(settings["username"], settings["password"]),
@@ -81,7 +82,7 @@ def generic_internet_nl_api_request(operation, url: str, settings: Dict[str, Any
     # should not break the process of gathering results.
 
     try:
-        requests_function = getattr(requests, operation)
+        requests_function = getattr(get_session(), operation)
         response = requests_function(
             url, auth=HTTPBasicAuth(settings["username"], settings["password"]), timeout=(300, 300)
         )
@@ -19,7 +19,7 @@ from django.db import transaction
 from websecmap.celery import app
 from websecmap.organizations.models import Url
 from websecmap.scanners.models import Endpoint, InternetNLV2Scan, InternetNLV2StateLog, EndpointGenericScan
-from websecmap.scanners.scanmanager import store_endpoint_scan_result
+from websecmap.scanners.scanmanager import store_endpoint_scan_results
 from websecmap.scanners.scanner.internet_nl_v2 import InternetNLApiSettings, register, result, status
 
 log = logging.getLogger(__name__)
@@ -584,14 +584,16 @@ def reuse_last_fields_and_set_them_to_error(endpoint_id: int):
     # get all latest fields from this endpoint.
     # This does not interfere with other scans, as they happen on different endpoints.
     fields = EndpointGenericScan.objects.all().filter(endpoint=endpoint_id).values_list("type", flat=True).distinct()
-    for field in fields:
-        store_endpoint_scan_result(
-            scan_type=field,
-            endpoint_id=endpoint_id,
-            rating="error",
-            message=json.dumps({"translation": "error", "technical_details_hash": ""}),
-            evidence="Error retrieving scan result data, something went wrong during the scan.",
+    store_endpoint_scan_results(
+        (
+            field,
+            endpoint_id,
+            "error",
+            json.dumps({"translation": "error", "technical_details_hash": ""}),
+            "Error retrieving scan result data, something went wrong during the scan.",
         )
+        for field in fields
+    )
 
 
 # todo: store this on another queue: there are so many results that it blocks the entire storage worker...
@@ -663,13 +665,16 @@ def store_domain_scan_results(domain: str, scan_data: dict, scan_type: str, endp
     # which was from another user. But that will take all updates from that scan, so it's up to date. These are
     # edge cases that are in here by design: we always want to get data from a certain point in time, regardless
     # who started the scan.
-    store_endpoint_scan_result(
-        scan_type=f"internet_nl_{scan_type}_overall_score",
-        endpoint_id=endpoint.pk,
-        rating=scan_data["scoring"]["percentage"],
-        message=scan_data["report"]["url"],
-        evidence=scan_data["report"]["url"],
-    )
+    # All results of the domain are stored at once, as there are about 60 of them.
+    results = [
+        (
+            f"internet_nl_{scan_type}_overall_score",
+            endpoint.pk,
+            scan_data["scoring"]["percentage"],
+            scan_data["report"]["url"],
+            scan_data["report"]["url"],
+        )
+    ]
 
     api_v2_categories_to_v1_categories = {
         "mail": {
@@ -700,18 +705,23 @@ def store_domain_scan_results(domain: str, scan_data: dict, scan_type: str, endp
         # to keep APIv2 field names in line with APIv1, so we don't have to rename fields and all reports stay valid.
         scan_type_field = f"internet_nl_{scan_type}_{api_v2_categories_to_v1_categories[scan_type][category]}"
 
-        store_endpoint_scan_result(
-            scan_type=scan_type_field,
-            endpoint_id=endpoint.pk,
-            rating=scan_data["results"]["categories"][category]["status"],
-            message=json.dumps(
-                {"translation": scan_data["results"]["categories"][category]["verdict"], "technical_details_hash": ""}
-            ),
-            evidence=scan_data["report"]["url"],
+        results.append(
+            (
+                scan_type_field,
+                endpoint.pk,
+                scan_data["results"]["categories"][category]["status"],
+                json.dumps(
+                    {
+                        "translation": scan_data["results"]["categories"][category]["verdict"],
+                        "technical_details_hash": "",
+                    }
+                ),
+                scan_data["report"]["url"],
+            )
         )
 
     # standard tests:
-    store_test_results(endpoint.pk, scan_data["results"]["tests"])
+    results += scan_results_from_test_results(endpoint.pk, scan_data["results"]["tests"])
 
     # prepare for calculated results
     scan_data["results"]["calculated_results"] = {}
@@ -720,10 +730,14 @@ def store_domain_scan_results(domain: str, scan_data: dict, scan_type: str, endp
     elif scan_type == "mail_dashboard":
         scan_data = calculate_forum_standaardisatie_views_mail(scan_data)
 
-    store_test_results(endpoint.pk, scan_data["results"]["calculated_results"])
+    results += scan_results_from_test_results(endpoint.pk, scan_data["results"]["calculated_results"])
+
+    store_endpoint_scan_results(results)
+
 
+def scan_results_from_test_results(endpoint_id, test_results) -> List[Tuple[str, int, str, str, str]]:
+    results = []
 
-def store_test_results(endpoint_id, test_results):
     # this way new fields are automatically added
     test_results_keys = test_results.keys()
 
@@ -741,16 +755,18 @@ def store_test_results(endpoint_id, test_results):
         # version, so all the rest of the stuff is kept.
         dumped_technical_details = ""
         technical_details_hash = hashlib.md5(dumped_technical_details.encode("utf-8")).hexdigest()
-        store_endpoint_scan_result(
-            scan_type=scan_type,
-            endpoint_id=endpoint_id,
-            rating=test_result["status"],
-            message=json.dumps(
-                {"translation": test_result["verdict"], "technical_details_hash": technical_details_hash}
-            ),
-            evidence="",
+        results.append(
+            (
+                scan_type,
+                endpoint_id,
+                test_result["status"],
+                json.dumps({"translation": test_result["verdict"], "technical_details_hash": technical_details_hash}),
+                "",
+            )
         )
 
+    return results
+
 
 def add_calculation(scan_data, new_key: str, required_values: List[str]):
     lowest_value = lowest_value_in_results(scan_data, required_values)
@@ -17,8 +17,8 @@ from websecmap.scanners.models import Endpoint
 from websecmap.scanners.scanmanager import endpoint_has_scans, store_endpoint_scan_result
 from websecmap.scanners.scanner.__init__ import allowed_to_scan, q_configurations_to_scan, unique_and_random
 from websecmap.scanners.scanner.http import (
-    can_connect,
     connect_result,
+    probe_uri,
     redirects_to_safety,
     resolves_on_v4,
     resolves_on_v6,
@@ -220,8 +220,8 @@ def scan(ip_version: int, url: str):
         # no need to further check, can't even get the IP address...
         return False, False, False
 
-    # retry harder!
-    can_connect_result = can_connect(protocol="https", url=url, port=443, ip_version=ip_version)
+    # The responses are shared with the security headers scanner and the http verify scan via the http probe.
+    can_connect_result = probe_uri(f"https://{url}:443", ip_version)["connected"]
     redirects_to_safety_result = None
 
     # if you cannot connect to a secure endpoint, we're going to find out of there is redirect.
@@ -229,7 +229,7 @@ def scan(ip_version: int, url: str):
         # The worker (should) only resolve domain names only over ipv4 or ipv6. (A / AAAA).
         # Currenlty docker does not support that. Which means a lot of network rewriting for dealing with
         # all edge cases of HTTP.
-        redirects_to_safety_result = redirects_to_safety(f"http://{url}:80")
+        redirects_to_safety_result = redirects_to_safety(probe_uri(f"http://{url}:80", ip_version))
 
     return resolves, can_connect_result, redirects_to_safety_result
 
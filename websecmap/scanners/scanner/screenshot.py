@@ -24,7 +24,6 @@ from datetime import datetime, timedelta
 from io import BytesIO
 
 import pytz
-import requests
 from celery import Task, group
 from constance import config
 from django.conf import settings
@@ -36,7 +35,9 @@ from websecmap.celery import app
 from websecmap.scanners import plannedscan
 from websecmap.scanners.models import Endpoint, Screenshot
 from websecmap.scanners.plannedscan import retrieve_endpoints_from_urls
+from websecmap.scanners.ratelimit import limit
 from websecmap.scanners.scanner.__init__ import endpoint_filters, q_configurations_to_scan, unique_and_random
+from websecmap.scanners.sessions import get_session
 from websecmap.scanners.timeout import timeout
 
 log = logging.getLogger(__package__)
@@ -121,8 +122,10 @@ def compose_scan_task(urls):
 
 
 # We expect the screenshot tool to hang at non responsive urls.
-@app.task(queue="screenshot", rate_limit="60/m")
-def make_screenshot(service: str, endpoint_url: str):
+@app.task(bind=True, queue="screenshot")
+def make_screenshot(self, service: str, endpoint_url: str):
+    limit(self, "make_screenshot", service)
+
     try:
         return make_screenshot_with_u2p(service, endpoint_url)
     except (ConnectionError, TimeoutError) as e:
@@ -145,7 +148,7 @@ def make_screenshot_with_u2p(screenshot_service: str, url: str):
     }
     api_call = f"{screenshot_service}/api/render?{urllib.parse.urlencode(get_parameters)}"
     # https://2.python-requests.org/en/latest/user/quickstart/#binary-response-content
-    return requests.get(api_call)
+    return get_session().get(api_call)
 
 
 @app.task(queue="storage")
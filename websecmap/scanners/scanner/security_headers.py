@@ -5,10 +5,8 @@ Check if the https site uses HSTS to tell the browser the site should only be re
 import logging
 from typing import Dict, Any, Union
 
-import requests
-import urllib3
 from celery import Task, group
-from requests import ConnectionError, ConnectTimeout, HTTPError, ReadTimeout, Timeout, Response
+from requests import ConnectionError
 
 from websecmap.celery import app
 from websecmap.organizations.models import Organization, Url
@@ -17,7 +15,7 @@ from websecmap.scanners.models import Endpoint, EndpointGenericScan
 from websecmap.scanners.plannedscan import retrieve_endpoints_from_urls
 from websecmap.scanners.scanmanager import store_endpoint_scan_result
 from websecmap.scanners.scanner.__init__ import allowed_to_scan, q_configurations_to_scan, unique_and_random
-from websecmap.scanners.scanner.http import get_random_user_agent
+from websecmap.scanners.scanner.http import probe_uri
 from websecmap.scanners.scanner.utils import CELERY_IP_VERSION_QUEUE_NAMES
 
 log = logging.getLogger(__name__)
@@ -102,7 +100,9 @@ def compose_scan_task(urls):
     tasks = []
     for endpoint in endpoints:
         tasks.append(
-            get_headers.si(endpoint.uri_url()).set(queue=CELERY_IP_VERSION_QUEUE_NAMES[endpoint.ip_version])
+            get_headers.si(endpoint.uri_url(), endpoint.ip_version).set(
+                queue=CELERY_IP_VERSION_QUEUE_NAMES[endpoint.ip_version]
+            )
             | analyze_headers.s(endpoint.pk)
             | plannedscan.finish.si("scan", "security_headers", endpoint.url.pk)
         )
@@ -391,51 +391,7 @@ def generic_check_using_csp_fallback(endpoint_id: int, headers, header):
 
 
 @app.task(bind=True, default_retry_delay=1, retry_kwargs={"max_retries": 3})
-def get_headers(self, uri_uri: str) -> Union[Dict[str, Any], bool]:
-    try:
-        response = get_headers_request(uri_uri)
-        # Object of type CaseInsensitiveDict is not JSON serializable.
-        return dict(response.headers)
-
-    # The amount of possible return states is overwhelming :)
-
-    # Solving https://sentry.io/internet-cleanup-foundation/faalkaart/issues/460895712/
-    #         https://sentry.io/internet-cleanup-foundation/faalkaart/issues/460895699/
-    # ValueError, really don't know how to further handle it.
-    #
-    # Solving https://sentry.io/internet-cleanup-foundation/faalkaart/issues/425503689/
-    # requests.TooManyRedirects
-    #
-    # Solving https://sentry.io/internet-cleanup-foundation/faalkaart/issues/425507209/
-    # LocationValueError - No host specified.
-    # it redirects to something like https:/// (with three slashes) and then somewhere it crashes
-    # possibly an error in requests.
-    #
-    # Possibly tooManyRedirects could be plotted on the map, given this is a configuration error
-    except (
-        ConnectTimeout,
-        HTTPError,
-        ReadTimeout,
-        Timeout,
-        ConnectionError,
-        ValueError,
-        requests.TooManyRedirects,
-        urllib3.exceptions.LocationValueError,
-    ) as e:
-        # If an expected error is encountered put this task back on the queue to be retried.
-        # This will keep the chained logic in place (saving result after successful scan).
-        # Retry delay and total number of attempts is configured in the task decorator.
-        try:
-            # Since this action raises an exception itself, any code after this won't be executed.
-            raise self.retry(exc=e)
-        except BaseException:
-            # If this task still fails after maximum retries the last
-            # error will be passed as result to the next task.
-            # Exceptions do not serialize.
-            return False
-
-
-def get_headers_request(uri_url: str) -> Response:
+def get_headers(self, uri_uri: str, ip_version: int = 4) -> Union[Dict[str, Any], bool]:
     """
     Issue #94:
     TL;DR: The fix is to follow all redirects.
@@ -463,35 +419,34 @@ def get_headers_request(uri_url: str) -> Response:
     Update 17 dec 2018: some web servers require a user agent to be sent in order to give a "more correct" response.
     Given that 'humans with browsers' access these pages, it's normal to also send a user agent.
 
-    :return: requests.response
+    The response is shared with other scanners via probe_uri. A retry fetches the headers again instead of using
+    the shared response.
     """
-
-    log.debug("Getting headers for %s" % uri_url)
-
-    # ignore wrong certificates, those are handled in a different scan.
-    # 10 seconds for network delay, 10 seconds for the site to respond.
-    response = requests.get(
-        uri_url,
-        timeout=(30, 30),
-        allow_redirects=True,
-        verify=False,  # nosec TLS does not have to be valid in this test, only headers do.
-        headers={"User-Agent": get_random_user_agent()},
-    )
-
-    # redirects are followed, this gives an indication on how many redirects are followed, and what url the
-    # headers are taken from:
-    for index, resp in enumerate(response.history):
-        log.debug(f"- Redirect {index}: {resp.url}.")
-
-    log.debug(f"- You are now at {response.url}.")
-
-    # Removed: only continue for valid responses (eg: 200)
-    # Error pages, such as 404 are super fancy, with forms and all kinds of content.
-    # it's obvious that such pages (with content) follow the same security rules as any 2XX response.
-    # if 400 <= response.status_code <= 600:
-    #     error_response_400_500(endpoint)
-    # response.raise_for_status()
-
-    for header in response.headers:
-        log.debug("Received header: %s" % header)
-    return response
+    log.debug("Getting headers for %s" % uri_uri)
+    outcome = probe_uri(uri_uri, ip_version, refresh=bool(self.request.retries))
+
+    if not outcome["error"]:
+        # redirects are followed, this gives an indication on how many redirects are followed, and what url the
+        # headers are taken from:
+        for index, redirect in enumerate(outcome["redirects"]):
+            log.debug(f"- Redirect {index}: {redirect}.")
+        log.debug(f"- You are now at {outcome['url']}.")
+
+        # Removed: only continue for valid responses (eg: 200)
+        # Error pages, such as 404 are super fancy, with forms and all kinds of content.
+        # it's obvious that such pages (with content) follow the same security rules as any 2XX response.
+        return outcome["headers"]
+
+    # The amount of possible return states is overwhelming :) Possibly tooManyRedirects could be plotted on the map,
+    # given this is a configuration error. See fetch in the http scanner for the handled errors.
+    try:
+        # If an expected error is encountered put this task back on the queue to be retried.
+        # This will keep the chained logic in place (saving result after successful scan).
+        # Retry delay and total number of attempts is configured in the task decorator.
+        # Since this action raises an exception itself, any code after this won't be executed.
+        raise self.retry(exc=ConnectionError(outcome["error"]))
+    except BaseException:
+        # If this task still fails after maximum retries the last
+        # error will be passed as result to the next task.
+        # Exceptions do not serialize.
+        return False
@@ -16,15 +16,16 @@ from websecmap.celery import app
 from websecmap.map.logic.map_defaults import get_country
 from websecmap.organizations.models import Organization, Url
 from websecmap.scanners import plannedscan
+from websecmap.scanners.ratelimit import limit
 from websecmap.scanners.scanner.__init__ import q_configurations_to_scan, unique_and_random, url_filters
 from websecmap.scanners.scanner.http import get_ips
+from websecmap.scanners.sessions import get_session
 
 # Include DNSRecon code from an external dependency. This is cloned recursively and placed outside the django app.
 from websecmap.scanners.scanner.utils import get_random_nameserver
 from dnsrecon.__main__ import ds_zone_walk, brute_domain
 from dnsrecon.lib.dnshelper import DnsHelper
 import re
-import requests
 
 
 log = logging.getLogger(__package__)
@@ -304,9 +305,9 @@ def dnsrecon_parse_report_contents(contents: List, url: Dict[str, Any]):
 
 
 # place it on the IPv4 queue, so it can scale using cloud workers :)
-# It seems that a rate limited task blocks an entire worker for any other tasks.
-@app.task(ignore_result=True, queue="known_subdomains", rate_limit="60/h")
-def wordlist_scan(url: str, wordlist: List[str]):
+# The rate limit is shared by all workers, see websecmap.scanners.ratelimit.
+@app.task(bind=True, ignore_result=True, queue="known_subdomains")
+def wordlist_scan(self, url: str, wordlist: List[str]):
     """
     60/h = 10.000 scans / week.
 
@@ -314,6 +315,8 @@ def wordlist_scan(url: str, wordlist: List[str]):
     :param wordlist:
     :return:
     """
+    limit(self, "wordlist_scan")
+
     log.debug("Performing wordlist scan on %s, with the wordlist of %s words" % (url, len(wordlist)))
 
     # any organization can determine at any points that there are now wildcards in effect
@@ -422,9 +425,8 @@ def remove_wildcards(urls: List[Url]):
 
 # don't overload the crt.sh service, rate limit
 # todo: create a generic: go to $page with $parameter and scrape all urls.
-@app.task(ignore_result=True, queue="discover_subdomains", rate_limit="2/m")
-@retry(wait=wait_fixed(30), before=before_log(log, logging.DEBUG))
-def certificate_transparency_scan(url: str):
+@app.task(bind=True, ignore_result=True, queue="discover_subdomains")
+def certificate_transparency_scan(self, url: str):
     """
     Checks the certificate transparency database for subdomains. Using a regex the subdomains
     are extracted. This method is extremely fast and reliable: these certificates all exist.
@@ -432,12 +434,18 @@ def certificate_transparency_scan(url: str):
     Hooray for transparency :)
     :return:
     """
+    limit(self, "certificate_transparency_scan", "crt.sh")
+    return certificate_transparency_subdomains(url)
+
+
+@retry(wait=wait_fixed(30), before=before_log(log, logging.DEBUG))
+def certificate_transparency_subdomains(url: str):
 
     # https://crt.sh/?q=%25.zutphen.nl
     crt_sh_url = "https://crt.sh/?q=%25." + str(url)
     pattern = r"[^\s%>]*\." + str(url.replace(".", r"\."))  # harder string formatting :)
 
-    response = requests.get(crt_sh_url, timeout=(30, 30), allow_redirects=False)
+    response = get_session().get(crt_sh_url, timeout=(30, 30), allow_redirects=False)
     matches = re.findall(pattern, response.text)
 
     subdomains = []
@@ -484,8 +492,8 @@ def store_certificate_transparency_results(subdomains: List[str], url_id) -> Lis
 
 
 # this is a fairly safe scanner, and can be run pretty quiclkly (no clue if parralelisation works)
-@app.task(ignore_result=True, queue="discover_subdomains", rate_limit="4/m")
-def nsec_scan(url: str):
+@app.task(bind=True, ignore_result=True, queue="discover_subdomains")
+def nsec_scan(self, url: str):
     """
     Tries to use nsec (dnssec) walking. Does not use nsec3 (hashes).
 
@@ -499,6 +507,8 @@ def nsec_scan(url: str):
     :param urls:
     :return:
     """
+    limit(self, "nsec_scan")
+
     resolver = DnsHelper(url, [get_random_nameserver()], 3)
     records = ds_zone_walk(resolver, url, 3)
     return records
@@ -19,32 +19,31 @@ This scanner will be replaced with the O-Saft scanner when ready.
 API Documentation:
 https://github.com/ssllabs/ssllabs-scan/blob/stable/ssllabs-api-docs.md
 """
+import asyncio
 import json
 import logging
 from datetime import datetime, timedelta
-from multiprocessing.pool import ThreadPool
-from time import sleep
-from typing import List, Any, Dict
+from typing import List, Any, Dict, Optional
 
 import pytz
 import requests
 from celery import Task, group
 from django.utils import timezone
-from tenacity import RetryError, before_log, retry, wait_fixed
 
 from websecmap.celery import app
 from websecmap.organizations.models import Organization, Url
 from websecmap.scanners import plannedscan
-from websecmap.scanners.models import Endpoint, ScanProxy, TlsQualysScratchpad
+from websecmap.scanners.models import Endpoint, TlsQualysScratchpad
 from websecmap.scanners.proxy import (
+    available_proxies,
     claim_proxy,
     release_proxy,
-    service_provider_status,
     store_check_result,
     timeout_claims,
 )
 from websecmap.scanners.scanmanager import store_endpoint_scan_result
 from websecmap.scanners.scanner.__init__ import allowed_to_scan, chunks2, q_configurations_to_scan, unique_and_random
+from websecmap.scanners.sessions import get_session
 
 # There is a balance between network timeout and qualys result cache.
 # This is relevant, since the results are not kept in cache for hours. More like 15 minutes.
@@ -56,8 +55,8 @@ log = logging.getLogger(__name__)
 
 """
 New architecture:
-- A worker gets a set of 25 objects to scan. Will do so multithreaded,
- - - starting one every minute (or backing off if needed)
+- A worker gets a set of 25 objects to scan. Will do so from a single event loop,
+ - - starting one whenever qualys reports there is capacity (or backing off if needed)
 - A finished scan results in a new task (just like a scrathpad). Whenever the worker is ready all 25 scans are
   completed and the worker is ready to receive more. This is the _FASTEST_ you can ever accomplish without messy
   queue management.
@@ -246,19 +245,7 @@ def compose_planned_scan_task(**kwargs) -> Task:
 
     timeout_claims()
 
-    proxies_available = (
-        ScanProxy.objects.all()
-        .filter(
-            is_dead=False,
-            currently_used_in_tls_qualys_scan=False,
-            manually_disabled=False,
-            request_speed_in_ms__gte=1,
-            # the upper speed should be configurable. When running N proxy checks at a time theywill be slower.
-            # more checks at the same time = slower > 3000ms.
-            # request_speed_in_ms__lte=2000,
-        )
-        .order_by("request_speed_in_ms")
-    )
+    proxies_available = available_proxies()
 
     # size for the proxies and such is 25 / each.
     amount_to_scan = len(proxies_available) * 25
@@ -301,147 +288,245 @@ def compose_scan_task(urls: List[Url]) -> Task:
     return group(tasks)
 
 
-# It's possible a lot of scans start at the same time. In that case the API does not have a notion of how many scans
-# are running (this takes a while). This results in too many requests and still a lot of errors. To avoid that this
-# method has been rate limited to one per minute per worker. This gives a bit of slack.
+# Qualys limits the amount of assessments per client. The X-Max-Assessments, X-ClientMaxAssessments and
+# X-Current-Assessments headers of every response tell how many assessments can run. A margin is kept below the maximum
+# as it takes a while before the API counts newly started assessments.
+MAX_CONCURRENT_ASSESSMENTS = 20
+
+# Seconds between starting two assessments. Starting too fast results in "Too many new assessments too fast".
+NEW_ASSESSMENT_COOL_OFF = 10
+
+# Seconds between polls of a running assessment. The eta of the assessment is used when there is one.
+POLL_INTERVAL = 30
+MIN_POLL_INTERVAL = 10
+MAX_POLL_INTERVAL = 360
+
+# Seconds to wait when the API is at full capacity or can't be reached. This is increased up to MAX_POLL_INTERVAL when
+# too many assessments are running.
+ERROR_INTERVAL = 60
+
+# Give up on the proxy after this many network errors in a row.
+MAX_NETWORK_ERRORS = 10
 
-# Note that this is a per worker instance rate limit, and not a global rate limit.
-# http://docs.celeryproject.org/en/latest/userguide/tasks.html
 
-# scan takes about 30 minutes.
-# 12 / hour = 1 every 5 minutes. In 30 minutes 6 scans will run at the same time. We used to have 10.
-# 20 / hour = 1 every 3 minutes. In 30 minutes 10 scans will run at the same time.
-# 30 / hours = 1 every 2 minutes. In 30 minutes 15 scans will run at the same time.
 @app.task(queue="qualys", acks_late=True)
 def qualys_scan_bulk(proxy: Dict[str, Any], urls: List[str]):
+    """
+    Scans all urls via the same proxy, so all scans stay on the same server (so no ip-hopping between scans, which
+    limits the available capacity severely). The assessments run at the same time from a single event loop, see
+    QualysPool.
+    """
 
     log.debug("Initiating bulk scan")
     log.debug("Received proxy: %s" % proxy)
     log.debug("Received urls: %s" % urls)
 
-    # Using this all scans stay on the same server (so no ip-hopping between scans, which limits the available
-    # capacity severely.
-    # Using this solution still uses parallel scans, while not having to rely on the black-box of redis and celery
-    # that have caused priority shifts. This is much faster and easier to understand.
-
     try:
-        # start one every 60 seconds, a thread can manage itself if too many are running.
-        pool = ThreadPool(25)
-
-        # Even if qualys is down, it will just wait until it knows you can add more... And the retry is infinite
-        # every 30 seconds. So they may be even down for a day and it will continue.
-        for url in urls:
-
-            try:
-                api_results = service_provider_status(proxy)
-                while api_results["max"] < 20 or api_results["this-client-max"] < 20 or api_results["current"] > 19:
-                    log.debug("Running out of capacity, waiting to start new scan.")
-                    sleep(70)
-                    api_results = service_provider_status(proxy)
-
-                pool.apply_async(qualys_scan_thread, [proxy, url])
-                sleep(70)
-
-            except RetryError:
-                log.debug("Retry error. Could not connect to proxy anymore.")
-                store_check_result.apply_async(
-                    [proxy, "Retry error. Proxy died while scanning.", True, datetime.now(pytz.utc)]
-                )
-
-        pool.close()
-        pool.join()
-
+        asyncio.run(QualysPool(proxy).run(urls))
     except Exception as e:
         # catch _anything_ that goes wrong, log it to the sentry/logfile
         # This is done to still return the scanproxy so it can be released.
         log.exception(f"Unexpected crash in qualys bulk scan: {e}")
 
     # return the proxy so it can be closed.
-    # The scan results are created as separate tasks in the scan thread.
+    # The scan results are created as separate tasks in the pool.
     return proxy
 
 
-# keeps scanning in a loop until it has the data to fire a
-def qualys_scan_thread(proxy: Dict[str, Any], url: str):
+class QualysPool:
+    """
+    Runs the assessments of a list of urls via one proxy. Every assessment is a coroutine that polls the API until the
+    assessment is ready, scheduled by the eta that the API gives. Requests are made in the default executor of the
+    loop, no thread waits between polls.
 
-    normal_waiting_time = 30
-    error_waiting_time = 60  # seconds until retry, can be increased when queues are full. Max = 180
-    max_waiting_time = 360
+    New assessments are started when the capacity that the API reports allows it, with NEW_ASSESSMENT_COOL_OFF seconds
+    in between. The capacity is updated from the headers of every response.
+    """
 
-    data = {}
+    def __init__(self, proxy: Dict[str, Any]):
+        self.proxy = proxy
+        # the capacity is not known until the first response
+        self.limit = 1
+        # the assessments that the API reports and the assessments started by this pool, which the API might not
+        # report yet (or at all, as the headers are not always sent).
+        self.reported = 0
+        self.running = 0
+        self.capacity_changed: Optional[asyncio.Condition] = None
+        self.cool_off = NEW_ASSESSMENT_COOL_OFF
+        self.next_start = 0.0
+        self.network_errors = 0
+        self.proxy_died = False
+        # the last stored state of every url, to only store state changes in the scratchpad
+        self.states = {}
+
+    async def run(self, urls: List[str]):
+        self.capacity_changed = asyncio.Condition()
+        # an unexpected error in one assessment does not stop the assessments of the other urls
+        results = await asyncio.gather(*[self.assess(url) for url in urls], return_exceptions=True)
+        for url, result in zip(urls, results):
+            if isinstance(result, Exception):
+                log.error(f"Qualys assessment of {url} failed.", exc_info=result)
+
+    async def assess(self, url: str):
+        running = False
 
-    while True:
         try:
-            api_result = service_provider_scan_via_api_with_limits(proxy, url)
-            data = api_result["data"]
-        except requests.RequestException:
+            while not self.proxy_died:
+                if not running:
+                    await self.start_slot()
+                    if self.proxy_died:
+                        return
+                    running = True
+
+                api_result = await self.request(url)
+                if api_result is None:
+                    await asyncio.sleep(ERROR_INTERVAL)
+                    continue
+
+                data = api_result["data"]
+                self.scratch_state_change(url, data)
+                # Always log to console. Don't ask the database (constance) if this should happen.
+                report_to_console(url, data)
+
+                # Qualys has completed the scan of the url and has a result.
+                if data.get("status") in ["READY", "ERROR"]:
+                    log.debug(f"Qualys scan finished on {url}.")
+                    process_qualys_result.apply_async([data, url])
+                    return
+
+                # The API is in error state, the assessment did not start. Try again later.
+                if "errors" in data:
+                    interval = self.error_interval(url, error_message(data))
+                    await self.finished(start_after=interval)
+                    running = False
+                    await asyncio.sleep(interval)
+                    continue
+
+                log.debug(f"Scan on {url} has not yet finished.")
+                await asyncio.sleep(poll_interval(data))
+        finally:
+            # also when the assessment failed, so the other assessments can use the slot
+            if running:
+                await self.finished()
+
+    async def start_slot(self):
+        """
+        Waits until a new assessment can be started. The capacity is only updated by responses of the API. When none
+        of the assessments of this pool is running, nothing updates it anymore. Then the reported capacity is not
+        trusted and an assessment is started to ask the API again.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            async with self.capacity_changed:
+                await self.capacity_changed.wait_for(
+                    lambda: max(self.reported, self.running) < self.limit or not self.running or self.proxy_died
+                )
+                if loop.time() >= self.next_start or self.proxy_died:
+                    self.running += 1
+                    self.reported += 1
+                    self.next_start = loop.time() + self.cool_off
+                    return
+                cool_off = self.next_start - loop.time()
+
+            # another assessment might start in the meantime, so the capacity is checked again afterwards
+            await asyncio.sleep(cool_off)
+
+    async def finished(self, start_after: float = 0):
+        """Frees the slot of an assessment. Use start_after to not start new assessments for that many seconds."""
+        async with self.capacity_changed:
+            loop = asyncio.get_running_loop()
+            self.next_start = max(self.next_start, loop.time() + start_after)
+            self.running -= 1
+            self.reported = max(self.reported - 1, 0)
+            self.capacity_changed.notify_all()
+
+    async def request(self, url: str) -> Optional[Dict[str, Any]]:
+        loop = asyncio.get_running_loop()
+        try:
+            api_result = await loop.run_in_executor(None, service_provider_scan_via_api_with_limits, self.proxy, url)
+        except (requests.RequestException, ValueError):
             # ex: ('Connection aborted.', ConnectionResetError(54, 'Connection reset by peer'))
             # ex: EOF occurred in violation of protocol (_ssl.c:749)
+            # ex: an html error page of the server or proxy instead of json, which raises a ValueError.
             log.exception(f"(Network or Server) Error when contacting Qualys for scan on {url}.")
-            sleep(60)
-            # continue
-
-        # Store debug data in database (this task has no direct DB access due to scanners queue).
-        scratch.apply_async([url, data])
-        # Always log to console. Don't ask the database (constance) if this should happen.
-        report_to_console(url, data)
-
-        # Qualys is already running a scan on this url
-        if "status" in data:
-            # Qualys has completed the scan of the url and has a result.
-            if data["status"] in ["READY", "ERROR"]:
-                # scan completed
-                # store the result on the storage queue.
-                log.debug(f"Qualys scan finished on {url}.")
-                process_qualys_result.apply_async([data, url])
-                return True
-            else:
-                log.debug(
-                    f"Scan on {url} has not yet finished. " f"Waiting {normal_waiting_time} seconds before next update."
-                )
-                sleep(normal_waiting_time)
-                # Don't break out of the loop...
-                # continue
-
-        # The API is in error state, let's see if we can be nice and recover.
-        if "errors" in data:
-            error_message = data["errors"][0]["message"]
-            # {'errors': [{'message': 'Running at full capacity. Please try again later.'}], 'status': 'FAILURE'}
-            # Don't increase the amount of waiting time yet... try again in a minute.
-            if error_message == "Running at full capacity. Please try again later.":
-                # this happens all the time, so don't raise an exception but just make a log message.
-                log.info(f"Error occurred while scanning {url}: qualys is at full capacity, trying later.")
-                sleep(error_waiting_time)
-                # Don't break out of the loop...
-                # continue
-
-            # We're going too fast with new assessments. Back off.
-            if error_message.startswith("Concurrent assessment limit reached"):
-                log.error(
-                    f"Too many concurrent assessments: Are you running multiple scans from the same IP? "
-                    f"Concurrent scans slowly lower the concurrency limit of 25 concurrent scans to zero. "
-                    f"Slow down. {data['errors'][0]['message']}"
+            self.network_errors += 1
+            if self.network_errors >= MAX_NETWORK_ERRORS and not self.proxy_died:
+                self.proxy_died = True
+                store_check_result.apply_async(
+                    [self.proxy, "Network errors. Proxy died while scanning.", True, datetime.now(pytz.utc)]
                 )
-                if error_waiting_time < max_waiting_time:
-                    error_waiting_time += 60
-                    sleep(error_waiting_time)
-                    # continue
-
-            if error_message.startswith("Too many concurrent assessments"):
-                log.info(f"Error occurred while scanning {url}: Too many concurrent assessments.")
-                if error_waiting_time < max_waiting_time:
-                    error_waiting_time += 60
-                    sleep(error_waiting_time)
-                    # continue
-
-            # All other situations that we did not foresee...
-            log.error("Unexpected error from API on %s: %s", url, str(data))
-
-        # This is an undefined state.
-        # scan started without errors. It's probably pending. Reset the waiting time to 60 seconds again as we
-        # we want to get the result asap.
-        log.debug(f"Got to an undefined state on qualys scan on {url}. Scan has not finished, and we're retrying.")
-        sleep(error_waiting_time)
+                async with self.capacity_changed:
+                    self.capacity_changed.notify_all()
+            return None
+
+        self.network_errors = 0
+        async with self.capacity_changed:
+            self.limit = min(api_result["max"], api_result["this-client-max"], MAX_CONCURRENT_ASSESSMENTS)
+            self.reported = api_result["current"]
+            self.capacity_changed.notify_all()
+        return api_result
+
+    def scratch_state_change(self, url: str, data: Dict[str, Any]):
+        # Store debug data in database (this task has no direct DB access due to scanners queue).
+        state = assessment_state(data)
+        if self.states.get(url) != state:
+            self.states[url] = state
+            scratch.apply_async([url, data])
+
+    def error_interval(self, url: str, error_message: str) -> int:
+        # {'errors': [{'message': 'Running at full capacity. Please try again later.'}], 'status': 'FAILURE'}
+        if error_message == "Running at full capacity. Please try again later.":
+            # this happens all the time, so don't raise an exception but just make a log message.
+            log.info(f"Error occurred while scanning {url}: qualys is at full capacity, trying later.")
+            return ERROR_INTERVAL
+
+        # We're going too fast with new assessments. Back off.
+        if error_message.startswith("Concurrent assessment limit reached") or error_message.startswith(
+            "Too many concurrent assessments"
+        ):
+            log.info(
+                f"Error occurred while scanning {url}: Too many concurrent assessments. Are you running multiple "
+                f"scans from the same IP? Concurrent scans slowly lower the concurrency limit of 25 concurrent scans "
+                f"to zero. Slow down. {error_message}"
+            )
+            self.cool_off = min(self.cool_off + ERROR_INTERVAL, MAX_POLL_INTERVAL)
+            return self.cool_off
+
+        if error_message.startswith("Too many new assessments too fast"):
+            self.cool_off = min(self.cool_off * 2, MAX_POLL_INTERVAL)
+            return self.cool_off
+
+        # All other situations that we did not foresee...
+        log.error("Unexpected error from API on %s: %s", url, error_message)
+        return ERROR_INTERVAL
+
+
+def poll_interval(data: Dict[str, Any]) -> int:
+    """The seconds until the next poll, when the endpoint that takes longest is expected to be ready."""
+    etas = [endpoint.get("eta", -1) for endpoint in data.get("endpoints", [])]
+    # the eta is -1 when it is not known yet
+    if not etas or max(etas) < 0:
+        return POLL_INTERVAL
+    return min(max(max(etas), MIN_POLL_INTERVAL), MAX_POLL_INTERVAL)
+
+
+def error_message(data: Dict[str, Any]) -> str:
+    """The message of the first error, an empty string when the API sends errors without a message."""
+    errors = data.get("errors") or [{}]
+    if not isinstance(errors, list) or not isinstance(errors[0], dict):
+        return ""
+    return str(errors[0].get("message", ""))
+
+
+def assessment_state(data: Dict[str, Any]) -> tuple:
+    """The status of an assessment and of its endpoints, without the progress details that change on every poll."""
+    return (
+        data.get("status", ""),
+        error_message(data),
+        tuple(
+            (endpoint.get("ipAddress", ""), endpoint.get("statusMessage", "")) for endpoint in data.get("endpoints", [])
+        ),
+    )
 
 
 @app.task(queue="storage")
@@ -502,9 +587,8 @@ def report_to_console(domain: str, data: Dict[str, Any]):
         log.error("Unexpected data received for domain: %s, %s" % (domain, data))
 
 
-# Qualys is a service that is constantly attacked / ddossed and very unreliable. So try a couple of times before
-# giving up. It can even be down for half a day. Waiting a little between retries.
-@retry(wait=wait_fixed(30), before=before_log(log, logging.DEBUG))
+# Qualys is a service that is constantly attacked / ddossed and very unreliable. It can even be down for half a day.
+# Network errors are retried by the QualysPool.
 def service_provider_scan_via_api_with_limits(proxy: Dict[str, Any], domain: str):
     # API Docs: https://github.com/ssllabs/ssllabs-scan/blob/stable/ssllabs-api-docs.md
     payload = {
@@ -517,7 +601,7 @@ def service_provider_scan_via_api_with_limits(proxy: Dict[str, Any], domain: str
         "all": "done",  # ?
     }
 
-    response = requests.get(
+    response = get_session().get(
         "https://api.ssllabs.com/api/v2/analyze",
         params=payload,
         timeout=(API_NETWORK_TIMEOUT, API_SERVER_TIMEOUT),  # 30 seconds network, 30 seconds server.
@@ -0,0 +1,161 @@
+"""
+A shared requests session for the http based scanners, so connections are kept alive and reused.
+
+Before, every scan made a new connection with requests.get or a new Session(). Each of those had to connect and do a
+tls handshake again. Every worker process now has one session. urllib3 keeps a pool of connections per scheme, host
+and port. Each proxy gets its own pools.
+
+- At most settings.HTTP_SESSION_POOLS hosts are kept per proxy, the least recently used pool is closed.
+- At most settings.HTTP_SESSION_HOST_CONNECTIONS connections are made to a host at the same time. Other requests to
+  that host wait until a connection is available.
+- Cookies are not kept, so scans don't influence each other. Cookies that are set while following redirects are still
+  sent, as with requests.get.
+- The session of an ip version connects to the A or AAAA address of a host, see get_session. The host name is still
+  used for the Host header and for tls (SNI).
+
+For every request the statsd metric http_session counts if a connection was reused. http_session_time has the time
+spent on connecting, the tls handshake and reading the response.
+"""
+import threading
+import time
+from functools import lru_cache
+from http.cookiejar import DefaultCookiePolicy
+from typing import Dict, Optional
+
+from django.conf import settings
+from requests import Session
+from requests.adapters import HTTPAdapter
+from statshog.defaults.django import statsd
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NewConnectionError
+
+from websecmap.scanners.resolver import resolve
+
+# The time spent on new connections of the current request, per thread.
+timings = threading.local()
+
+
+def add_timing(phase: str, seconds: float):
+    if hasattr(timings, "phases"):
+        timings.phases[phase] = timings.phases.get(phase, 0) + seconds
+
+
+def spent(phase: str) -> float:
+    return getattr(timings, "phases", {}).get(phase, 0)
+
+
+def new_connection(connection, new_conn):
+    """
+    Makes the socket of the connection with its _new_conn method. When the connection has an ip version, the socket
+    connects to the address of that version. The host of the connection is not changed, it is used for tls (SNI).
+    """
+    start = time.monotonic()
+
+    if not connection.ip_version:
+        sock = new_conn()
+    else:
+        addresses = resolve(connection.host, connection.ip_version)
+        if not addresses:
+            raise NewConnectionError(
+                connection,
+                f"Failed to establish a new connection: {connection.host} has no IPv{connection.ip_version} address",
+            )
+
+        # the socket is made to _dns_host, which is also the host name of the connection outside of _new_conn
+        host, connection._dns_host = connection._dns_host, addresses[0]
+        try:
+            sock = new_conn()
+        finally:
+            connection._dns_host = host
+
+    add_timing("connect", time.monotonic() - start)
+    return sock
+
+
+class TimedHTTPConnection(HTTPConnection):
+    ip_version: Optional[int] = None
+
+    def _new_conn(self):
+        return new_connection(self, super()._new_conn)
+
+
+class TimedHTTPSConnection(HTTPSConnection):
+    ip_version: Optional[int] = None
+
+    def _new_conn(self):
+        return new_connection(self, super()._new_conn)
+
+    def connect(self):
+        # connects with _new_conn, and then does the tls handshake
+        start = time.monotonic()
+        connecting = spent("connect")
+        super().connect()
+        add_timing("tls", time.monotonic() - start - (spent("connect") - connecting))
+
+
+@lru_cache(maxsize=None)
+def timed_pool_classes(ip_version: Optional[int] = None) -> Dict[str, type]:
+    """The connection pools per scheme, of which the connections connect to addresses of the ip version if given."""
+    http_connection = type("TimedHTTPConnection", (TimedHTTPConnection,), {"ip_version": ip_version})
+    https_connection = type("TimedHTTPSConnection", (TimedHTTPSConnection,), {"ip_version": ip_version})
+    return {
+        "http": type("TimedHTTPConnectionPool", (HTTPConnectionPool,), {"ConnectionCls": http_connection}),
+        "https": type("TimedHTTPSConnectionPool", (HTTPSConnectionPool,), {"ConnectionCls": https_connection}),
+    }
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    def __init__(self, ip_version: Optional[int] = None, **kwargs):
+        # used by init_poolmanager, which is called by the init of HTTPAdapter
+        self.ip_version = ip_version
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = timed_pool_classes(self.ip_version)
+
+    def proxy_manager_for(self, proxy, **proxy_kwargs):
+        manager = super().proxy_manager_for(proxy, **proxy_kwargs)
+        # Socks proxies have their own connection classes. The proxy resolves the hosts, so the connections to the
+        # proxy are not limited to an ip version.
+        if not proxy.lower().startswith("socks"):
+            manager.pool_classes_by_scheme = timed_pool_classes()
+        return manager
+
+    def send(self, request, **kwargs):
+        timings.phases = {}
+        start = time.monotonic()
+        try:
+            return super().send(request, **kwargs)
+        finally:
+            phases = timings.phases
+            del timings.phases
+
+            elapsed = time.monotonic() - start
+            phases["read"] = max(elapsed - sum(phases.values()), 0)
+
+            statsd.incr("http_session", tags={"connection": "new" if "connect" in phases else "reused"})
+            for phase, seconds in phases.items():
+                statsd.timing("http_session_time", seconds * 1000, tags={"phase": phase})
+
+
+@lru_cache(maxsize=3)
+def get_session(ip_version: Optional[int] = None) -> Session:
+    """
+    The session of this worker process, use it as requests: get_session().get(url, timeout=(30, 30)). The session of
+    ip version 4 or 6 only connects to IPv4 or IPv6 addresses, the other session to any address of a host.
+    """
+    session = Session()
+
+    adapter = TimedHTTPAdapter(
+        ip_version=ip_version,
+        pool_connections=settings.HTTP_SESSION_POOLS,
+        pool_maxsize=settings.HTTP_SESSION_HOST_CONNECTIONS,
+        pool_block=True,
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    return session
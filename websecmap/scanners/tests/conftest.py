@@ -3,6 +3,13 @@ import pytest
 
 from websecmap.organizations.models import Organization, Url
 from websecmap.scanners.models import Endpoint
+from websecmap.scanners.scanner import http
+
+
+@pytest.fixture(autouse=True)
+def empty_probe_cache():
+    """Fetched endpoints are kept in memory, which would leak into the next test."""
+    http.probe_memory_cache.cache_clear()
 
 
 @pytest.fixture
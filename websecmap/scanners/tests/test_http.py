@@ -0,0 +1,174 @@
+import asyncio
+
+import redis
+
+from websecmap.scanners.models import Endpoint, PlannedScan, State
+from websecmap.scanners.plannedscan import pickup, request
+from websecmap.scanners.scanner import http
+from websecmap.scanners.scanner.http import (
+    compose_discover_task,
+    fetch,
+    probe,
+    probe_targets,
+    probe_uri,
+    store_discovered_endpoints,
+)
+from websecmap.scanners.tests.test_plannedscan import create_url
+
+
+async def serve(answer: bytes):
+    async def handle(reader, writer):
+        await reader.readline()
+        writer.write(answer)
+        await writer.drain()
+        writer.close()
+
+    return await asyncio.start_server(handle, "127.0.0.1", 0)
+
+
+def test_probe():
+    async def probe_servers():
+        website = await serve(b"HTTP/1.1 301 Moved Permanently\r\nLocation: https://example.com/\r\n\r\n")
+        # closes the connection without answering, requests sees that as "Connection aborted"
+        silent = await serve(b"")
+        # nothing listens on this port after the server is closed
+        closed = await serve(b"")
+        closed_port = closed.sockets[0].getsockname()[1]
+        closed.close()
+        await closed.wait_closed()
+
+        results = [
+            await probe("http", "example.com", "127.0.0.1", website.sockets[0].getsockname()[1]),
+            await probe("http", "example.com", "127.0.0.1", silent.sockets[0].getsockname()[1]),
+            await probe("http", "example.com", "127.0.0.1", closed_port),
+        ]
+
+        website.close()
+        silent.close()
+        return results
+
+    assert asyncio.run(probe_servers()) == [True, True, False]
+
+
+def test_probe_targets(monkeypatch):
+    resolved = []
+
+    def get_ipv4(url):
+        resolved.append(url)
+        return "" if url == "unresolvable.example.com" else "127.0.0.1"
+
+    monkeypatch.setattr(http, "get_ipv4", get_ipv4)
+
+    async def probe_website():
+        website = await serve(b"HTTP/1.1 200 OK\r\n\r\n")
+        port = website.sockets[0].getsockname()[1]
+        targets = [
+            [1, "example.com", "http", port],
+            [1, "example.com", "https", port],
+            [2, "unresolvable.example.com", "http", port],
+        ]
+        results = await probe_targets(targets, 4, concurrency=2)
+        website.close()
+        return port, results
+
+    port, results = asyncio.run(probe_website())
+
+    # the tls handshake on a plain http server fails, without a sign of a server
+    assert results == [[1, "http", port, True], [1, "https", port, False], [2, "http", port, False]]
+
+    # every url is resolved once, for all ports
+    assert sorted(resolved) == ["example.com", "unresolvable.example.com"]
+
+    # endpoints that were fetched by the shared probe are not connected to again
+    monkeypatch.setattr(http, "fetch", lambda uri_url, ip_version: {"connected": True})
+    probe_uri(f"http://unresolvable.example.com:{port}", 4)
+    results = asyncio.run(probe_targets([[2, "unresolvable.example.com", "http", port]], 4, concurrency=2))
+    assert results == [[2, "http", port, True]]
+
+
+def test_compose_discover_task(db, monkeypatch):
+    monkeypatch.setattr(http, "DISCOVERY_BATCH_SIZE", 2)
+    urls = [create_url(f"{number}.example.com") for number in range(3)]
+
+    tasks = compose_discover_task(urls)
+
+    # two batches per ip version, instead of a task per url, port and ip version
+    assert len(tasks.tasks) == 4
+    assert len(tasks.tasks[0].tasks[0].args[0]) == 2 * len(http.PREFERRED_PORT_ORDER)
+    assert len(tasks.tasks[1].tasks[0].args[0]) == 1 * len(http.PREFERRED_PORT_ORDER)
+
+
+def test_store_discovered_endpoints(db):
+    u1 = create_url("example.com")
+    u2 = create_url("example2.com")
+    Endpoint.objects.create(url=u2, protocol="http", port=80, ip_version=4, is_dead=False)
+
+    request("discover", "http", [u1, u2])
+    pickup("discover", "http", 2)
+
+    store_discovered_endpoints(
+        [[u1.id, "https", 443, True], [u1.id, "http", 80, False], [u2.id, "http", 80, False]],
+        ip_version=4,
+        origin="http_discover",
+        activity="discover",
+    )
+
+    assert list(Endpoint.objects.all().filter(is_dead=False).values_list("url", "protocol", "port")) == [
+        (u1.id, "https", 443)
+    ]
+    assert Endpoint.objects.all().get(url=u2).is_dead_reason == "Not found in HTTP Scanner anymore (http_discover)."
+    assert PlannedScan.objects.all().filter(state=State["finished"].value).count() == 2
+
+
+def test_fetch(responses):
+    responses.add(responses.GET, "http://example.com:80/", status=301, headers={"Location": "https://example.com/"})
+    responses.add(responses.GET, "https://example.com/", headers={"X-Frame-Options": "DENY"})
+
+    outcome = fetch("http://example.com:80")
+    assert outcome["connected"] is True
+    assert outcome["status_code"] == 200
+    assert outcome["url"] == "https://example.com/"
+    assert outcome["redirects"] == ["http://example.com:80/"]
+    assert outcome["headers"]["X-Frame-Options"] == "DENY"
+
+    # nothing listens
+    outcome = fetch("https://example.com:8443")
+    assert outcome["connected"] is False
+    assert outcome["error"]
+
+
+def test_probe_uri(monkeypatch):
+    fetched = []
+
+    def fetch(uri_url, ip_version):
+        fetched.append(uri_url)
+        return {"connected": True, "url": uri_url}
+
+    monkeypatch.setattr(http, "fetch", fetch)
+
+    for attempt in range(3):
+        probe_uri("https://example.com:443", 4)
+        probe_uri("http://example.com:80", 4)
+
+    # outcomes are kept per ip version
+    probe_uri("https://example.com:443", 6)
+    # unless a fresh outcome is needed
+    probe_uri("https://example.com:443", 4, refresh=True)
+
+    assert fetched == [
+        "https://example.com:443",
+        "http://example.com:80",
+        "https://example.com:443",
+        "https://example.com:443",
+    ]
+
+
+def test_probe_uri_without_redis(monkeypatch):
+    # nothing listens on this port, so every redis command fails
+    monkeypatch.setattr(http, "probe_redis_cache", lambda: redis.Redis.from_url("redis://127.0.0.1:1"))
+    monkeypatch.setattr(http, "fetch", lambda uri_url, ip_version: {"connected": True, "url": uri_url})
+
+    assert http.cached_probe_uri("https://example.com:443", 4) is None
+    assert probe_uri("https://example.com:443", 4) == {"connected": True, "url": "https://example.com:443"}
+    # the outcome is still kept in memory
+    assert http.probe_memory_cache().get("http_probe:4:https://example.com:443")
@@ -2,11 +2,17 @@ from datetime import datetime, timedelta
 
 import pytz
 
-from websecmap.map.models import Configuration, OrganizationReport
-from websecmap.organizations.models import OrganizationType
-from websecmap.scanners.models import PlannedScan
+from websecmap.map.models import Configuration
+from websecmap.organizations.models import OrganizationType, Url
+from websecmap.scanners.models import Activity, LatestUrlScan, PlannedScan, Priority, Scanner, UrlGenericScan
 from websecmap.scanners.plannedscan import plan_outdated_scans
-from websecmap.scanners.tests.test_plannedscan import create_organization, create_url, link_url_to_organization
+from websecmap.scanners.tests.test_plannedscan import (
+    create_endpoint,
+    create_endpoint_scan,
+    create_organization,
+    create_url,
+    link_url_to_organization,
+)
 
 
 def test_plan_outdated_scans(db):
@@ -34,59 +40,45 @@ def test_plan_outdated_scans(db):
     m.is_reported = True
     m.save()
 
-    example_report = {
-        "organization": {
-            "urls": [
-                {
-                    "url": "example.com",
-                    "ratings": [],
-                    "endpoints": [
-                        {
-                            "ratings": [
-                                {
-                                    "type": "http_security_header_strict_transport_security",
-                                    "since": "2010-08-05T18:57:53.873815+00:00",
-                                    "last_scan": "2010-08-07T14:34:56.917953+00:00",
-                                    "scan_type": "http_security_header_strict_transport_security",
-                                },
-                                {
-                                    "type": "http_security_header_x_frame_options",
-                                    "since": "2010-08-05T18:57:53.856580+00:00",
-                                    "last_scan": "2010-08-07T14:34:56.898717+00:00",
-                                    "scan_type": "http_security_header_x_frame_options",
-                                },
-                                {
-                                    "type": "http_security_header_x_content_type_options",
-                                    "since": "2010-08-05T18:57:53.864561+00:00",
-                                    "last_scan": "2010-08-07T14:34:56.907224+00:00",
-                                    "scan_type": "http_security_header_x_content_type_options",
-                                },
-                                {
-                                    "type": "http_security_header_x_xss_protection",
-                                    "since": "2020-08-05T18:57:53.845210+00:00",
-                                    "last_scan": "2020-08-07T14:34:56.881692+00:00",
-                                    "scan_type": "http_security_header_x_xss_protection",
-                                },
-                            ],
-                        }
-                    ],
-                }
-            ],
-        }
-    }
-    r = OrganizationReport()
-    r.calculation = example_report
-    r.organization = o
-    r.at_when = datetime.now(pytz.utc) - timedelta(days=100)
-    r.save()
+    long_ago = datetime(2010, 8, 7, tzinfo=pytz.utc)
+    recently = datetime.now(pytz.utc) - timedelta(days=1)
+
+    e1 = create_endpoint(u1, 4, "https", 443)
+    create_endpoint_scan(e1, "http_security_header_strict_transport_security", "True", long_ago)
+    create_endpoint_scan(e1, "http_security_header_x_frame_options", "True", long_ago)
+    create_endpoint_scan(e1, "http_security_header_x_content_type_options", "True", long_ago)
+    create_endpoint_scan(e1, "http_security_header_x_xss_protection", "True", recently)
+
+    # up to date, on a dead endpoint, or on a dead url: nothing to plan
+    e2 = create_endpoint(u2, 4, "https", 443)
+    create_endpoint_scan(e2, "http_security_header_strict_transport_security", "True", recently)
+    dead_endpoint = create_endpoint(u2, 6, "https", 443)
+    dead_endpoint.is_dead = True
+    dead_endpoint.save()
+    create_endpoint_scan(dead_endpoint, "http_security_header_strict_transport_security", "True", long_ago)
+    u3 = create_url("dead.example.com")
+    u3.is_dead = True
+    u3.save()
+    link_url_to_organization(u3, o)
+    create_endpoint_scan(create_endpoint(u3, 4, "https", 443), "plain_https", "True", long_ago)
 
-    assert len(r.calculation["organization"]) == 1
+    # url scans are also planned
+    scan = UrlGenericScan.objects.all().create(
+        url=u2, type="DNSSEC", rating="True", is_the_latest_scan=True, rating_determined_on=long_ago
+    )
+    UrlGenericScan.objects.all().filter(url=u2).update(last_scan_moment=long_ago)
+    LatestUrlScan.objects.create(url=u2, type="DNSSEC", scan=scan)
+
+    # onboarded urls, otherwise the scans get the onboarding priority
+    Url.objects.all().update(onboarded=True)
 
     assert PlannedScan.objects.all().count() == 0
 
     published_scan_types = [
         "http_security_header_strict_transport_security",
         "http_security_header_x_content_type_options",
+        "plain_https",
+        "DNSSEC",
     ]
     plan_outdated_scans(published_scan_types)
 
@@ -95,8 +87,15 @@ def test_plan_outdated_scans(db):
 
     [{'activity': 'scan', 'scanner': 'security_headers', 'url': 'example.com'},
      {'activity': 'discover', 'scanner': 'http', 'url': 'example.com'},
-     {'activity': 'verify', 'scanner': 'http', 'url': 'example.com'}]
+     {'activity': 'verify', 'scanner': 'http', 'url': 'example.com'},
+     {'activity': 'scan', 'scanner': 'dnssec', 'url': 'example2.com'}]
 
     As both scans originate from the same scanner, and have the same underlaying scanner.
     """
-    assert PlannedScan.objects.all().count() == 3
+    assert set(PlannedScan.objects.all().values_list("activity", "scanner", "url")) == {
+        (Activity["scan"].value, Scanner["security_headers"].value, u1.id),
+        (Activity["discover"].value, Scanner["http"].value, u1.id),
+        (Activity["verify"].value, Scanner["http"].value, u1.id),
+        (Activity["scan"].value, Scanner["dnssec"].value, u2.id),
+    }
+    assert set(PlannedScan.objects.all().values_list("priority", flat=True)) == {Priority["outdated"].value}
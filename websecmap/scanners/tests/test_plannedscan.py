@@ -1,28 +1,43 @@
 import logging
 from datetime import timedelta
 
+import pytest
 from django.utils import timezone
 from freezegun import freeze_time
 
 from websecmap.organizations.models import Organization, Url
+from websecmap.scanners import plannedscan
 from websecmap.scanners.models import (
     Endpoint,
     EndpointGenericScan,
+    ArchivedPlannedScan,
+    LatestEndpointScan,
     PlannedScan,
+    PlannedScanCounter,
     PlannedScanStatistic,
+    Priority,
     Scanner,
     State,
     Activity,
 )
 from websecmap.scanners.plannedscan import (
+    archive_finished_scans,
     calculate_progress,
+    claim,
+    fair_share,
+    finish,
     finish_multiple,
+    flush_finished_scans,
     get_latest_progress,
     pickup,
+    recalculate_progress,
     request,
     reset,
+    retry,
     store_progress,
     retrieve_endpoints_from_urls,
+    scheduled_scan_ids,
+    set_scan_states,
 )
 from websecmap.scanners.scanner.tls_qualys import plan_scan
 
@@ -76,6 +91,8 @@ def create_endpoint_scan(endpoint, type, rating, at_when):
     egs.last_scan_moment = at_when
     egs.save()
 
+    LatestEndpointScan.objects.update_or_create(endpoint=endpoint, type=type, defaults={"scan": egs})
+
 
 def test_plannedscan(db):
     o = create_organization("Test")
@@ -251,3 +268,250 @@ def test_retrieve_endpoints_from_urls(db):
 
     assert endpoints == [e1]
     assert urls_without_endpoints == [u2.id]
+
+
+def test_claim(db, django_assert_max_num_queries):
+    urls = [create_url(f"example{number}.com") for number in range(5)]
+    request(scanner="tls_qualys", activity="scan", urls=urls)
+
+    # the urls are retrieved together with the claimed scans
+    with django_assert_max_num_queries(15):
+        first_claim = claim(scanner="tls_qualys", activity="scan", amount=3)
+        assert sorted(scan.url.url for scan in first_claim) == sorted(url.url for url in urls[0:3])
+
+    # claimed scans are not claimed again
+    second_claim = claim(scanner="tls_qualys", activity="scan", amount=3)
+    assert len(second_claim) == 2
+    assert not {scan.id for scan in first_claim} & {scan.id for scan in second_claim}
+    assert PlannedScan.objects.all().filter(state=State["picked_up"].value).count() == 5
+    assert claim(scanner="tls_qualys", activity="scan", amount=3) == []
+
+    # other scanners and activities are not claimed
+    request(scanner="dnssec", activity="scan", urls=urls[0:1])
+    request(scanner="tls_qualys", activity="verify", urls=urls[0:1])
+    assert [scan.url for scan in claim(scanner="dnssec", activity="scan", amount=10)] == urls[0:1]
+
+
+def test_concurrent_claim(db, monkeypatch):
+    urls = [create_url(f"example{number}.com") for number in range(3)]
+    request(scanner="tls_qualys", activity="scan", urls=urls)
+
+    def claimed_in_between(*args):
+        # another claim picks up the first scan after the scans were scheduled
+        scan_ids = scheduled_scan_ids(*args)
+        PlannedScan.objects.all().filter(id=scan_ids[0]).update(
+            state=State["picked_up"].value, last_state_change_at=timezone.now() - timedelta(seconds=1)
+        )
+        return scan_ids
+
+    monkeypatch.setattr(plannedscan, "scheduled_scan_ids", claimed_in_between)
+    # databases with skip locked don't see the scan of the other claim
+    monkeypatch.setattr(plannedscan.connection.features, "has_select_for_update_skip_locked", False)
+
+    assert sorted(scan.url.url for scan in claim(scanner="tls_qualys", activity="scan", amount=3)) == [
+        "example1.com",
+        "example2.com",
+    ]
+
+
+def test_request(db, django_assert_num_queries):
+    urls = [create_url(f"example{number}.com") for number in range(4)]
+    request(scanner="tls_qualys", activity="scan", urls=urls[0:2])
+    claim(scanner="tls_qualys", activity="scan", amount=1)
+
+    # requested and picked up scans are not requested again, also not when an url is in the request twice
+    with django_assert_num_queries(6):
+        request(scanner="tls_qualys", activity="scan", urls=[url.id for url in urls] + [urls[3].id])
+    assert sorted(PlannedScan.objects.all().values_list("url", flat=True)) == sorted(url.id for url in urls)
+
+    # finished scans can be requested again
+    finish_multiple(scanner="tls_qualys", activity="scan", urls=[url.id for url in urls])
+    assert PlannedScan.objects.all().filter(state=State["finished"].value).count() == 1
+    request(scanner="tls_qualys", activity="scan", urls=urls)
+    assert PlannedScan.objects.all().filter(state=State["requested"].value).count() == 4
+
+    # many urls are checked against all open requests at once
+    many_urls = [create_url(f"many{number}.com") for number in range(600)]
+    request(scanner="tls_qualys", activity="scan", urls=many_urls + urls)
+    assert PlannedScan.objects.all().filter(state=State["requested"].value).count() == 604
+
+
+def test_set_scan_states(db, django_assert_num_queries):
+    urls = [create_url(f"example{number}.com") for number in range(3)]
+    request(scanner="tls_qualys", activity="scan", urls=urls)
+    claim(scanner="tls_qualys", activity="scan", amount=3)
+    # a second scan on the first url, which is newer
+    newest_scan = PlannedScan.objects.get(url=urls[0])
+    newest_scan.pk = None
+    newest_scan.save()
+    oldest_scan, newest_scan = PlannedScan.objects.all().filter(url=urls[0]).order_by("id")
+
+    with django_assert_num_queries(9):
+        assert set_scan_states("scan", "tls_qualys", [urls[0].id, urls[1].id, urls[1].id], "finished") == 2
+
+    # the oldest scan is finished first
+    assert PlannedScan.objects.get(id=oldest_scan.id).state == State["finished"].value
+    assert PlannedScan.objects.get(id=newest_scan.id).state == State["picked_up"].value
+    assert PlannedScan.objects.get(url=urls[1]).finished_at_when
+    assert PlannedScan.objects.get(url=urls[2]).state == State["picked_up"].value
+
+    # scans of other scanners are not touched
+    assert set_scan_states("scan", "dnssec", [urls[2].id], "finished") == 0
+
+
+class FakeBuffer:
+    """The list commands of redis that are used by the finish buffer."""
+
+    def __init__(self):
+        self.items = []
+        self.commands = []
+
+    def rpush(self, key, *values):
+        self.items.extend(value.encode() if isinstance(value, str) else value for value in values)
+        return len(self.items)
+
+    def pipeline(self):
+        return self
+
+    def lrange(self, key, start, end):
+        self.commands.append(lambda: self.items[start : end + 1])
+
+    def ltrim(self, key, start, end):
+        def trim():
+            self.items = self.items[start:]
+
+        self.commands.append(trim)
+
+    def execute(self):
+        results = [command() for command in self.commands]
+        self.commands = []
+        return results
+
+
+def test_finish_buffer(db, monkeypatch):
+    buffer = FakeBuffer()
+    monkeypatch.setattr(plannedscan, "finish_buffer", lambda: buffer)
+    flushes = []
+    monkeypatch.setattr(flush_finished_scans, "apply_async", lambda countdown: flushes.append(countdown))
+
+    urls = [create_url(f"example{number}.com") for number in range(3)]
+    request(scanner="tls_qualys", activity="scan", urls=urls)
+    request(scanner="dnssec", activity="scan", urls=urls[0:1])
+    claim(scanner="tls_qualys", activity="scan", amount=3)
+    claim(scanner="dnssec", activity="scan", amount=1)
+    # a second scan on the first url, which should not be finished
+    newest_scan = PlannedScan.objects.get(url=urls[0], scanner=Scanner["tls_qualys"].value)
+    newest_scan.pk = None
+    newest_scan.save()
+
+    # a flush is scheduled when the first scan is added to the buffer
+    finish("scan", "tls_qualys", urls[0].id)
+    finish("scan", "tls_qualys", urls[1].id)
+    finish("scan", "dnssec", urls[0].id)
+    assert len(flushes) == 1
+
+    # a flush that fails puts the scans back and schedules the next flush
+    calls = []
+
+    def fail_second_group(*args):
+        calls.append(args)
+        if len(calls) == 2:
+            raise RuntimeError("database went away")
+        return set_scan_states(*args)
+
+    monkeypatch.setattr(plannedscan, "set_scan_states", fail_second_group)
+    with pytest.raises(RuntimeError):
+        flush_finished_scans()
+    assert len(buffer.items) == 3
+    assert len(flushes) == 2
+    # the group that was written before the failure is rolled back, so it is not written twice
+    assert PlannedScan.objects.all().filter(state=State["finished"].value).count() == 0
+
+    # scans that are finished after the failure are flushed with the earlier ones
+    finish("scan", "tls_qualys", urls[2].id)
+    flush_finished_scans()
+    assert buffer.items == []
+    assert PlannedScan.objects.all().filter(state=State["finished"].value).count() == 4
+    assert PlannedScan.objects.get(id=newest_scan.id).state == State["picked_up"].value
+
+
+def test_scheduled_scan_ids(db):
+    urls = [create_url(f"example{number}.com") for number in range(4)]
+    for url in urls:
+        url.onboarded = True
+        url.save()
+
+    request(scanner="tls_qualys", activity="scan", urls=urls[0:2])
+    request(scanner="tls_qualys", activity="scan", urls=urls[2:4], priority="outdated")
+    # the first url was requested the longest ago
+    for age, url in enumerate(urls):
+        PlannedScan.objects.all().filter(url=url).update(requested_at_when=timezone.now() - timedelta(hours=10 - age))
+    scan_ids = {scan.url_id: scan.id for scan in PlannedScan.objects.all()}
+    requested_scans = PlannedScan.objects.all().filter(state=State["requested"].value)
+
+    # the oldest of the highest priority first
+    assert scheduled_scan_ids(requested_scans, 3, 0) == [
+        scan_ids[urls[2].id],
+        scan_ids[urls[3].id],
+        scan_ids[urls[0].id],
+    ]
+
+    # with a part of the scans by age, older requests get their turn
+    assert scheduled_scan_ids(requested_scans, 2, 1) == [scan_ids[urls[0].id], scan_ids[urls[2].id]]
+    assert scheduled_scan_ids(requested_scans, 3, 3) == [
+        scan_ids[urls[0].id],
+        scan_ids[urls[1].id],
+        scan_ids[urls[2].id],
+    ]
+
+    # requesting again with a higher priority raises the priority, urls that are onboarding always go first
+    request(scanner="tls_qualys", activity="scan", urls=urls[1:2], priority="outdated")
+    assert PlannedScan.objects.get(url=urls[1]).priority == Priority["outdated"].value
+    onboarding_url = create_url("onboarding.com")
+    request(scanner="tls_qualys", activity="scan", urls=[onboarding_url])
+    assert scheduled_scan_ids(requested_scans, 1, 0) == [PlannedScan.objects.get(url=onboarding_url).id]
+
+
+def test_fair_share():
+    assert fair_share(10, 20) == 2
+    assert fair_share(10, 0) == 0
+    assert fair_share(10, 100) == 10
+    assert fair_share(10, 1000) == 10
+    # small amounts get their share on average
+    assert 1000 < sum(fair_share(1, 20) for _ in range(10000)) < 3000
+
+
+def test_progress_counters_and_archive(db):
+    urls = [create_url(f"example{number}.com") for number in range(3)]
+
+    def counted_progress():
+        progress = calculate_progress()
+        recalculate_progress()
+        assert calculate_progress() == progress
+        return {(row["state"], row["amount"]) for row in progress}
+
+    request(scanner="tls_qualys", activity="scan", urls=urls)
+    assert counted_progress() == {(State["requested"].value, 3)}
+
+    claim(scanner="tls_qualys", activity="scan", amount=2)
+    assert counted_progress() == {(State["requested"].value, 1), (State["picked_up"].value, 2)}
+
+    # picked up scans that take too long are retried
+    PlannedScan.objects.all().update(last_state_change_at=timezone.now() - timedelta(days=1))
+    retry()
+    assert counted_progress() == {(State["requested"].value, 3)}
+
+    claim(scanner="tls_qualys", activity="scan", amount=3)
+    finish_multiple(scanner="tls_qualys", activity="scan", urls=[url.id for url in urls[0:2]])
+    expected_progress = {(State["requested"].value, 0), (State["picked_up"].value, 1), (State["finished"].value, 2)}
+    assert counted_progress() == expected_progress
+
+    # old finished scans are archived, and are still counted
+    PlannedScan.objects.all().filter(url=urls[0]).update(finished_at_when=timezone.now() - timedelta(days=8))
+    assert archive_finished_scans(days=7) == 1
+    assert ArchivedPlannedScan.objects.all().count() == 1
+    assert PlannedScan.objects.all().count() == 2
+    assert counted_progress() == expected_progress
+
+    reset()
+    assert PlannedScanCounter.objects.all().count() == 0
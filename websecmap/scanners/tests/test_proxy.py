@@ -0,0 +1,101 @@
+import random
+from collections import Counter
+
+import pytest
+from celery.exceptions import Retry
+from freezegun import freeze_time
+
+from websecmap.scanners.models import ScanProxy
+from websecmap.scanners.proxy import (
+    available_proxies,
+    claim_proxy,
+    health_weighted_order,
+    lease_first,
+    release_proxy,
+    timeout_claims,
+)
+
+
+def create_proxies(amount: int, request_speed_in_ms: int = 200):
+    return [
+        ScanProxy.objects.create(address=f"https://192.0.2.{number}:1337", request_speed_in_ms=request_speed_in_ms)
+        for number in range(amount)
+    ]
+
+
+def test_claim_proxy(db):
+    proxy = create_proxies(1)[0]
+
+    with freeze_time("2020-01-01 12:00:00"):
+        lease = claim_proxy()
+        assert lease == {**proxy.as_dict(), "lease_until": "2020-01-01T15:00:00+00:00"}
+
+        # all proxies are claimed, the task is retried later instead of waiting on the worker
+        with pytest.raises(Retry):
+            claim_proxy()
+
+        release_proxy(lease)
+        assert claim_proxy()["id"] == proxy.pk
+
+    # the lease expires when the proxy is never released, for example because the scan crashed
+    with freeze_time("2020-01-01 15:00:01"):
+        assert available_proxies().count() == 1
+        timeout_claims()
+        assert ScanProxy.objects.get().currently_used_in_tls_qualys_scan is False
+
+
+def test_late_release(db):
+    """A scan that releases its proxy after its lease expired, does not release the lease of another scan."""
+    proxy = create_proxies(1)[0]
+
+    with freeze_time("2020-01-01 12:00:00"):
+        expired_lease = claim_proxy()
+
+    with freeze_time("2020-01-01 15:00:01"):
+        lease = claim_proxy()
+
+        release_proxy(expired_lease)
+        assert available_proxies().count() == 0
+
+        release_proxy(lease)
+        assert available_proxies().count() == 1
+
+    # proxies that are claimed without a lease are released unconditionally
+    ScanProxy.objects.all().update(currently_used_in_tls_qualys_scan=True)
+    release_proxy(proxy.as_dict())
+    assert available_proxies().count() == 1
+
+
+def test_concurrent_claims(db):
+    """Hundreds of scans claim one of the proxies at the same moment. Every proxy is claimed once."""
+    proxies = create_proxies(20)
+    random.seed(0)
+
+    # all claims see the same available proxies, before any of them has claimed one
+    orders = [health_weighted_order(list(available_proxies())) for claim in range(500)]
+
+    # each claim tries the proxies in their order until one is still available
+    claimed = [lease_first(order) for order in orders]
+
+    claimed_ids = [proxy["id"] for proxy in claimed if proxy]
+    assert sorted(claimed_ids) == sorted(proxy.pk for proxy in proxies)
+    assert claimed.count(None) == 480
+    assert available_proxies().count() == 0
+
+
+def test_health_weighted_order(db):
+    fast = ScanProxy.objects.create(address="https://192.0.2.1:1337", request_speed_in_ms=100)
+    slow = ScanProxy.objects.create(address="https://192.0.2.2:1337", request_speed_in_ms=1000)
+    full = ScanProxy.objects.create(
+        address="https://192.0.2.3:1337",
+        request_speed_in_ms=100,
+        qualys_capacity_this_client=25,
+        qualys_capacity_current=25,
+    )
+    random.seed(0)
+
+    first = Counter(health_weighted_order([fast, slow, full])[0].pk for attempt in range(1000))
+
+    # proxies that are fast and have capacity are claimed more often, but others are still claimed once in a while
+    assert first[fast.pk] > first[slow.pk] > 0
+    assert first[fast.pk] > first[full.pk] > 0
@@ -0,0 +1,103 @@
+from contextlib import nullcontext
+
+import pytest
+from celery.exceptions import Retry
+from freezegun import freeze_time
+
+from websecmap.scanners import ratelimit
+from websecmap.scanners.ratelimit import acquire, limit, target_network
+
+
+@pytest.fixture
+def empty_buckets(monkeypatch):
+    monkeypatch.setattr(ratelimit, "local_buckets", ratelimit.LRUCache(ratelimit.LOCAL_BUCKETS))
+
+
+def test_target_network():
+    assert target_network("192.0.2.15") == "192.0.2.0/24"
+    assert target_network("2001:db8:1:2::1") == "2001:db8:1::/48"
+
+
+def test_acquire(empty_buckets):
+    with freeze_time("2020-01-01 12:00:00"):
+        # 2/m, so a token every 30 seconds
+        assert acquire("certificate_transparency_scan", "crt.sh") == 0
+        # the next token is reserved
+        assert acquire("certificate_transparency_scan", "crt.sh") == 30
+
+        # other targets and scanners have their own bucket
+        assert acquire("certificate_transparency_scan", "example.com") == 0
+        assert acquire("nsec_scan") == 0
+
+    with freeze_time("2020-01-01 12:00:20"):
+        # the token of 12:00:30 is reserved, the next one is at 12:01:00
+        assert acquire("certificate_transparency_scan", "crt.sh") == pytest.approx(40)
+
+    with freeze_time("2020-01-01 12:01:30"):
+        assert acquire("certificate_transparency_scan", "crt.sh") == 0
+
+
+def test_acquire_many_waiters(empty_buckets):
+    """Waiters that acquire at the same moment each get their own token, so they each wait just once."""
+    with freeze_time("2020-01-01 12:00:00"):
+        # 60/m, so a token every second
+        waits = [acquire("make_screenshot", "http://screenshot:1337") for waiter in range(100)]
+        assert waits == pytest.approx(list(range(100)))
+
+    # all reserved tokens are used after 100 seconds, then the bucket is full again
+    with freeze_time("2020-01-01 12:01:40"):
+        assert acquire("make_screenshot", "http://screenshot:1337") == 0
+
+
+class Request:
+    called_directly = False
+    is_eager = False
+
+
+class FakeTask:
+    def __init__(self):
+        self.request = Request()
+
+    def retry(self, countdown, max_retries, headers=None):
+        self.countdown = countdown
+        self.headers = headers
+        return Retry(when=countdown)
+
+
+def test_limit(empty_buckets):
+    task = FakeTask()
+
+    with freeze_time("2020-01-01 12:00:00"):
+        limit(task, "make_screenshot", "http://screenshot:1337")
+
+        # the task is retried at the moment of its token, instead of waiting on the worker
+        with pytest.raises(Retry):
+            limit(task, "make_screenshot", "http://screenshot:1337")
+        assert task.countdown == 1
+
+    # the retried task has a token already, it does not take another one
+    retried_task = FakeTask()
+    for header, value in task.headers.items():
+        setattr(retried_task.request, header, value)
+
+    with freeze_time("2020-01-01 12:00:01"):
+        limit(retried_task, "make_screenshot", "http://screenshot:1337")
+        # the token of 12:00:01 was used by the retried task, the next one is not taken yet
+        assert acquire("make_screenshot", "http://screenshot:1337") == 1
+
+
+def test_limit_reservation_horizon(empty_buckets):
+    """Tokens are not reserved so far ahead that the broker would deliver the retried task again."""
+    with freeze_time("2020-01-01 12:00:00"):
+        # 60/h, so a token every minute: the tokens of the next 30 minutes are reserved
+        for waiting_task in range(31):
+            with pytest.raises(Retry) if waiting_task else nullcontext():
+                limit(FakeTask(), "wordlist_scan")
+
+        task = FakeTask()
+        with pytest.raises(Retry):
+            limit(task, "wordlist_scan")
+        # nothing is reserved, the task tries again when the next free token is within 30 minutes
+        assert task.headers is None
+        assert task.countdown == pytest.approx(60)
+        assert acquire("wordlist_scan", horizon=ratelimit.RESERVATION_HORIZON) == pytest.approx(31 * 60)
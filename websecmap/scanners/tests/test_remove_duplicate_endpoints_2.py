@@ -5,8 +5,9 @@ from django.utils import timezone
 from deepdiff import DeepDiff
 
 from websecmap.organizations.models import Url
-from websecmap.scanners.duplicates import deduplicate_all_endpoints_sequentially
-from websecmap.scanners.models import Endpoint, EndpointGenericScan
+from websecmap.scanners.duplicates import deduplicate_all_endpoints_sequentially, reduce_if_duplicate_endpoint
+from websecmap.scanners.models import Endpoint, EndpointGenericScan, LatestEndpointScan
+from websecmap.scanners.scanmanager import store_endpoint_scan_result
 import logging
 
 log = logging.getLogger(__package__)
@@ -149,3 +150,33 @@ def test_deduplicate_all_endpoints_sequentially(db):
     # scans have migrated to endpoint id 1
     # first_epgs = EndpointGenericScan.objects.filter(endpoint=target_ep).first()
     # assert first_epgs.endpoint.id == 1
+
+
+def test_deduplicate_latest_scans(db):
+    u = Url.objects.create(url="basisbeveiliging.nl")
+    duplicate_properties = {"protocol": "https", "port": 443, "ip_version": 4, "is_dead": False, "url": u}
+    older = Endpoint.objects.create(**{**duplicate_properties, **{"discovered_on": date(2021, 7, 1)}})
+    newer = Endpoint.objects.create(**{**duplicate_properties, **{"discovered_on": date(2021, 7, 2)}})
+
+    store_endpoint_scan_result("tls_qualys", older.id, "A", "old")
+    store_endpoint_scan_result("tls_qualys", newer.id, "F", "new")
+    store_endpoint_scan_result("http_security_header_x_frame_options", older.id, "ok", "only on the older endpoint")
+    store_endpoint_scan_result("http_security_header_x_content_type_options", newer.id, "ok", "only on the newer one")
+
+    reduce_if_duplicate_endpoint(newer)
+
+    # the newest scan of each type on both endpoints is the latest scan of the remaining endpoint
+    latest_scans = {
+        latest.type: latest.scan.explanation for latest in LatestEndpointScan.objects.all().filter(endpoint=older)
+    }
+    assert latest_scans == {
+        "tls_qualys": "new",
+        "http_security_header_x_frame_options": "only on the older endpoint",
+        "http_security_header_x_content_type_options": "only on the newer one",
+    }
+    assert LatestEndpointScan.objects.all().count() == 3
+    assert not EndpointGenericScan.objects.get(explanation="old").is_the_latest_scan
+
+    # new scans continue from the transferred latest scan
+    store_endpoint_scan_result("tls_qualys", older.id, "F", "new")
+    assert EndpointGenericScan.objects.all().filter(type="tls_qualys").count() == 2
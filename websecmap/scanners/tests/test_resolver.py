@@ -0,0 +1,82 @@
+import redis
+from freezegun import freeze_time
+
+from websecmap.scanners import resolver
+from websecmap.scanners.resolver import LRUCache, resolve
+
+
+def test_lru_cache():
+    cache = LRUCache(maxsize=2)
+
+    with freeze_time("2020-01-01 12:00:00"):
+        cache.set("a", ["192.0.2.1"], ttl=60)
+        cache.set("b", [], ttl=60)
+        assert cache.get("b") == []
+        assert cache.get("a") == ["192.0.2.1"]
+
+        # a was used more recently than b, so b is removed
+        cache.set("c", ["192.0.2.3"], ttl=60)
+        assert cache.get("b") is None
+        assert cache.get("a") == ["192.0.2.1"]
+
+    with freeze_time("2020-01-01 12:01:00"):
+        assert cache.get("a") is None
+        assert cache.get("c") is None
+
+
+def test_resolve(monkeypatch):
+    lookups = []
+
+    def lookup(hostname, record_type):
+        lookups.append((hostname, record_type))
+        if hostname == "example.com":
+            return ["192.0.2.1"], 300
+        if hostname == "timeout.example.com":
+            return [], 0
+        # does not exist
+        return [], 60
+
+    monkeypatch.setattr(resolver, "lookup", lookup)
+    resolver.memory_cache.cache_clear()
+
+    with freeze_time("2020-01-01 12:00:00"):
+        for attempt in range(3):
+            assert resolve("example.com", 4) == ["192.0.2.1"]
+            assert resolve("Example.com", 4) == ["192.0.2.1"]
+            assert resolve("nxdomain.example.com", 4) == []
+            assert resolve("timeout.example.com", 4) == []
+
+        # a and aaaa records are cached separately
+        assert resolve("example.com", 6) == ["192.0.2.1"]
+
+    assert lookups == [
+        ("example.com", "A"),
+        ("nxdomain.example.com", "A"),
+        ("timeout.example.com", "A"),
+        ("timeout.example.com", "A"),
+        ("timeout.example.com", "A"),
+        ("example.com", "AAAA"),
+    ]
+
+    # the missing hostname expires before the address
+    with freeze_time("2020-01-01 12:02:00"):
+        assert resolve("example.com", 4) == ["192.0.2.1"]
+        assert resolve("nxdomain.example.com", 4) == []
+    assert lookups[6:] == [("nxdomain.example.com", "A")]
+
+
+def test_resolve_without_redis(monkeypatch):
+    # nothing listens on this port, so every redis command fails
+    monkeypatch.setattr(resolver, "redis_cache", lambda: redis.Redis.from_url("redis://127.0.0.1:1"))
+    monkeypatch.setattr(resolver, "lookup", lambda hostname, record_type: (["192.0.2.1"], 300))
+    resolver.memory_cache.cache_clear()
+
+    # the address is looked up and cached in memory
+    assert resolve("example.com", 4) == ["192.0.2.1"]
+    assert resolver.memory_cache().get("dns_cache:A:example.com") == ["192.0.2.1"]
+
+
+def test_lookup_ip_address():
+    assert resolver.lookup("192.0.2.1", "A") == (["192.0.2.1"], resolver.MAX_TTL)
+    assert resolver.lookup("192.0.2.1", "AAAA") == ([], resolver.MAX_TTL)
+    assert resolver.lookup("2001:db8::1", "AAAA") == (["2001:db8::1"], resolver.MAX_TTL)
@@ -0,0 +1,111 @@
+from datetime import datetime
+
+import pytz
+from django.db.models.signals import post_save
+from freezegun import freeze_time
+
+from websecmap.scanners.models import EndpointGenericScan, LatestEndpointScan, LatestUrlScan, UrlGenericScan
+from websecmap.scanners.scanmanager import (
+    store_endpoint_scan_result,
+    store_endpoint_scan_results,
+    store_url_scan_result,
+)
+from websecmap.scanners.tests.test_plannedscan import create_endpoint, create_url
+
+
+def test_store_endpoint_scan_results(db, django_assert_num_queries):
+    e1 = create_endpoint(create_url("example.com"), 4, "https", 443)
+    e2 = create_endpoint(create_url("example2.com"), 4, "https", 443)
+
+    with freeze_time("2020-01-01"):
+        store_endpoint_scan_result("test1", e1.pk, "good", "")
+        store_endpoint_scan_result("test2", e1.pk, "good", "")
+        store_endpoint_scan_result("test1", e2.pk, "good", "")
+
+    with freeze_time("2020-02-01"):
+        # one query for the latest scans, six for the changes, one to check for concurrently stored first scans and
+        # two for the transaction
+        with django_assert_num_queries(10):
+            store_endpoint_scan_results(
+                [
+                    # unchanged
+                    ("test1", e1.pk, "good", "", ""),
+                    # changed
+                    ("test2", e1.pk, "bad", "", ""),
+                    # new, and then changed and unchanged within the same results. Ratings are stored as a string.
+                    ("test3", e1.pk, "good", "", ""),
+                    ("test3", e1.pk, 80, "", ""),
+                    ("test3", e1.pk, "80", "", ""),
+                    # long messages and evidence are cut off
+                    ("test1", e2.pk, "good", "very long message" * 100, "very long evidence" * 1000),
+                ]
+            )
+
+    scans = EndpointGenericScan.objects.all().order_by("endpoint", "type", "id")
+    assert [(scan.endpoint_id, scan.type, scan.rating, scan.is_the_latest_scan) for scan in scans] == [
+        (e1.pk, "test1", "good", True),
+        (e1.pk, "test2", "good", False),
+        (e1.pk, "test2", "bad", True),
+        (e1.pk, "test3", "good", False),
+        (e1.pk, "test3", "80", True),
+        (e2.pk, "test1", "good", False),
+        (e2.pk, "test1", "good", True),
+    ]
+
+    # the latest scan table points to the scans that are flagged as latest
+    assert set(LatestEndpointScan.objects.all().values_list("scan", flat=True)) == set(
+        scans.filter(is_the_latest_scan=True).values_list("id", flat=True)
+    )
+    assert LatestEndpointScan.objects.all().count() == 4
+
+    february = datetime(2020, 2, 1, tzinfo=pytz.utc)
+    unchanged = scans.get(endpoint=e1, type="test1")
+    assert unchanged.last_scan_moment == february
+    assert unchanged.rating_determined_on == datetime(2020, 1, 1, tzinfo=pytz.utc)
+
+    long_scan = scans.get(endpoint=e2, is_the_latest_scan=True)
+    assert len(long_scan.explanation) == 255
+    assert len(long_scan.evidence) == 9000
+
+
+def test_store_url_scan_result(db):
+    u = create_url("example.com")
+
+    store_url_scan_result("DNSSEC", u.pk, "good", "")
+    store_url_scan_result("DNSSEC", u.pk, "good", "")
+    store_url_scan_result("DNSSEC", u.pk, "bad", "")
+
+    scans = UrlGenericScan.objects.all().order_by("id")
+    assert [(scan.rating, scan.is_the_latest_scan) for scan in scans] == [("good", False), ("bad", True)]
+    assert list(LatestUrlScan.objects.all().values_list("url", "type", "scan")) == [(u.pk, "DNSSEC", scans[1].pk)]
+
+
+def test_store_first_scans_concurrently(db, monkeypatch):
+    """Two workers store the first scan of the same type, both see no latest scan. The last one stored is kept."""
+    e = create_endpoint(create_url("example.com"), 4, "https", 443)
+    u = create_url("example2.com")
+
+    bulk_create = EndpointGenericScan.objects.bulk_create
+
+    def other_worker_stores_first(scans, **kwargs):
+        monkeypatch.undo()
+        store_endpoint_scan_result("test1", e.pk, "other", "")
+        return bulk_create(scans, **kwargs)
+
+    monkeypatch.setattr(EndpointGenericScan.objects, "bulk_create", other_worker_stores_first)
+    store_endpoint_scan_result("test1", e.pk, "good", "")
+
+    scans = EndpointGenericScan.objects.all().order_by("id")
+    assert [(scan.rating, scan.is_the_latest_scan) for scan in scans] == [("other", False), ("good", True)]
+    assert list(LatestEndpointScan.objects.all().values_list("scan", flat=True)) == [scans[1].pk]
+
+    def other_worker_stores_first_url_scan(sender, instance, **kwargs):
+        post_save.disconnect(other_worker_stores_first_url_scan, sender=UrlGenericScan)
+        store_url_scan_result("DNSSEC", u.pk, "other", "")
+
+    post_save.connect(other_worker_stores_first_url_scan, sender=UrlGenericScan)
+    store_url_scan_result("DNSSEC", u.pk, "good", "")
+
+    scans = UrlGenericScan.objects.all().order_by("id")
+    assert [(scan.rating, scan.is_the_latest_scan) for scan in scans] == [("good", True), ("other", False)]
+    assert list(LatestUrlScan.objects.all().values_list("scan", flat=True)) == [scans[0].pk]
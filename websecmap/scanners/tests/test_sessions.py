@@ -0,0 +1,105 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from websecmap.scanners import sessions
+from websecmap.scanners.scanner.http import fetch
+from websecmap.scanners.sessions import get_session
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Set-Cookie", "session=1")
+        self.send_header("X-Host", self.headers["Host"])
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Recorder:
+    def __init__(self):
+        self.metrics = []
+
+    def incr(self, metric, tags):
+        self.metrics.append((metric, tags))
+
+    def timing(self, metric, value, tags):
+        self.metrics.append((metric, tags))
+
+
+def test_get_session(responses, monkeypatch):
+    # a real server is used, to see connections being reused
+    responses.add_passthru("http://127.0.0.1")
+    recorder = Recorder()
+    monkeypatch.setattr(sessions, "statsd", recorder)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+
+    first = get_session().get(url, timeout=(5, 5))
+    second = get_session().get(url, timeout=(5, 5))
+
+    server.shutdown()
+    server.server_close()
+
+    assert first.text == second.text == "ok"
+    assert second.request.headers.get("Cookie") is None
+
+    assert ("http_session", {"connection": "new"}) in recorder.metrics
+    assert ("http_session_time", {"phase": "connect"}) in recorder.metrics
+    assert recorder.metrics[-2:] == [
+        ("http_session", {"connection": "reused"}),
+        ("http_session_time", {"phase": "read"}),
+    ]
+
+
+def test_get_session_ip_version(responses, monkeypatch):
+    responses.add_passthru("http://probe.example.com")
+    monkeypatch.setattr(sessions, "statsd", Recorder())
+    # the host only has an IPv4 address
+    monkeypatch.setattr(sessions, "resolve", lambda host, ip_version: ["127.0.0.1"] if ip_version == 4 else [])
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://probe.example.com:{server.server_address[1]}/"
+
+    try:
+        # the connection is made to the address, the host name is kept
+        response = get_session(4).get(url, timeout=(5, 5))
+        assert response.headers["X-Host"] == f"probe.example.com:{server.server_address[1]}"
+
+        with pytest.raises(requests.ConnectionError):
+            get_session(6).get(url, timeout=(5, 5))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_fetch_reuses_connections(responses, monkeypatch):
+    responses.add_passthru("http://127.0.0.1")
+    recorder = Recorder()
+    monkeypatch.setattr(sessions, "statsd", recorder)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+
+    try:
+        assert fetch(url, 4)["connected"] is True
+        assert fetch(url, 4)["connected"] is True
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    # the body of the first response was read, so its connection is used again
+    connections = [tags["connection"] for metric, tags in recorder.metrics if metric == "http_session"]
+    assert connections == ["new", "reused"]
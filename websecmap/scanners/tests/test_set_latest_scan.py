@@ -1,8 +1,8 @@
 from django.utils.timezone import now
 
 from websecmap.organizations.models import Url
-from websecmap.scanners.management.commands.set_latest_scan import reflag_endpointgenericscan
-from websecmap.scanners.models import EndpointGenericScan, Endpoint
+from websecmap.scanners.management.commands.set_latest_scan import rebuild_latest_scans, reflag_endpointgenericscan
+from websecmap.scanners.models import EndpointGenericScan, Endpoint, LatestEndpointScan, LatestUrlScan, UrlGenericScan
 
 
 def test_reflag_endpointgenericscan(db):
@@ -50,3 +50,25 @@ def test_reflag_endpointgenericscan(db):
     # highest ID is affected
     e3 = EndpointGenericScan.objects.get(id=othere2.pk)
     assert e3.is_the_latest_scan is True
+
+
+def test_rebuild_latest_scans(db):
+    u = Url.objects.create(url="basisbeveiliging.nl")
+    e = Endpoint.objects.create(protocol="https", port=443, ip_version=4, is_dead=False, url=u)
+
+    args = {"type": "tls_qualys", "last_scan_moment": now(), "endpoint": e, "rating_determined_on": now()}
+    EndpointGenericScan.objects.create(**args)
+    latest = EndpointGenericScan.objects.create(**args)
+    UrlGenericScan.objects.create(type="DNSSEC", last_scan_moment=now(), url=u, rating_determined_on=now())
+
+    reflag_endpointgenericscan("tls_qualys")
+    rebuild_latest_scans(EndpointGenericScan, LatestEndpointScan, "endpoint", "tls_qualys")
+    # running multiple times does not matter
+    rebuild_latest_scans(EndpointGenericScan, LatestEndpointScan, "endpoint", "tls_qualys")
+    # without flags there is nothing to point to
+    rebuild_latest_scans(UrlGenericScan, LatestUrlScan, "url", "DNSSEC")
+
+    assert list(LatestEndpointScan.objects.all().values_list("endpoint", "type", "scan")) == [
+        (e.pk, "tls_qualys", latest.pk)
+    ]
+    assert LatestUrlScan.objects.all().count() == 0
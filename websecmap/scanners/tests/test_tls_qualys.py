@@ -1,5 +1,10 @@
+import asyncio
+
+import responses as mocked_responses
+
 from websecmap.scanners.models import Endpoint, EndpointGenericScan
-from websecmap.scanners.scanner.tls_qualys import save_scan
+from websecmap.scanners.scanner import tls_qualys
+from websecmap.scanners.scanner.tls_qualys import QualysPool, error_message, poll_interval, save_scan
 from websecmap.scanners.tests.test_plannedscan import create_url
 
 
@@ -68,3 +73,139 @@ def test_qualys_save_data(db):
         scan_results.append(scan.rating)
 
     assert sorted(scan_results) == sorted(["B", "trusted", "scan_error", "scan_error"])
+
+
+class Recorder:
+    def __init__(self):
+        self.calls = []
+
+    def apply_async(self, args):
+        self.calls.append(args)
+
+
+def test_qualys_pool(monkeypatch):
+    for interval in ["NEW_ASSESSMENT_COOL_OFF", "POLL_INTERVAL", "MIN_POLL_INTERVAL", "ERROR_INTERVAL"]:
+        monkeypatch.setattr(tls_qualys, interval, 0)
+    scratched, processed = Recorder(), Recorder()
+    monkeypatch.setattr(tls_qualys, "scratch", scratched)
+    monkeypatch.setattr(tls_qualys, "process_qualys_result", processed)
+
+    polls = {}
+    running = set()
+    most_running = []
+
+    def service_provider_scan_via_api_with_limits(proxy, domain):
+        polls[domain] = polls.get(domain, 0) + 1
+        running.add(domain)
+        most_running.append(len(running))
+
+        if domain == "full.example.com" and polls[domain] == 1:
+            data = {"errors": [{"message": "Running at full capacity. Please try again later."}], "status": "FAILURE"}
+            running.remove(domain)
+        elif polls[domain] < 4:
+            status = "DNS" if polls[domain] == 1 else "IN_PROGRESS"
+            data = {"status": status, "endpoints": [{"ipAddress": "192.0.2.1", "statusMessage": "In progress"}]}
+        else:
+            data = {"status": "READY", "endpoints": [{"ipAddress": "192.0.2.1", "statusMessage": "Ready"}]}
+            running.remove(domain)
+
+        # this client can run two assessments
+        return {"max": 25, "current": len(running), "this-client-max": 2, "data": data}
+
+    monkeypatch.setattr(
+        tls_qualys, "service_provider_scan_via_api_with_limits", service_provider_scan_via_api_with_limits
+    )
+
+    urls = ["a.example.com", "b.example.com", "c.example.com", "full.example.com"]
+    asyncio.run(QualysPool({"id": 1}).run(urls))
+
+    assert max(most_running) <= 2
+    assert sorted(url for data, url in processed.calls) == sorted(urls)
+    # the assessment that could not start is started again
+    assert polls["full.example.com"] == 4
+
+    # only changes are stored: dns, in progress and ready, but not the second poll that is in progress
+    assert [data["status"] for url, data in scratched.calls if url == "a.example.com"] == [
+        "DNS",
+        "IN_PROGRESS",
+        "READY",
+    ]
+
+
+def test_qualys_pool_at_capacity(monkeypatch):
+    """Every assessment is refused while the API reports that it is full. The pool keeps asking the API."""
+    for interval in ["NEW_ASSESSMENT_COOL_OFF", "ERROR_INTERVAL"]:
+        monkeypatch.setattr(tls_qualys, interval, 0)
+    processed = Recorder()
+    monkeypatch.setattr(tls_qualys, "scratch", Recorder())
+    monkeypatch.setattr(tls_qualys, "process_qualys_result", processed)
+
+    polls = []
+
+    def service_provider_scan_via_api_with_limits(proxy, domain):
+        polls.append(domain)
+        if len(polls) <= 30:
+            data = {"errors": [{"message": "Concurrent assessment limit reached (25/25)"}], "status": "FAILURE"}
+            return {"max": 25, "current": 25, "this-client-max": 25, "data": data}
+        return {"max": 25, "current": 0, "this-client-max": 25, "data": {"status": "READY", "endpoints": []}}
+
+    monkeypatch.setattr(
+        tls_qualys, "service_provider_scan_via_api_with_limits", service_provider_scan_via_api_with_limits
+    )
+
+    urls = [f"{number}.example.com" for number in range(24)]
+    pool = QualysPool({"id": 1})
+    asyncio.run(asyncio.wait_for(pool.run(urls), timeout=30))
+
+    assert sorted(url for data, url in processed.calls) == sorted(urls)
+    assert pool.running == 0
+
+
+def test_qualys_pool_unexpected_responses(monkeypatch, responses):
+    for interval in ["NEW_ASSESSMENT_COOL_OFF", "ERROR_INTERVAL"]:
+        monkeypatch.setattr(tls_qualys, interval, 0)
+    scratched, processed = Recorder(), Recorder()
+    monkeypatch.setattr(tls_qualys, "scratch", scratched)
+    monkeypatch.setattr(tls_qualys, "process_qualys_result", processed)
+
+    analyze = "https://api.ssllabs.com/api/v2/analyze"
+    # an error page of a proxy, errors without a message and then the result
+    responses.add(mocked_responses.GET, analyze, body="<html>Bad Gateway</html>", status=502)
+    responses.add(mocked_responses.GET, analyze, json={"errors": [{}], "status": "FAILURE"})
+    responses.add(mocked_responses.GET, analyze, json={"status": "READY", "endpoints": []})
+
+    pool = QualysPool({"id": 1, "protocol": "https", "address": "https://192.0.2.1:1337"})
+    asyncio.run(pool.run(["example.com"]))
+
+    assert processed.calls == [[{"status": "READY", "endpoints": []}, "example.com"]]
+    assert pool.network_errors == 0
+    assert pool.running == 0
+
+    # an unexpected error in one assessment does not stop the others
+    report_to_console = tls_qualys.report_to_console
+
+    def crash(url, data):
+        if url == "crash.example.com":
+            raise KeyError("status")
+        report_to_console(url, data)
+
+    monkeypatch.setattr(tls_qualys, "report_to_console", crash)
+    processed.calls = []
+    asyncio.run(pool.run(["crash.example.com", "example.com"]))
+    assert [url for data, url in processed.calls] == ["example.com"]
+    assert pool.running == 0
+
+
+def test_error_message():
+    assert error_message({"errors": [{"message": "Running at full capacity."}]}) == "Running at full capacity."
+    assert error_message({"errors": [{}]}) == ""
+    assert error_message({"errors": []}) == ""
+    assert error_message({"errors": ["Running at full capacity."]}) == ""
+
+
+def test_poll_interval():
+    assert poll_interval({"status": "DNS"}) == tls_qualys.POLL_INTERVAL
+    assert poll_interval({"endpoints": [{"eta": -1}]}) == tls_qualys.POLL_INTERVAL
+    assert poll_interval({"endpoints": [{"eta": 2}, {"eta": 45}]}) == 45
+    assert poll_interval({"endpoints": [{"eta": 2}]}) == tls_qualys.MIN_POLL_INTERVAL
+    assert poll_interval({"endpoints": [{"eta": 4000}]}) == tls_qualys.MAX_POLL_INTERVAL
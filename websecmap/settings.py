@@ -556,6 +556,11 @@ occurs. So probably connection limits are the issue.
 """
 CELERY_BROKER_POOL_LIMIT = 30
 
+# Redis url of the buffer for finished planned scans, for example the broker: "redis://localhost:6379/0".
+# Finished scans are then written to the database in batches, instead of with a query per scan.
+# See websecmap.scanners.plannedscan.finish. Without a buffer finished scans are written directly.
+PLANNED_SCAN_FINISH_BUFFER = os.environ.get("PLANNED_SCAN_FINISH_BUFFER", "")
+
 #
 # End of celery settings
 #####
@@ -643,6 +648,29 @@ SENTRY_PROJECT_URL = "https://sentry.io/%s/%s" % (SENTRY_ORGANIZATION, SENTRY_PR
 NETWORK_SUPPORTS_IPV4 = os.environ.get("NETWORK_SUPPORTS_IPV4", True)
 NETWORK_SUPPORTS_IPV6 = os.environ.get("NETWORK_SUPPORTS_IPV6", False)
 
+# The amount of connections the http scanner makes at the same time when discovering endpoints, per worker process.
+HTTP_DISCOVERY_CONCURRENCY = int(os.environ.get("HTTP_DISCOVERY_CONCURRENCY", 100))
+
+# A and AAAA lookups of scanners are cached per worker process, with at most this many hostnames.
+# Set a redis url, for example "redis://localhost:6379/1", to share lookups between workers.
+# See websecmap.scanners.resolver.
+DNS_CACHE_SIZE = int(os.environ.get("DNS_CACHE_SIZE", 10000))
+DNS_CACHE_REDIS = os.environ.get("DNS_CACHE_REDIS", "")
+
+# The outcome of fetching an endpoint is shared by the security headers, plain http and http verify scanners. Set a
+# redis url to share these outcomes between workers. See websecmap.scanners.scanner.http.probe_uri.
+HTTP_PROBE_CACHE = os.environ.get("HTTP_PROBE_CACHE", "")
+
+# The http based scanners share a session per worker process, which keeps connections alive. The session keeps
+# connections to at most this many hosts, and makes at most this many connections to a host at the same time.
+# See websecmap.scanners.sessions.
+HTTP_SESSION_POOLS = int(os.environ.get("HTTP_SESSION_POOLS", 100))
+HTTP_SESSION_HOST_CONNECTIONS = int(os.environ.get("HTTP_SESSION_HOST_CONNECTIONS", 10))
+
+# Scanners limit the amount of scans per network and service they use, see websecmap.scanners.ratelimit. Set a redis
+# url to share these limits between all workers. Otherwise every worker process applies the limits on its own.
+SCANNER_RATE_LIMIT_REDIS = os.environ.get("SCANNER_RATE_LIMIT_REDIS", "")
+
 # atomic imports: fail completely, not half
 IMPORT_EXPORT_USE_TRANSACTIONS = True
 